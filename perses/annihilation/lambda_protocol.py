@@ -3,6 +3,8 @@ import numpy as np
 import logging
 import copy
 import traceback
+import inspect
+from collections import OrderedDict
 from openmmtools.alchemy import AlchemicalState
 
 logging.basicConfig(level=logging.NOTSET)
@@ -10,6 +12,35 @@ _logger = logging.getLogger("lambda_protocol")
 _logger.setLevel(logging.DEBUG)
 
 
+class PiecewiseLinearFunction(object):
+    """A lambda function given as a table of nodes, linearly interpolated between the nodes.
+
+    Unlike python functions, such functions are tabulated exactly on their own nodes (rather than on the
+    compilation grid of the LambdaProtocol), so they can always be evaluated without calling back into python
+    and expressed algebraically with `LambdaProtocol.to_expressions`.
+    """
+
+    def __init__(self, nodes, values):
+        """
+        Parameters
+        ----------
+        nodes : array-like of float
+            strictly increasing global lambdas, from 0 to 1
+        values : array-like of float
+            the value of the function at each node
+        """
+        self.nodes = np.array(nodes, dtype=np.float64)
+        self.values = np.array(values, dtype=np.float64)
+        assert self.nodes.ndim == 1 and self.nodes.shape == self.values.shape, f"there must be one value per node"
+        assert self.nodes[0] == 0. and self.nodes[-1] == 1., f"the nodes must run from 0 to 1"
+        assert np.all(np.diff(self.nodes) > 0.), f"the nodes must be strictly increasing"
+        for array in [self.nodes, self.values]:
+            array.setflags(write=False)
+
+    def __call__(self, x):
+        return float(np.interp(x, self.nodes, self.values))
+
+
 class LambdaProtocol(object):
     """Protocols for perturbing each of the compent energy terms in alchemical
     free energy simulations.
@@ -35,9 +66,17 @@ class LambdaProtocol(object):
                          lambda x: x
                          }
 
+    # number of points of the global lambda grid on which the protocol is compiled;
+    # the grid contains every multiple of 1/12, so the breakpoints of the predefined protocols are nodes
+    default_compilation_points = 1201
+
+    # validated and compiled protocols of this process, keyed by protocol fingerprint, in least-recently-used order
+    _compiled_protocols = OrderedDict()
+    max_compiled_protocols = 128
+
     # lambda components for each component,
     # all run from 0 -> 1 following master lambda
-    def __init__(self, functions='default'):
+    def __init__(self, functions='default', compilation_points=None):
         """Instantiates lambda protocol to be used in a free energy calculation.
         Can either be user defined, by passing in a dict, or using one
         of the pregenerated sets by passing in a string 'default', 'namd' or 'quarters'
@@ -50,6 +89,9 @@ class LambdaProtocol(object):
         type : str or dict, default='default'
             one of the predefined lambda protocols ['default','namd','quarters']
             or a dictionary
+        compilation_points : int, default None
+            number of evenly spaced global lambda points on which the protocol is tabulated;
+            if None, `LambdaProtocol.default_compilation_points` is used
 
         Returns
         -------
@@ -109,23 +151,101 @@ class LambdaProtocol(object):
                                   functions to default. """)
                 self.functions = LambdaProtocol.default_functions
 
-        self._validate_functions()
-        self._check_for_naked_charges()
+        self._add_missing_functions()
+        if compilation_points is None:
+            compilation_points = LambdaProtocol.default_compilation_points
 
-    def _validate_functions(self,n=10):
-        """Ensures that all the lambda functions adhere to the rules:
-            - must begin at 0.
-            - must finish at 1.
-            - must be monotonically increasing
+        # validation and compilation are conducted once per distinct protocol in a process
+        self.fingerprint = self._compute_fingerprint(compilation_points)
+        if self.fingerprint is not None and self.fingerprint in LambdaProtocol._compiled_protocols:
+            LambdaProtocol._compiled_protocols.move_to_end(self.fingerprint)
+            self._parameter_names, self._grid, self._table, self._tabulated, self._nodes = LambdaProtocol._compiled_protocols[self.fingerprint]
+            self._parameter_names, self._nodes = list(self._parameter_names), list(self._nodes)
+        else:
+            self.compile(n=compilation_points)
+            self._validate_functions()
+            self._check_for_naked_charges()
+            if self.fingerprint is not None:
+                for array in [self._grid, self._table, self._tabulated]:
+                    array.setflags(write=False)
+                LambdaProtocol._compiled_protocols[self.fingerprint] = (tuple(self._parameter_names), self._grid, self._table, self._tabulated, tuple(self._nodes))
+                while len(LambdaProtocol._compiled_protocols) > LambdaProtocol.max_compiled_protocols:
+                    LambdaProtocol._compiled_protocols.popitem(last=False)
+
+    @staticmethod
+    def _is_immutable_primitive(value):
+        """Whether a value is a number, str, bool, None or a tuple of these, i.e. whether it can be part of a fingerprint
+        without the risk that its state changes while its hash does not."""
+        if isinstance(value, tuple):
+            return all(LambdaProtocol._is_immutable_primitive(item) for item in value)
+        return value is None or isinstance(value, (bool, int, float, complex, str))
+
+    @staticmethod
+    def _function_fingerprint(function):
+        """Fingerprint of a python function from its code, constants, defaults, closure and the current values
+        of the globals it refers to (or of a PiecewiseLinearFunction from its nodes and values).
+        Bound methods, and functions whose defaults, closure or globals hold anything but immutable primitives
+        (numbers, strings, bools, None and tuples of these), cannot be fingerprinted, since their state can change.
 
         Parameters
         ----------
-        n : int, default 10
-            number of grid points used to check monotonicity
+        function : callable
+            the lambda function
 
         Returns
         -------
+        fingerprint : tuple or None
+            a hashable fingerprint, or None if the callable cannot be fingerprinted
         """
+        if isinstance(function, PiecewiseLinearFunction):
+            return ('piecewise_linear', function.nodes.tobytes(), function.values.tobytes())
+        if inspect.ismethod(function):
+            return None
+        try:
+            code = function.__code__
+            closure = tuple(cell.cell_contents for cell in function.__closure__) if function.__closure__ else ()
+            global_values = tuple((name, function.__globals__.get(name)) for name in code.co_names)
+            kwdefaults = tuple(sorted(function.__kwdefaults__.items())) if function.__kwdefaults__ else ()
+        except (AttributeError, TypeError, ValueError):
+            return None
+        if not all(LambdaProtocol._is_immutable_primitive(values) for values in [function.__defaults__, kwdefaults, closure, global_values]):
+            return None
+        return (code.co_code, code.co_consts, code.co_names, function.__defaults__, kwdefaults, closure, global_values)
+
+    def _compute_fingerprint(self, n):
+        """Fingerprint of the protocol (all functions and the compilation grid), used to memoize validation
+        and compilation within a process.  None if any of the functions cannot be fingerprinted.
+
+        Parameters
+        ----------
+        n : int
+            number of compilation grid points
+        """
+        fingerprints = []
+        for name in sorted(self.functions.keys()):
+            function_fingerprint = LambdaProtocol._function_fingerprint(self.functions[name])
+            if function_fingerprint is None:
+                return None
+            fingerprints.append((name, function_fingerprint))
+        return (n, tuple(fingerprints))
+
+    @staticmethod
+    def _lambda_ranges(mask, global_lambda):
+        """Format the contiguous ranges of global lambda where `mask` is True, e.g. '[0.25, 0.5], [0.75, 0.8]'.
+
+        Parameters
+        ----------
+        mask : np.ndarray of bool
+            the flagged points
+        global_lambda : np.ndarray of float
+            the (sorted) global lambda of each point
+        """
+        edges = np.diff(np.concatenate([[0], mask.astype(int), [0]]))
+        starts, ends = np.where(edges == 1)[0], np.where(edges == -1)[0] - 1
+        return ', '.join(f"[{global_lambda[start]:.4g}, {global_lambda[end]:.4g}]" for start, end in zip(starts, ends))
+
+    def _add_missing_functions(self):
+        """Adds the functions of `default_functions` that are missing from `functions`."""
         # the individual lambda functions that must be defined for
         required_functions = list(LambdaProtocol.default_functions.keys())
 
@@ -134,45 +254,236 @@ class LambdaProtocol(object):
                 _logger.warning(f'function {function} is missing from lambda_functions')
                 _logger.warning(f'adding default {function} from LambdaProtocol.default_functions')
                 self.functions[function] = LambdaProtocol.default_functions[function]
+
+    def _validation_points(self, n):
+        """The global lambdas at which the protocol is validated: the compilation grid and `n` evenly spaced points."""
+        return np.union1d(self._grid, np.linspace(0., 1., n))
+
+    def _validate_functions(self,n=10):
+        """Ensures that all the lambda functions adhere to the rules:
+            - must begin at 0.
+            - must finish at 1.
+            - must be monotonically increasing
+
+        The protocol must be compiled; monotonicity is checked (vectorized) on the compilation grid.
+
+        Parameters
+        ----------
+        n : int, default 10
+            number of additional evenly spaced grid points used to check monotonicity
+
+        Returns
+        -------
+        """
+        for function in LambdaProtocol.default_functions.keys():
             # assert that the function starts and ends at 0 and 1 respectively
             assert (self.functions[function](0.) == 0.
-                    ), 'lambda functions must start at 0'
+                    ), f'lambda functions must start at 0 ({function} starts at {self.functions[function](0.)})'
             assert (self.functions[function](1.) == 1.
-                    ), 'lambda functions must end at 1'
-
-            # now validatate that it's monotonic
-            global_lambda = np.linspace(0., 1., n)
-            sub_lambda = [self.functions[function](l) for l in global_lambda]
-            difference = np.diff(sub_lambda)
-            if all(i >= 0. for i in difference) == False:
-                _logger.warning(f'The function {function} is not monotonic as typically expected.')
-                _logger.warning('Simulating with non-monotonic function anyway')
+                    ), f'lambda functions must end at 1 ({function} ends at {self.functions[function](1.)})'
+
+        # now validatate that it's monotonic
+        global_lambda = self._validation_points(n)
+        values = self.evaluate(global_lambda)
+        decreasing = np.diff(values, axis=0) < 0.
+        for index in np.where(decreasing.any(axis=0))[0]:
+            _logger.warning(f'The function {self._parameter_names[index]} is not monotonic as typically expected; '
+                            f'it decreases over lambda {LambdaProtocol._lambda_ranges(decreasing[:, index], global_lambda[1:])}')
+            _logger.warning('Simulating with non-monotonic function anyway')
         return
 
     def _check_for_naked_charges(self,n=10):
-        global_lambda = np.linspace(0., 1., n)
+        """Ensures that no unique atom carries charge while its sterics are off:
+            - unique new atoms may only be charged once their sterics are (partially) on
+            - unique old atoms may only be (partially) discharged before their sterics start turning off
 
-        # checking unique new terms first
-        ele = 'lambda_electrostatics_insert'
-        sterics = 'lambda_sterics_insert'
-        for l in global_lambda:
-            e_val = self.functions[ele](l)
-            s_val = self.functions[sterics](l)
-            if e_val != 0.:
-                assert (s_val != 0.)
+        The protocol must be compiled; the check is vectorized over the compilation grid.
 
+        Parameters
+        ----------
+        n : int, default 10
+            number of additional evenly spaced grid points at which to check
+
+        Raises
+        ------
+        AssertionError
+            listing the ranges of global lambda with naked charges
+        """
+        global_lambda = self._validation_points(n)
+        values = self.evaluate(global_lambda)
+        column = {name: index for index, name in enumerate(self._parameter_names)}
+
+        # checking unique new terms first
+        naked_new = (values[:, column['lambda_electrostatics_insert']] != 0.) & (values[:, column['lambda_sterics_insert']] == 0.)
         # checking unique old terms now
-        ele = 'lambda_electrostatics_delete'
-        sterics = 'lambda_sterics_delete'
-        for l in global_lambda:
-            e_val = self.functions[ele](l)
-            s_val = self.functions[sterics](l)
-            if e_val != 1.:
-                assert (s_val != 1.)
+        naked_old = (values[:, column['lambda_electrostatics_delete']] != 1.) & (values[:, column['lambda_sterics_delete']] == 1.)
+
+        errors = []
+        if naked_new.any():
+            errors.append(f"unique new atoms are charged with their sterics off at lambda {LambdaProtocol._lambda_ranges(naked_new, global_lambda)}")
+        if naked_old.any():
+            errors.append(f"unique old atoms are charged with their sterics off at lambda {LambdaProtocol._lambda_ranges(naked_old, global_lambda)}")
+        assert len(errors) == 0, f"the lambda protocol produces naked charges: {'; '.join(errors)}"
 
     def get_functions(self):
         return self.functions
 
+    @property
+    def parameter_names(self):
+        """list of str : the alchemical parameter names, in the column order returned by `evaluate`"""
+        return list(self._parameter_names)
+
+    def compile(self, n=None):
+        """Tabulate every lambda function on a grid of global lambda so that the protocol
+        can be evaluated for arrays of lambdas without calling back into python.
+
+        Functions that are piecewise linear with their breakpoints on the grid (as are all the
+        predefined protocols) are reproduced exactly by linear interpolation of the table; this
+        is checked at the midpoint of every grid interval.  Functions that fail the check are
+        evaluated directly by `evaluate`.  PiecewiseLinearFunctions are interpolated on their own nodes.
+
+        Parameters
+        ----------
+        n : int, default None
+            number of grid points; if None, `LambdaProtocol.default_compilation_points` is used
+        """
+        if n is None:
+            n = LambdaProtocol.default_compilation_points
+        assert n >= 2, f"a compiled protocol requires at least 2 grid points; got {n}"
+        self._parameter_names = list(self.functions.keys())
+        self._grid = np.linspace(0., 1., n)
+        midpoints = 0.5 * (self._grid[1:] + self._grid[:-1])
+
+        self._table = np.zeros((n, len(self._parameter_names)))
+        self._tabulated = np.zeros(len(self._parameter_names), dtype=bool)
+        self._nodes = [None] * len(self._parameter_names)
+        for index, name in enumerate(self._parameter_names):
+            function = self.functions[name]
+            if isinstance(function, PiecewiseLinearFunction):
+                self._nodes[index] = (function.nodes, function.values)
+                self._table[:, index] = np.interp(self._grid, function.nodes, function.values)
+                self._tabulated[index] = True
+                continue
+            self._table[:, index] = [function(l) for l in self._grid]
+            exact_midpoints = np.array([function(l) for l in midpoints])
+            interpolated_midpoints = np.interp(midpoints, self._grid, self._table[:, index])
+            self._tabulated[index] = np.allclose(exact_midpoints, interpolated_midpoints, rtol=0., atol=1e-12)
+            if not self._tabulated[index]:
+                _logger.debug(f"{name} is not piecewise linear on the compilation grid; it will be evaluated directly")
+
+    def evaluate(self, global_lambdas):
+        """Evaluate all alchemical parameters at one or more values of global lambda.
+
+        Parameters
+        ----------
+        global_lambdas : float or array-like of float
+            global lambda value(s) in [0, 1]
+
+        Returns
+        -------
+        values : np.ndarray of shape (n_lambdas, n_parameters)
+            values[i, j] is the value of `parameter_names[j]` at `global_lambdas[i]`
+        """
+        global_lambdas = np.atleast_1d(np.asarray(global_lambdas, dtype=np.float64))
+        assert global_lambdas.ndim == 1, f"global_lambdas must be a scalar or a one-dimensional array"
+        values = np.zeros((len(global_lambdas), len(self._parameter_names)))
+        for index, name in enumerate(self._parameter_names):
+            if self._nodes[index] is not None:
+                values[:, index] = np.interp(global_lambdas, *self._nodes[index])
+            elif self._tabulated[index]:
+                values[:, index] = np.interp(global_lambdas, self._grid, self._table[:, index])
+            else:
+                values[:, index] = [self.functions[name](l) for l in global_lambdas]
+        return values
+
+    def to_expressions(self, variable='lambda', max_breakpoints=32, tolerance=1e-9):
+        """Express each (piecewise linear) lambda function as an algebraic expression of `variable`
+        that can be evaluated by OpenMM, e.g. as the `alchemical_functions` of a nonequilibrium integrator.
+
+        A function with slope s0 on its first segment and slope changes ds_k at breakpoints x_k is written as
+        ``f(0) + s0*variable + sum_k ds_k*max(0, variable - x_k)``.
+
+        Parameters
+        ----------
+        variable : str, default 'lambda'
+            the name of the global lambda variable in the expressions
+        max_breakpoints : int, default 32
+            maximum number of breakpoints per function
+        tolerance : float, default 1e-9
+            slope changes smaller than this are not treated as breakpoints
+
+        Returns
+        -------
+        expressions : dict of str: str
+            the expression of each alchemical parameter
+
+        Raises
+        ------
+        ValueError
+            if a function is not piecewise linear on the compilation grid or has more than `max_breakpoints` breakpoints
+        """
+        expressions = {}
+        for index, name in enumerate(self._parameter_names):
+            if not self._tabulated[index]:
+                raise ValueError(f"{name} is not piecewise linear on the compilation grid and cannot be expressed algebraically")
+            function = self.functions[name]
+            grid, table = self._grid, self._table[:, index]
+            if self._nodes[index] is not None:
+                grid, table = self._nodes[index]
+            slopes = np.diff(table) / np.diff(grid)
+            breakpoint_indices = np.where(np.abs(np.diff(slopes)) > tolerance)[0] + 1
+            if len(breakpoint_indices) > max_breakpoints:
+                raise ValueError(f"{name} has {len(breakpoint_indices)} breakpoints; at most {max_breakpoints} are supported")
+
+            # recompute the slope of every linear segment from the function values at its ends
+            nodes = np.concatenate([[0.], grid[breakpoint_indices], [1.]])
+            node_values = np.array([function(node) for node in nodes])
+            segment_slopes = np.diff(node_values) / np.diff(nodes)
+
+            terms = [f"{node_values[0]:.17g}", f"{segment_slopes[0]:.17g}*{variable}"]
+            for breakpoint, slope_change in zip(nodes[1:-1], np.diff(segment_slopes)):
+                terms.append(f"{slope_change:.17g}*max(0, {variable} - {breakpoint:.17g})")
+            expressions[name] = ' + '.join(terms)
+        return expressions
+
+    def schedule_table(self, global_lambdas):
+        """Precompute the alchemical parameters along a switching schedule, along with
+        a mask of the parameters that change at each step.
+
+        Parameters
+        ----------
+        global_lambdas : array-like of float
+            the global lambda at each step of the schedule
+
+        Returns
+        -------
+        values : np.ndarray of shape (n_steps, n_parameters)
+            values[i, j] is the value of `parameter_names[j]` at step i
+        changes : np.ndarray of bool, shape (n_steps, n_parameters)
+            changes[i, j] is True if `parameter_names[j]` differs between steps i-1 and i;
+            every parameter is flagged as changed at the first step
+        """
+        values = self.evaluate(global_lambdas)
+        changes = np.ones(values.shape, dtype=bool)
+        changes[1:] = values[1:] != values[:-1]
+        return values, changes
+
+    def evaluate_dict(self, global_lambda):
+        """Evaluate all alchemical parameters at a single value of global lambda.
+
+        Parameters
+        ----------
+        global_lambda : float
+            global lambda value in [0, 1]
+
+        Returns
+        -------
+        values : dict of str: float
+            the value of each alchemical parameter
+        """
+        row = self.evaluate(global_lambda)[0]
+        return {name: float(value) for name, value in zip(self._parameter_names, row)}
+
     def plot_fucntions(self,n=50):
         import matplotlib.pyplot as plt
         fig = plt.figure(figsize=(10,5))
@@ -187,6 +498,164 @@ class LambdaProtocol(object):
         plt.show()
 
 
+class ThermodynamicLengthOptimizer(object):
+    """
+    Builds a lambda protocol that traverses the alchemical path at constant thermodynamic speed.
+
+    The thermodynamic length of each interval of a pilot lambda schedule is estimated from the standard deviation of the
+    reduced incremental work accumulated over that interval (for small intervals, std(w) ~ dlambda * std(dU/dlambda)).
+    Per-component estimates (e.g. from pilot runs that perturb one alchemical component at a time) are combined by summing
+    their variances, neglecting cross-correlations.  Spacing the protocol so that every step covers the same thermodynamic
+    length equalizes the dissipation per step, which minimizes the total dissipated work for a fixed number of steps.
+
+    The alchemical components are reparameterized jointly (through the global lambda) rather than individually,
+    so that the ordering constraints of the base protocol (e.g. no naked charges) are preserved.
+    """
+
+    def __init__(self, pilot_lambdas, work_variances, lambda_protocol=None, min_length_fraction=1e-2):
+        """
+        Parameters
+        ----------
+        pilot_lambdas : array-like of float
+            the global lambdas of the pilot schedule; must run from 0 to 1 (or from 1 to 0)
+        work_variances : np.ndarray of shape (n_intervals,) or (n_intervals, n_components)
+            the variance of the reduced incremental work accumulated over each pilot interval (per component, if 2D)
+        lambda_protocol : LambdaProtocol, default None
+            the protocol that was used for the pilot runs; if None, the default LambdaProtocol is used
+        min_length_fraction : float, default 1e-2
+            the length of each interval is bounded below by this fraction of the mean interval length so that
+            intervals with vanishing work variance still receive a (small) share of the steps
+        """
+        pilot_lambdas = np.asarray(pilot_lambdas, dtype=np.float64)
+        work_variances = np.asarray(work_variances, dtype=np.float64)
+        if work_variances.ndim == 1:
+            work_variances = work_variances[:, np.newaxis]
+        assert work_variances.ndim == 2, f"work_variances must be of shape (n_intervals,) or (n_intervals, n_components)"
+        assert len(pilot_lambdas) == work_variances.shape[0] + 1, f"there must be one work variance per pilot lambda interval"
+        assert np.all(np.isfinite(work_variances)) and np.all(work_variances >= 0.), f"work variances must be finite and non-negative"
+
+        # orient the pilot schedule from 0 to 1
+        if pilot_lambdas[0] > pilot_lambdas[-1]:
+            pilot_lambdas, work_variances = pilot_lambdas[::-1], work_variances[::-1]
+        assert pilot_lambdas[0] == 0. and pilot_lambdas[-1] == 1., f"the pilot schedule must run between 0 and 1"
+        assert np.all(np.diff(pilot_lambdas) > 0.), f"the pilot schedule must be strictly monotonic"
+
+        self.lambda_protocol = lambda_protocol if lambda_protocol is not None else LambdaProtocol()
+        self.pilot_lambdas = pilot_lambdas
+        self.component_lengths = np.sqrt(work_variances).sum(axis=0)
+
+        interval_lengths = np.sqrt(work_variances.sum(axis=1))
+        self.thermodynamic_length = interval_lengths.sum()
+        if self.thermodynamic_length == 0.:
+            _logger.warning(f"the pilot work variances are all zero; the optimal protocol is the pilot schedule")
+            interval_lengths = np.diff(pilot_lambdas)
+        else:
+            interval_lengths = np.maximum(interval_lengths, min_length_fraction * interval_lengths.mean())
+
+        # normalized cumulative thermodynamic length at each pilot lambda
+        self._progress = np.concatenate([[0.], np.cumsum(interval_lengths)])
+        self._progress /= self._progress[-1]
+        self._progress[-1] = 1.
+
+    @classmethod
+    def from_incremental_works(cls, pilot_lambdas, incremental_works, lambda_protocol=None, **kwargs):
+        """
+        Estimate the thermodynamic length from the incremental works of a pilot nonequilibrium (AIS) run.
+
+        Parameters
+        ----------
+        pilot_lambdas : array-like of float
+            the global lambdas of the pilot schedule
+        incremental_works : np.ndarray of shape (n_particles, n_intervals) or dict of str: np.ndarray
+            the reduced incremental works of the pilot particles; a dict maps component names to the incremental
+            works of per-component pilot runs
+        lambda_protocol : LambdaProtocol, default None
+            the protocol that was used for the pilot runs
+
+        Returns
+        -------
+        optimizer : ThermodynamicLengthOptimizer
+        """
+        if type(incremental_works) == dict:
+            work_variances = np.array([np.var(np.asarray(works), axis=0, ddof=1) for works in incremental_works.values()]).T
+        else:
+            work_variances = np.var(np.asarray(incremental_works), axis=0, ddof=1)
+        return cls(pilot_lambdas, work_variances, lambda_protocol=lambda_protocol, **kwargs)
+
+    def pilot_lambda(self, progress):
+        """
+        Map fractions of the total thermodynamic length onto global lambdas of the pilot protocol.
+
+        Parameters
+        ----------
+        progress : float or np.ndarray of float
+            fraction(s) of the thermodynamic length in [0, 1]
+
+        Returns
+        -------
+        global_lambda : float or np.ndarray of float
+        """
+        return np.interp(progress, self._progress, self.pilot_lambdas)
+
+    def optimal_lambdas(self, num_steps, direction='forward'):
+        """
+        The nonequilibrium schedule of `num_steps` steps (in the global lambda of the pilot protocol)
+        in which every step covers the same thermodynamic length.
+
+        Parameters
+        ----------
+        num_steps : int
+            number of lambda increments
+        direction : str, default 'forward'
+            'forward' (0 -> 1) or 'reverse' (1 -> 0)
+
+        Returns
+        -------
+        lambdas : np.ndarray of shape (num_steps + 1,)
+        """
+        assert direction in ['forward', 'reverse'], f"direction {direction} is not an appropriate direction"
+        lambdas = self.pilot_lambda(np.linspace(0., 1., num_steps + 1))
+        lambdas[0], lambdas[-1] = 0., 1.
+        return lambdas if direction == 'forward' else lambdas[::-1].copy()
+
+    def optimal_protocol(self, compilation_points=None):
+        """
+        A LambdaProtocol whose global lambda advances at constant thermodynamic speed, so that
+        a uniformly spaced nonequilibrium schedule equalizes the dissipation per step.
+
+        Every function of the pilot protocol is composed with the (piecewise linear) map from thermodynamic length to
+        pilot lambda and emitted as a PiecewiseLinearFunction, whose nodes are the pilot lambdas and the breakpoints of
+        the pilot function (mapped to thermodynamic length).  The composition is exact if the pilot function is piecewise linear
+        on its compilation grid; otherwise, it is linearly interpolated between the grid points.
+
+        Parameters
+        ----------
+        compilation_points : int, default None
+            passed to the LambdaProtocol
+
+        Returns
+        -------
+        lambda_protocol : LambdaProtocol
+        """
+        base = self.lambda_protocol
+        values = base.evaluate(base._grid)
+        functions = {}
+        for index, name in enumerate(base.parameter_names):
+            if base._nodes[index] is not None:
+                base_nodes = base._nodes[index][0]
+            elif base._tabulated[index]:
+                slopes = np.diff(values[:, index]) / np.diff(base._grid)
+                base_nodes = base._grid[np.where(np.abs(np.diff(slopes)) > 1e-9)[0] + 1]
+            else:
+                base_nodes = base._grid
+            # the nodes (in thermodynamic length) of the composition
+            nodes = np.union1d(self._progress, np.interp(base_nodes, self.pilot_lambdas, self._progress))
+            nodes = nodes[(nodes >= 0.) & (nodes <= 1.)]
+            node_values = base.evaluate(self.pilot_lambda(nodes))[:, index]
+            functions[name] = PiecewiseLinearFunction(nodes, node_values)
+        return LambdaProtocol(functions=functions, compilation_points=compilation_points)
+
+
 class RelativeAlchemicalState(AlchemicalState):
     """
     Relative AlchemicalState to handle all lambda parameters required for relative perturbations
@@ -225,8 +694,9 @@ class RelativeAlchemicalState(AlchemicalState):
        ----------
        lambda_value : float
            The new value for all defined parameters.
+       lambda_protocol : LambdaProtocol, default LambdaProtocol()
+           the compiled protocol; pass a cached instance rather than instantiating one per call
        """
        self.global_lambda = global_lambda
-       for parameter_name in lambda_protocol.functions:
-           lambda_value = lambda_protocol.functions[parameter_name](global_lambda)
+       for parameter_name, lambda_value in lambda_protocol.evaluate_dict(global_lambda).items():
            setattr(self, parameter_name, lambda_value)
@@ -3,13 +3,15 @@ import numpy as np
 import copy
 import logging
 import traceback
+import mdtraj as md
+import pymbar
 from simtk import openmm, unit
 from perses.dispersed.feptasks import Particle, compute_reduced_potential
 from perses.storage import NetCDFStorageView
 from perses.annihilation.relative import HybridTopologyFactory
 from perses.tests.utils import quantity_is_finite
 from openmmtools.constants import kB
-from openmmtools.cache import LRUCache, global_context_cache
+from collections import OrderedDict
 from openmmtools.states import ThermodynamicState, SamplerState, CompoundThermodynamicState
 from perses.annihilation.lambda_protocol import RelativeAlchemicalState, LambdaProtocol
 
@@ -23,6 +25,300 @@ class NaNException(Exception):
     def __init__(self, *args, **kwargs):
         super(NaNException,self).__init__(*args,**kwargs)
 
+class SwitchingWorkStatistics(object):
+    """
+    Streaming statistics of the reduced switching works of one transformation (one direction).
+
+    The mean and variance are accumulated with Welford's algorithm and the exponential average
+    (the EXP free energy estimate) with a running, numerically stable log-sum-exp, so that no per-step
+    work arrays need to be transferred or kept.  The total works themselves (one float per switch) are
+    kept if `keep_works` is True so that BAR estimates can be computed with the reverse transformation.
+    """
+
+    def __init__(self, keep_works=True):
+        """
+        Parameters
+        ----------
+        keep_works : bool, default True
+            whether to keep the total work of every switch (required for BAR)
+        """
+        self.keep_works = keep_works
+        self._works = []
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._min_work = np.inf
+        self._sum_exp = 0.0
+
+    def update(self, work):
+        """
+        Add the total reduced work of a switch.
+
+        Parameters
+        ----------
+        work : float
+            the reduced work
+        """
+        self.n += 1
+        delta = work - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (work - self.mean)
+
+        # running sum of exp(-(w - min_work))
+        if work < self._min_work:
+            self._sum_exp = self._sum_exp * np.exp(work - self._min_work) + 1.0 if self.n > 1 else 1.0
+            self._min_work = work
+        else:
+            self._sum_exp += np.exp(-(work - self._min_work))
+
+        if self.keep_works:
+            self._works.append(work)
+
+    @property
+    def variance(self):
+        """float : the sample variance of the works"""
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def free_energy_EXP(self):
+        """float : the (reduced) exponential averaging free energy estimate, -log <exp(-w)>"""
+        if self.n == 0:
+            return np.nan
+        return self._min_work - np.log(self._sum_exp / self.n)
+
+    @property
+    def works(self):
+        """np.ndarray : the total works of the switches (empty if `keep_works` is False)"""
+        return np.array(self._works)
+
+    def summary(self):
+        """
+        Returns
+        -------
+        summary : dict
+            number of switches, mean, variance and standard error of the works, and the EXP estimate
+        """
+        return {'n': self.n,
+                'mean': self.mean,
+                'variance': self.variance,
+                'std_error': np.sqrt(self.variance / self.n) if self.n > 0 else np.nan,
+                'free_energy_EXP': self.free_energy_EXP}
+
+
+class HybridCacheEntry(object):
+    """
+    A cached hybrid topology factory together with its alchemical thermodynamic states and the
+    contexts used to evaluate endpoint energies and (optionally) to run integrator native switching.
+    """
+
+    def __init__(self, hybrid_factory, temperature, pressure=None):
+        """
+        Parameters
+        ----------
+        hybrid_factory : perses.annihilation.relative.HybridTopologyFactory
+            the factory of the hybrid system
+        temperature : simtk.unit.Quantity with units compatible with kelvin
+            the temperature of the thermodynamic states
+        pressure : simtk.unit.Quantity with units compatible with atmospheres, default None
+            the pressure of the thermodynamic states; if None, no barostat
+        """
+        self.hybrid_factory = hybrid_factory
+        hybrid_system = hybrid_factory.hybrid_system
+        self.hybrid_thermodynamic_state = ThermodynamicState(hybrid_system, temperature=temperature, pressure=pressure)
+        alchemical_state = RelativeAlchemicalState.from_system(hybrid_system)
+        alchemical_state.set_alchemical_parameters(0.0)
+        self.thermodynamic_state = CompoundThermodynamicState(copy.deepcopy(self.hybrid_thermodynamic_state), composable_states=[alchemical_state])
+        self.nbytes = HybridCache.estimate_nbytes(hybrid_factory)
+
+        self._energy_context = None
+        self._switching_context = None
+        self._switching_integrator = None
+
+    def get_energy_context(self, platform=None):
+        """
+        The context used to evaluate energies of the hybrid system; it is created on first use.
+
+        Parameters
+        ----------
+        platform : simtk.openmm.Platform, default None
+            the platform of the context, if it is created
+
+        Returns
+        -------
+        context : simtk.openmm.Context
+        """
+        if self._energy_context is None:
+            integrator = openmm.VerletIntegrator(1.0 * unit.femtoseconds)
+            self._energy_context = self.hybrid_thermodynamic_state.create_context(integrator, platform=platform)
+        return self._energy_context
+
+    def get_switching_context(self, integrator_factory, platform=None):
+        """
+        The context (and integrator) used for integrator native switching; it is created on first use.
+
+        Parameters
+        ----------
+        integrator_factory : callable
+            function without arguments that returns the switching integrator
+        platform : simtk.openmm.Platform, default None
+            the platform of the context, if it is created
+
+        Returns
+        -------
+        context : simtk.openmm.Context
+        integrator : simtk.openmm.Integrator
+        """
+        if self._switching_context is None:
+            self._switching_integrator = integrator_factory()
+            self._switching_context = self.thermodynamic_state.create_context(self._switching_integrator, platform=platform)
+        return self._switching_context, self._switching_integrator
+
+    def release(self):
+        """
+        Free the contexts held by the entry.
+        """
+        del self._energy_context, self._switching_context, self._switching_integrator
+        self._energy_context, self._switching_context, self._switching_integrator = None, None, None
+
+
+class HybridCache(object):
+    """
+    Least-recently-used cache of HybridCacheEntry objects, keyed on the topology proposal, that is bounded by
+    the estimated memory footprint of the cached systems and contexts (and, optionally, by the number of entries).
+
+    Hit, miss and eviction statistics are available from `statistics`.
+    """
+
+    # rough per-item footprints used to estimate the memory of a hybrid system and of its contexts
+    _bytes_per_particle = 64
+    _bytes_per_term = 48
+    _context_bytes_per_particle = 2048
+    _context_bytes_per_term = 64
+    _contexts_per_entry = 2
+
+    def __init__(self, max_bytes=None, capacity=None):
+        """
+        Parameters
+        ----------
+        max_bytes : int, default None
+            maximum estimated size (in bytes) of the cached entries; if None, the size is unbounded
+        capacity : int, default None
+            maximum number of cached entries; if None, the number of entries is unbounded
+        """
+        self.max_bytes = max_bytes
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @classmethod
+    def estimate_nbytes(cls, hybrid_factory):
+        """
+        Estimate the memory footprint of a hybrid system and its contexts.
+
+        Parameters
+        ----------
+        hybrid_factory : perses.annihilation.relative.HybridTopologyFactory
+            the factory of the hybrid system
+
+        Returns
+        -------
+        nbytes : int
+            the estimated size in bytes
+        """
+        hybrid_system = hybrid_factory.hybrid_system
+        num_particles = hybrid_system.getNumParticles()
+        num_terms = hybrid_system.getNumConstraints()
+        for force in hybrid_system.getForces():
+            force_terms, force_exceptions = HybridTopologyFactory._count_force_terms(force)
+            num_terms += force_terms + force_exceptions
+        system_nbytes = cls._bytes_per_particle * num_particles + cls._bytes_per_term * num_terms
+        context_nbytes = cls._context_bytes_per_particle * num_particles + cls._context_bytes_per_term * num_terms
+        return int(system_nbytes + cls._contexts_per_entry * context_nbytes)
+
+    @property
+    def nbytes(self):
+        """int : the estimated size (in bytes) of the cached entries"""
+        return self._nbytes
+
+    @property
+    def statistics(self):
+        """dict : the number of hits, misses and evictions, the hit rate, the number of entries and their estimated size"""
+        lookups = self._hits + self._misses
+        return {'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': self._hits / lookups if lookups > 0 else 0.0,
+                'entries': len(self._entries),
+                'nbytes': self._nbytes}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __getitem__(self, key):
+        try:
+            entry = self._entries[key]
+        except KeyError:
+            self._misses += 1
+            raise
+        self._hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def peek(self, key):
+        """
+        Retrieve an entry without updating its recency or the cache statistics.
+
+        Parameters
+        ----------
+        key : object
+            the key of the entry
+
+        Returns
+        -------
+        entry : HybridCacheEntry
+        """
+        return self._entries[key]
+
+    def __setitem__(self, key, entry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._nbytes += entry.nbytes
+        self._evict()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._nbytes -= entry.nbytes
+        entry.release()
+
+    def _evict(self):
+        """
+        Evict least recently used entries until the cache fits its bounds; the most recent entry is always kept.
+        """
+        while len(self._entries) > 1:
+            over_capacity = self.capacity is not None and len(self._entries) > self.capacity
+            over_size = self.max_bytes is not None and self._nbytes > self.max_bytes
+            if not (over_capacity or over_size):
+                break
+            key = next(iter(self._entries))
+            _logger.debug(f"evicting hybrid cache entry ({self._entries[key].nbytes} estimated bytes)")
+            self._remove(key)
+            self._evictions += 1
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        for key in list(self._entries.keys()):
+            self._remove(key)
+
+
 class NCMCEngine(object):
     """
     NCMC switching engine
@@ -47,7 +343,10 @@ class NCMCEngine(object):
     def __init__(self, temperature=default_temperature, functions=None, nsteps=default_nsteps,
                  steps_per_propagation=default_steps_per_propagation, timestep=default_timestep,
                  constraint_tolerance=None, platform=None, write_ncmc_interval=1, measure_shadow_work=False,
-                 integrator_splitting='V R O H R V', storage=None, verbose=False, LRUCapacity=10, pressure=None, bond_softening_constant=1.0, angle_softening_constant=1.0):
+                 integrator_splitting='V R O H R V', storage=None, verbose=False, LRUCapacity=10, pressure=None, bond_softening_constant=1.0, angle_softening_constant=1.0,
+                 integrator_native_switching=False, cache_max_bytes=None, work_readout_interval=None,
+                 trajectory_atom_indices=None, compress_trajectory=False, trajectory_precision=None,
+                 streaming_work_statistics=False, collision_rate=1.0/unit.picoseconds, random_seed=None):
         """
         This is the base class for NCMC switching between two different systems.
 
@@ -80,9 +379,38 @@ class NCMCEngine(object):
         verbose : bool, optional, default=False
             If True, print debug information.
         LRUCapacity : int, default 10
-            Capacity of LRU cache for hybrid systems
+            Maximum number of entries of the LRU cache for hybrid systems
         pressure : float, default None
             The pressure to use for the simulation. If None, no barostat
+        integrator_native_switching : bool, default False
+            If True, the whole switching protocol (lambda updates from the compiled schedule and protocol work accumulation)
+            is compiled into a single openmmtools AlchemicalNonequilibriumLangevinIntegrator, so that a switch runs on the device
+            without returning to python between steps.  `functions` must then be algebraic expressions of 'lambda' or
+            piecewise linear python functions (see LambdaProtocol.to_expressions), and `integrator_splitting` must contain an 'H' step.
+            The switch is only interrupted to read the work (see `work_readout_interval`) and to record NCMC trajectory frames
+            every `write_ncmc_interval` steps if storage is attached.
+            If False, the schedule is evaluated in python and uploaded to the integrator before every step.
+        cache_max_bytes : int, default None
+            Maximum estimated size (in bytes) of the hybrid systems, thermodynamic states and contexts held in the
+            hybrid cache; if None, the cache is only bounded by `LRUCapacity`
+        work_readout_interval : int, default None
+            The number of steps between readouts of the protocol work, which is accumulated inside the integrator
+            (no energies are evaluated in python).  If None, the work is read at every step in external switching and only at
+            the end of the switch with integrator native switching.
+        trajectory_atom_indices : list of int, default None
+            Indices of the hybrid atoms whose positions are written to storage; if None, all atoms are written
+        compress_trajectory : bool, default False
+            Whether to zlib-compress the NCMC trajectory written to storage
+        trajectory_precision : int, default None
+            If not None, the stored NCMC positions (in angstroms) are quantized to this many decimal digits (improves compression)
+        streaming_work_statistics : bool, default False
+            If True, only the total work of each switch is read back (no work or trajectory readouts during the switch, and no
+            protocol work arrays or trajectories are written to storage).  Running statistics of the works of every transformation
+            are always available from `work_statistics`; use `compute_BAR` for the free energy between two chemical states.
+        collision_rate : simtk.unit.Quantity with units compatible with 1/picoseconds, default 1/picoseconds
+            The collision rate of the Langevin switching integrator
+        random_seed : int, default None
+            If not None, the seed of the switching integrator and of the initial velocities, so that a switch can be reproduced
         """
         # Handle some defaults.
         if functions == None:
@@ -107,8 +435,34 @@ class NCMCEngine(object):
         self._bond_softening_constant = bond_softening_constant
         self._angle_softening_constant = angle_softening_constant
         self._disable_barostat = False
-        self._hybrid_cache = LRUCache(capacity=LRUCapacity)
+        self._hybrid_cache = HybridCache(max_bytes=cache_max_bytes, capacity=LRUCapacity)
         self._measure_shadow_work = measure_shadow_work
+        self._collision_rate = collision_rate
+        self._random_seed = random_seed
+        self._integrator_native_switching = integrator_native_switching
+        if self._integrator_native_switching:
+            assert 'H' in self._integrator_splitting.split(), f"integrator native switching requires an 'H' step in the integrator splitting"
+            if all(type(function) == str for function in self._functions.values()):
+                self._alchemical_functions = copy.deepcopy(self._functions)
+            else:
+                self._alchemical_functions = LambdaProtocol(functions=self._functions).to_expressions(variable='lambda')
+        else:
+            #the python functions are evaluated along the schedule here, and the value of each parameter after the next lambda update
+            #is uploaded to the integrator before every step; string functions are expressions of 'lambda' evaluated by the integrator
+            assert self._integrator_splitting.split().count('H') == 1, f"external switching requires exactly one 'H' step in the integrator splitting"
+            self._alchemical_functions = {name: function for name, function in self._functions.items() if type(function) == str}
+            external_functions = {name: function for name, function in self._functions.items() if type(function) != str}
+            self._external_parameter_names, self._external_initial_values = [], []
+            self._external_schedule, self._external_changes = None, None
+            if len(external_functions) > 0:
+                lambda_protocol = LambdaProtocol(functions=external_functions)
+                self._external_parameter_names = [name for name in lambda_protocol.parameter_names if name in external_functions]
+                columns = [lambda_protocol.parameter_names.index(name) for name in self._external_parameter_names]
+                self._external_initial_values = lambda_protocol.evaluate(0.0)[0, columns]
+                values, changes = lambda_protocol.schedule_table(np.arange(1, self._nsteps + 1) / self._nsteps)
+                self._external_schedule, self._external_changes = values[:, columns], changes[:, columns]
+            for name in self._external_parameter_names:
+                self._alchemical_functions[name] = f"select(lambda, {name}_next, {name}_initial)"
 
         self._nattempted = 0
 
@@ -123,6 +477,14 @@ class NCMCEngine(object):
         else:
             self._write_ncmc_interval = 1
         self._work_save_interval = write_ncmc_interval
+        if work_readout_interval is not None:
+            assert work_readout_interval > 0, f"the work readout interval must be a positive integer"
+        self._work_readout_interval = work_readout_interval
+        self._trajectory_atom_indices = trajectory_atom_indices
+        self._compress_trajectory = compress_trajectory
+        self._trajectory_precision = trajectory_precision
+        self._streaming_work_statistics = streaming_work_statistics
+        self._work_statistics = dict()
 
     @property
     def beta(self):
@@ -206,7 +568,7 @@ class NCMCEngine(object):
             a factory object containing the hybrid system
         """
         try:
-            hybrid_factory = self._hybrid_cache[topology_proposal]
+            hybrid_factory = self._hybrid_cache[topology_proposal].hybrid_factory
 
             #If we've retrieved the factory from the cache, update it to include the relevant positions
             hybrid_factory._old_positions = current_positions
@@ -215,13 +577,200 @@ class NCMCEngine(object):
         except KeyError:
             try:
                 hybrid_factory = HybridTopologyFactory(topology_proposal, current_positions, new_positions, bond_softening_constant=self._bond_softening_constant, angle_softening_constant=self._angle_softening_constant)
-                self._hybrid_cache[topology_proposal] = hybrid_factory
+                self._hybrid_cache[topology_proposal] = HybridCacheEntry(hybrid_factory, self._temperature, pressure=self._pressure)
             except:
                 hybrid_factory = None
 
 
         return hybrid_factory
 
+    def _update_work_statistics(self, topology_proposal, work):
+        """
+        Add the total reduced work of a switch to the running statistics of its transformation.
+
+        Parameters
+        ----------
+        topology_proposal : perses.rjmc.TopologyProposal
+            the proposal of the switch
+        work : float
+            the total reduced work of the switch
+        """
+        if not np.isfinite(work):
+            return
+        key = (topology_proposal.old_chemical_state_key, topology_proposal.new_chemical_state_key)
+        if key not in self._work_statistics:
+            self._work_statistics[key] = SwitchingWorkStatistics()
+        self._work_statistics[key].update(work)
+
+    @property
+    def work_statistics(self):
+        """dict of (str, str): dict : running statistics of the total works, keyed by (old, new) chemical state keys"""
+        return {key: statistics.summary() for key, statistics in self._work_statistics.items()}
+
+    def compute_BAR(self, old_chemical_state_key, new_chemical_state_key):
+        """
+        Compute the BAR free energy between two chemical states from the works of the switches accumulated so far in both directions.
+
+        Parameters
+        ----------
+        old_chemical_state_key : str
+            the chemical state key of the initial state of the forward transformation
+        new_chemical_state_key : str
+            the chemical state key of the final state of the forward transformation
+
+        Returns
+        -------
+        DeltaF : float
+            the reduced free energy difference
+        dDeltaF : float
+            its uncertainty
+        """
+        forward = self._work_statistics.get((old_chemical_state_key, new_chemical_state_key), None)
+        reverse = self._work_statistics.get((new_chemical_state_key, old_chemical_state_key), None)
+        if forward is None or reverse is None or forward.n == 0 or reverse.n == 0:
+            raise ValueError(f"BAR requires switches in both directions between {old_chemical_state_key} and {new_chemical_state_key}")
+        return pymbar.BAR(forward.works, reverse.works)
+
+    @property
+    def hybrid_cache_statistics(self):
+        """dict : hit, miss and eviction statistics of the hybrid cache"""
+        return self._hybrid_cache.statistics
+
+    def _switch(self, cache_entry, sampler_state):
+        """
+        Run an NCMC switch with an AlchemicalNonequilibriumLangevinIntegrator using `integrator_splitting`.
+        With integrator native switching, the schedule is compiled into the integrator and the switch is only interrupted for
+        readouts; otherwise, the value of each python-driven parameter after the next lambda update is uploaded to the integrator
+        before every step.  Either way, the lambda updates, the protocol work accumulation and the initial velocities are the same.
+        The sampler state is updated in place with the final configuration.
+
+        Parameters
+        ----------
+        cache_entry : HybridCacheEntry
+            the cached hybrid system; its thermodynamic state is at lambda = 0 and it holds the switching context
+        sampler_state : openmmtools.states.SamplerState
+            the initial hybrid configuration
+
+        Returns
+        -------
+        protocol_work : float
+            the reduced protocol work of the switch
+        work_trajectory : np.ndarray of shape (n_readouts + 1,)
+            the cumulative reduced protocol work at the start of the switch and at every work readout
+        trajectory : list of np.ndarray of shape (n_atoms, 3)
+            positions (in nanometers) recorded every `write_ncmc_interval` steps, if storage is attached
+        box_vectors : list of np.ndarray of shape (3, 3)
+            box vectors (in nanometers) of the recorded frames
+        """
+        from openmmtools.integrators import AlchemicalNonequilibriumLangevinIntegrator
+
+        # only drive the alchemical parameters that are defined in the hybrid system
+        system_parameters = set()
+        for force in cache_entry.thermodynamic_state.system.getForces():
+            if hasattr(force, 'getNumGlobalParameters'):
+                for parameter_index in range(force.getNumGlobalParameters()):
+                    system_parameters.add(force.getGlobalParameterName(parameter_index))
+        alchemical_functions = {name: expression for name, expression in self._alchemical_functions.items() if name in system_parameters}
+        external = not self._integrator_native_switching
+        external_columns = []
+        if external:
+            external_columns = [index for index, name in enumerate(self._external_parameter_names) if name in system_parameters]
+
+        def integrator_factory():
+            integrator = AlchemicalNonequilibriumLangevinIntegrator(alchemical_functions=alchemical_functions,
+                                                                    splitting=self._integrator_splitting,
+                                                                    temperature=self._temperature,
+                                                                    collision_rate=self._collision_rate,
+                                                                    timestep=self._timestep,
+                                                                    nsteps_neq=self._nsteps,
+                                                                    measure_shadow_work=self._measure_shadow_work)
+            for index in external_columns:
+                name = self._external_parameter_names[index]
+                integrator.addGlobalVariable(f"{name}_initial", self._external_initial_values[index])
+                integrator.addGlobalVariable(f"{name}_next", self._external_initial_values[index])
+            if self._constraint_tolerance is not None:
+                integrator.setConstraintTolerance(self._constraint_tolerance)
+            if self._random_seed is not None:
+                integrator.setRandomNumberSeed(self._random_seed)
+            return integrator
+
+        context, integrator = cache_entry.get_switching_context(integrator_factory, platform=self._platform)
+        sampler_state.apply_to_context(context, ignore_velocities=True)
+        if self._random_seed is not None:
+            context.setVelocitiesToTemperature(self._temperature, self._random_seed)
+        else:
+            context.setVelocitiesToTemperature(self._temperature)
+        integrator.reset()
+
+        # the integrator is only interrupted to read the work or record a frame (and, in external switching, at every step)
+        #in streaming mode, only the total work is read
+        work_readout_interval = self._work_readout_interval
+        if work_readout_interval is None and external:
+            work_readout_interval = 1
+        read_work = work_readout_interval is not None and not self._streaming_work_statistics
+        save_configuration = self._save_configuration and not self._streaming_work_statistics
+        readout_steps = set([self._nsteps])
+        if external:
+            readout_steps.update(range(1, self._nsteps))
+        if read_work:
+            readout_steps.update(range(work_readout_interval, self._nsteps, work_readout_interval))
+        if save_configuration:
+            readout_steps.update(range(self._write_ncmc_interval, self._nsteps, self._write_ncmc_interval))
+
+        work_trajectory, trajectory, box_vectors = [0.0], [], []
+        current_step = 0
+        for readout_step in sorted(readout_steps):
+            if external and current_step < self._nsteps:
+                for index in external_columns:
+                    if self._external_changes[current_step, index]:
+                        integrator.setGlobalVariableByName(f"{self._external_parameter_names[index]}_next", self._external_schedule[current_step, index])
+            integrator.step(readout_step - current_step)
+            current_step = readout_step
+            if read_work and (current_step % work_readout_interval == 0 or current_step == self._nsteps):
+                work_trajectory.append(integrator.get_protocol_work(dimensionless=True))
+            if save_configuration and current_step % self._write_ncmc_interval == 0:
+                state = context.getState(getPositions=True)
+                trajectory.append(state.getPositions(asNumpy=True).value_in_unit_system(unit.md_unit_system))
+                box_vectors.append(state.getPeriodicBoxVectors(asNumpy=True).value_in_unit_system(unit.md_unit_system))
+
+        protocol_work = integrator.get_protocol_work(dimensionless=True)
+        if not read_work:
+            work_trajectory.append(protocol_work)
+        sampler_state.update_from_context(context)
+        if not np.isfinite(protocol_work) or sampler_state.has_nan():
+            raise NaNException("NaN encountered during NCMC switching")
+        return protocol_work, np.array(work_trajectory), trajectory, box_vectors
+
+    def _write_ncmc_trajectory(self, trajectory, box_lengths, box_angles, topology, iteration):
+        """
+        Write the (subsampled and optionally compressed) NCMC trajectory and box dimensions to storage.
+
+        Parameters
+        ----------
+        trajectory : np.ndarray of shape (n_frames, n_atoms, 3)
+            the hybrid positions of each frame (in nanometers)
+        box_lengths : np.ndarray of shape (n_frames, 3)
+            the box lengths of each frame
+        box_angles : np.ndarray of shape (n_frames, 3)
+            the box angles of each frame
+        topology : mdtraj.Topology
+            the hybrid topology
+        iteration : int
+            iteration number, for storage purposes
+        """
+        if self._trajectory_atom_indices is not None:
+            trajectory = trajectory[:, self._trajectory_atom_indices, :]
+            topology = topology.subset(self._trajectory_atom_indices)
+        nframes = np.shape(trajectory)[0]
+        for frame in range(nframes):
+            self._storage.write_configuration("ncmcpositions", unit.Quantity(trajectory[frame, :, :], unit.nanometers), topology,
+                                              iteration=iteration, frame=frame, nframes=nframes,
+                                              zlib=self._compress_trajectory, least_significant_digit=self._trajectory_precision)
+
+        #write out the periodic box vectors:
+        box_lengths_and_angles = np.stack([box_lengths, box_angles])
+        self._storage.write_array("ncmcboxvectors", box_lengths_and_angles, iteration=iteration)
+
     def integrate(self, topology_proposal, initial_sampler_state, proposed_sampler_state, iteration=None):
         """
         Performs NCMC switching to either delete or insert atoms according to the provided `topology_proposal`.
@@ -268,16 +817,12 @@ class NCMCEngine(object):
 
         #generate the corresponding thermodynamic and sampler states so that we can use the NonequilibriumSwitchingMove:
 
-        #First generate the thermodynamic state:
-        hybrid_system = hybrid_factory.hybrid_system
-        hybrid_thermodynamic_state = ThermodynamicState(hybrid_system, temperature=self._temperature, pressure=self._pressure)
-
-        #Now create an RelativeAlchemicalState from the hybrid system:
-        alchemical_state = RelativeAlchemicalState.from_system(hybrid_system)
-        alchemical_state.set_alchemical_parameters(0.0)
-
-        #Now create a compound thermodynamic state that combines the hybrid thermodynamic state with the alchemical state:
-        compound_thermodynamic_state = CompoundThermodynamicState(hybrid_thermodynamic_state, composable_states=[alchemical_state])
+        #The hybrid thermodynamic state and the compound thermodynamic state (with the RelativeAlchemicalState of the hybrid system)
+        #are cached with the factory
+        cache_entry = self._hybrid_cache.peek(topology_proposal)
+        hybrid_thermodynamic_state = cache_entry.hybrid_thermodynamic_state
+        compound_thermodynamic_state = cache_entry.thermodynamic_state
+        compound_thermodynamic_state.set_alchemical_parameters(0.0)
 
         #construct a sampler state from the hybrid positions and the box vectors of the initial sampler state:
         initial_hybrid_positions = hybrid_factory.hybrid_positions
@@ -286,30 +831,18 @@ class NCMCEngine(object):
         initial_hybrid_sampler_state = SamplerState(initial_hybrid_positions, box_vectors=initial_hybrid_box_vectors)
         final_hybrid_sampler_state = copy.deepcopy(initial_hybrid_sampler_state)
 
-        #create the nonequilibrium move:
-        #ne_move = NonequilibriumSwitchingMove(self._functions, self._integrator_splitting, self._temperature, self._nsteps, self._timestep,
-        #                                      work_save_interval=self._write_ncmc_interval, top=topology,subset_atoms=None,
-        #                                      save_configuration=self._save_configuration, measure_shadow_work=self._measure_shadow_work)
-
-        ne_move = ExternalNonequilibriumSwitchingMove(self._functions, nsteps_neq=self._nsteps,
-                                                      timestep=self._timestep, temperature=self._temperature,
-                                                      work_configuration_save_interval=self._work_save_interval,
-                                                      splitting="V R O R V")
-
-
-        #run the NCMC protocol
+        #run the NCMC protocol; with integrator native switching, the schedule is compiled into the integrator,
+        #otherwise it is evaluated in python and uploaded to the integrator at every step
         try:
-            ne_move.apply(compound_thermodynamic_state, final_hybrid_sampler_state)
+            protocol_work, work_trajectory, switching_trajectory, switching_box_vectors = self._switch(cache_entry, final_hybrid_sampler_state)
         except Exception as e:
             _logger.warn("NCMC failed because {}; rejecting.".format(str(e)))
             logP_work = -np.inf
             return [initial_sampler_state, proposed_sampler_state, -np.inf, 0.0, 0.0]
-
-        #get the total work:
-        logP_work = - ne_move.cumulative_work[-1]
+        logP_work = - protocol_work
 
         # Compute contribution of transforming to and from the hybrid system:
-        context, integrator = global_context_cache.get_context(hybrid_thermodynamic_state)
+        context = cache_entry.get_energy_context(platform=self._platform)
 
         #set all alchemical parameters to zero:
         for parameter in self._functions.keys():
@@ -339,30 +872,26 @@ class NCMCEngine(object):
         old_box_vectors = copy.deepcopy(new_box_vectors) #these are the same as the new system
         final_old_sampler_state = SamplerState(old_positions, box_vectors=old_box_vectors)
 
-        #extract the trajectory and box vectors from the move:
-        trajectory = ne_move.trajectory[::-self._write_ncmc_interval, :, :][::-1]
         topology = hybrid_factory.hybrid_topology
-        position_varname = "ncmcpositions"
-        nframes = np.shape(trajectory)[0]
-
-        #extract box vectors:
-        box_vec_varname = "ncmcboxvectors"
-        box_lengths = ne_move.box_lengths[::-self._write_ncmc_interval, :][::-1]
-        box_angles = ne_move.box_angles[::-self._write_ncmc_interval, :][::-1]
-        box_lengths_and_angles = np.stack([box_lengths, box_angles])
-
-        #write out the positions of the topology
-        if self._storage:
-            for frame in range(nframes):
-                self._storage.write_configuration(position_varname, trajectory[frame, :, :], topology, iteration=iteration, frame=frame, nframes=nframes)
-
-        #write out the periodict box vectors:
-        if self._storage:
-            self._storage.write_array(box_vec_varname, box_lengths_and_angles, iteration=iteration)
-
-        #retrieve the protocol work and write that out too:
-        protocol_work = ne_move.cumulative_work
-        if self._storage:
+        #the integrator accumulates the work; it was only read out at the readout steps
+        trajectory = np.array(switching_trajectory)
+        box_lengths, box_angles = [], []
+        for frame_box_vectors in switching_box_vectors:
+            a, b, c, alpha, beta, gamma = md.utils.box_vectors_to_lengths_and_angles(*frame_box_vectors)
+            box_lengths.append([a, b, c])
+            box_angles.append([alpha, beta, gamma])
+        box_lengths, box_angles = np.array(box_lengths), np.array(box_angles)
+        protocol_work = work_trajectory
+
+        #accumulate the running statistics of the total work of this transformation
+        self._update_work_statistics(topology_proposal, -logP_work)
+
+        #write out the positions of the topology and the periodic box vectors
+        if self._storage and len(trajectory) > 0 and not self._streaming_work_statistics:
+            self._write_ncmc_trajectory(trajectory, box_lengths, box_angles, topology, iteration)
+
+        #write out the protocol work
+        if self._storage and not self._streaming_work_statistics:
             self._storage.write_array("protocolwork", protocol_work, iteration=iteration)
 
         # Return
@@ -6,6 +6,8 @@ import mdtraj as md
 import numpy as np
 import copy
 import enum
+import time
+import resource
 from io import StringIO
 import lxml.etree as etree
 from openmmtools.constants import ONE_4PI_EPS0
@@ -52,7 +54,8 @@ class HybridTopologyFactory(object):
 
     """
 
-    _known_forces = {'HarmonicBondForce', 'HarmonicAngleForce', 'PeriodicTorsionForce', 'NonbondedForce', 'MonteCarloBarostat'}
+    _known_forces = {'HarmonicBondForce', 'HarmonicAngleForce', 'PeriodicTorsionForce', 'NonbondedForce', 'MonteCarloBarostat',
+                     'RBTorsionForce', 'CMAPTorsionForce', 'GBSAOBCForce', 'CustomGBForce'}
 
     def __init__(self,
                  topology_proposal,
@@ -71,7 +74,12 @@ class HybridTopologyFactory(object):
                  softcore_LJ_v2_alpha = 0.85,
                  softcore_electrostatics_alpha = 0.3,
                  softcore_sigma_Q = 1.0,
-                 interpolate_old_and_new_14s = False):
+                 interpolate_old_and_new_14s = False,
+                 interpolate_core_sterics_in_nonbonded = False,
+                 prune_interaction_groups = False,
+                 copy_systems = True,
+                 log_construction_profile = False,
+                 alchemical_force_group = None):
         """
         Initialize the Hybrid topology factory.
 
@@ -118,14 +126,45 @@ class HybridTopologyFactory(object):
             softcore sigma parameter for softcore electrostatics.
         interpolate_old_and_new_14s : bool, default False
             whether to turn on new 1,4 interactions and turn off old 1,4 interactions; if False, they are present in the nonbonded force
+        interpolate_core_sterics_in_nonbonded : bool, default False
+            whether to interpolate the Lennard-Jones parameters of core atoms in the standard NonbondedForce (with per-particle
+            offsets on lambda_sterics_core) instead of in the CustomNonbondedForce. Core-core and core-environment pairs are then
+            removed from the CustomNonbondedForce, which only keeps the softcore interactions of unique atoms. The endstates are
+            unchanged; at intermediate lambda_sterics_core, the pair parameters follow the Lorentz-Berthelot mixing of the interpolated
+            particle parameters rather than the interpolation of the mixed parameters (the two agree if the core epsilons do not change). If the dispersion correction is used, OpenMM recomputes it whenever lambda_sterics_core changes.
+        prune_interaction_groups : bool, default False
+            whether to restrict the CustomNonbondedForce to one interaction group per alchemical atom class (see
+            _handle_interaction_groups) instead of one per pair of classes. Environment-environment interactions are always in the
+            standard NonbondedForce; combined with interpolate_core_sterics_in_nonbonded, only the pairs involving unique atoms remain
+            in the CustomNonbondedForce, which keeps its cost independent of the number of solvent-solvent pairs in explicit solvent.
+        copy_systems : bool, default True
+            whether to deep-copy the old and new systems of the topology proposal before building the hybrid system. The factory only
+            reads the input systems and clones the forces it transfers to the hybrid system (the barostat), so setting this to False
+            (copy-on-write construction) is safe and avoids holding two extra copies of each system in memory; the input systems must
+            then not be modified while the factory is in use.
+        log_construction_profile : bool, default False
+            whether to log the construction profile (see the construction_profile property) once the hybrid system is built
+        alchemical_force_group : int, default None
+            if not None, the custom forces that depend on alchemical (lambda) parameters are placed in this force group, while the
+            standard forces (which hold the environment interactions) remain in force group 0.  The groups can then be integrated
+            with different timesteps by a multiple time step splitting (see perses.dispersed.utils.multiple_time_step_splitting).
+            The standard NonbondedForce carries alchemical parameter offsets but stays in group 0 with the environment nonbonded interactions.
 
         .. todo :: Document how positions for hybrid system are constructed
 
         """
         _logger.info("Beginning nonbonded method, total particle, barostat, and exceptions retrieval...")
+        self._construction_profile = {'steps': dict()}
+        construction_start_time = time.time()
+
         self._topology_proposal = topology_proposal
-        self._old_system = copy.deepcopy(topology_proposal.old_system)
-        self._new_system = copy.deepcopy(topology_proposal.new_system)
+        if copy_systems:
+            self._old_system = copy.deepcopy(topology_proposal.old_system)
+            self._new_system = copy.deepcopy(topology_proposal.new_system)
+        else:
+            _logger.info("Reading old and new systems without copying them (copy-on-write construction)")
+            self._old_system = topology_proposal.old_system
+            self._new_system = topology_proposal.new_system
         self._old_to_hybrid_map = {}
         self._new_to_hybrid_map = {}
         self._hybrid_system_forces = dict()
@@ -133,6 +172,8 @@ class HybridTopologyFactory(object):
         self._new_positions = new_positions
         self._soften_only_new = soften_only_new
         self._interpolate_14s = interpolate_old_and_new_14s
+        self._interpolate_core_sterics_in_nonbonded = interpolate_core_sterics_in_nonbonded
+        self._prune_interaction_groups = prune_interaction_groups
 
         #new attributes from the modified geometry engine
         if neglected_old_angle_terms:
@@ -245,7 +286,7 @@ class HybridTopologyFactory(object):
         _logger.info(f"getDefaultPeriodicBoxVectors added to hybrid: {box_vectors}")
 
         #assign atoms to one of the classes described in the class docstring
-        self._atom_classes = self._determine_atom_classes()
+        self._atom_classes = self._profile_step('determine_atom_classes', self._determine_atom_classes)
         _logger.info("Determined atom classes.")
 
         #create the opposite atom maps for use in nonbonded force processing; let's omit this from logger
@@ -254,45 +295,75 @@ class HybridTopologyFactory(object):
 
         #construct dictionary of exceptions in old and new systems
         _logger.info("Generating old system exceptions dict...")
-        self._old_system_exceptions = self._generate_dict_from_exceptions(self._old_system_forces['NonbondedForce'])
+        self._old_system_exceptions = self._profile_step('generate_old_system_exceptions', self._generate_dict_from_exceptions, self._old_system_forces['NonbondedForce'])
         _logger.info("Generating new system exceptions dict...")
-        self._new_system_exceptions = self._generate_dict_from_exceptions(self._new_system_forces['NonbondedForce'])
+        self._new_system_exceptions = self._profile_step('generate_new_system_exceptions', self._generate_dict_from_exceptions, self._new_system_forces['NonbondedForce'])
+
+        #retrieve the implicit solvent forces (if any) as CustomGBForces
+        self._old_gb_force = self._get_gb_force(self._old_system_forces)
+        self._new_gb_force = self._get_gb_force(self._new_system_forces)
+        if (self._old_gb_force is None) != (self._new_gb_force is None):
+            raise ValueError("Implicit solvent must be present in both the old and new systems, or in neither.")
 
         #copy constraints, checking to make sure they are not changing
         _logger.info("Handling constraints...")
-        self._handle_constraints()
+        self._profile_step('handle_constraints', self._handle_constraints)
 
         #copy over relevant virtual sites
         _logger.info("Handling virtual sites...")
-        self._handle_virtual_sites()
+        self._profile_step('handle_virtual_sites', self._handle_virtual_sites)
 
         #call each of the methods to add the corresponding force terms and prepare the forces:
         _logger.info("Adding bond force terms...")
-        self._add_bond_force_terms()
+        self._profile_step('add_bond_force_terms', self._add_bond_force_terms)
 
         _logger.info("Adding angle force terms...")
-        self._add_angle_force_terms()
+        self._profile_step('add_angle_force_terms', self._add_angle_force_terms)
 
         _logger.info("Adding torsion force terms...")
-        self._add_torsion_force_terms()
+        self._profile_step('add_torsion_force_terms', self._add_torsion_force_terms)
+
+        if 'RBTorsionForce' in self._old_system_forces or 'RBTorsionForce' in self._new_system_forces:
+            _logger.info("Adding Ryckaert-Bellemans torsion force terms...")
+            self._profile_step('add_rb_torsion_force_terms', self._add_rb_torsion_force_terms)
+
+        if 'CMAPTorsionForce' in self._old_system_forces or 'CMAPTorsionForce' in self._new_system_forces:
+            _logger.info("Adding CMAP torsion force terms...")
+            self._profile_step('add_cmap_torsion_force_terms', self._add_cmap_torsion_force_terms)
+
+        if self._old_gb_force is not None:
+            _logger.info("Adding implicit solvent force terms...")
+            self._profile_step('add_gb_force_terms', self._add_gb_force_terms)
 
         if 'NonbondedForce' in self._old_system_forces or 'NonbondedForce' in self._new_system_forces:
             _logger.info("Adding nonbonded force terms...")
-            self._add_nonbonded_force_terms()
+            self._profile_step('add_nonbonded_force_terms', self._add_nonbonded_force_terms)
 
         #call each force preparation method to generate the actual interactions that we need:
         _logger.info("Handling harmonic bonds...")
-        self.handle_harmonic_bonds()
+        self._profile_step('handle_harmonic_bonds', self.handle_harmonic_bonds)
 
         _logger.info("Handling harmonic angles...")
-        self.handle_harmonic_angles()
+        self._profile_step('handle_harmonic_angles', self.handle_harmonic_angles)
 
         _logger.info("Handling torsion forces...")
-        self.handle_periodic_torsion_force()
+        self._profile_step('handle_periodic_torsion_force', self.handle_periodic_torsion_force)
+
+        if 'RBTorsionForce' in self._old_system_forces or 'RBTorsionForce' in self._new_system_forces:
+            _logger.info("Handling Ryckaert-Bellemans torsion forces...")
+            self._profile_step('handle_rb_torsion_force', self.handle_rb_torsion_force)
+
+        if 'CMAPTorsionForce' in self._old_system_forces or 'CMAPTorsionForce' in self._new_system_forces:
+            _logger.info("Handling CMAP torsion forces...")
+            self._profile_step('handle_cmap_torsion_force', self.handle_cmap_torsion_force)
+
+        if self._old_gb_force is not None:
+            _logger.info("Handling implicit solvent forces...")
+            self._profile_step('handle_gb_force', self.handle_gb_force)
 
         if 'NonbondedForce' in self._old_system_forces or 'NonbondedForce' in self._new_system_forces:
             _logger.info("Handling nonbonded forces...")
-            self.handle_nonbonded()
+            self._profile_step('handle_nonbonded', self.handle_nonbonded)
 
         if 'NonbondedForce' in self._old_system_forces or 'NonbondedForce' in self._new_system_forces:
             _logger.info("Handling unique_new/old interaction exceptions...")
@@ -300,14 +371,163 @@ class HybridTopologyFactory(object):
                 _logger.info("There are no old/new system exceptions.")
             else:
                 _logger.info("There are old or new system exceptions...proceeding.")
-                self.handle_old_new_exceptions()
+                self._profile_step('handle_old_new_exceptions', self.handle_old_new_exceptions)
 
 
+        if alchemical_force_group is not None:
+            _logger.info(f"Assigning alchemical forces to force group {alchemical_force_group}...")
+            self._profile_step('assign_alchemical_force_group', self._assign_alchemical_force_group, alchemical_force_group)
+
         #get positions for the hybrid
-        self._hybrid_positions = self._compute_hybrid_positions()
+        self._hybrid_positions = self._profile_step('compute_hybrid_positions', self._compute_hybrid_positions)
 
         #generate the topology representation
-        self._hybrid_topology = self._create_topology()
+        self._hybrid_topology = self._profile_step('create_topology', self._create_topology)
+
+        self._finalize_construction_profile(time.time() - construction_start_time)
+        if log_construction_profile:
+            self._log_construction_profile()
+
+    def _assign_alchemical_force_group(self, force_group):
+        """
+        Place every custom hybrid force that depends on an alchemical parameter in the given force group.
+        The standard forces, which hold the environment interactions, are left in their current force group.
+
+        Parameters
+        ----------
+        force_group : int
+            the force group of the alchemical forces (0 <= force_group < 32)
+        """
+        if not 0 <= force_group < 32:
+            raise ValueError(f"force groups must be between 0 and 31; got {force_group}")
+        for name, force in self._hybrid_system_forces.items():
+            if name.startswith('standard'):
+                continue
+            if not hasattr(force, 'getNumGlobalParameters'):
+                continue
+            parameter_names = [force.getGlobalParameterName(index) for index in range(force.getNumGlobalParameters())]
+            if any(parameter_name.startswith('lambda') for parameter_name in parameter_names):
+                _logger.debug(f"\t_assign_alchemical_force_group: placing {name} in force group {force_group}")
+                force.setForceGroup(force_group)
+
+    @staticmethod
+    def _get_peak_rss():
+        """
+        Get the peak resident set size of the process.
+
+        Returns
+        -------
+        peak_rss : float
+            peak resident set size in MB
+        """
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on linux
+        if sys.platform == 'darwin':
+            return peak_rss / 1024**2
+        return peak_rss / 1024
+
+    @staticmethod
+    def _count_force_terms(force):
+        """
+        Count the interaction terms and the exceptions/exclusions of a force.
+
+        Parameters
+        ----------
+        force : openmm.Force
+            the force to inspect
+
+        Returns
+        -------
+        num_terms : int
+            number of bonds, angles, torsions, collective variables or particles (in that order of precedence)
+        num_exceptions : int
+            number of exceptions and exclusions
+        """
+        num_terms = 0
+        for counter in ['getNumBonds', 'getNumAngles', 'getNumTorsions', 'getNumCollectiveVariables', 'getNumParticles']:
+            if hasattr(force, counter):
+                num_terms = getattr(force, counter)()
+                break
+        num_exceptions = 0
+        for counter in ['getNumExceptions', 'getNumExclusions']:
+            if hasattr(force, counter):
+                num_exceptions += getattr(force, counter)()
+        return num_terms, num_exceptions
+
+    def _count_hybrid_terms(self):
+        """
+        Count the terms and exceptions/exclusions of all the forces in the hybrid system.
+
+        Returns
+        -------
+        num_terms : int
+            total number of terms
+        num_exceptions : int
+            total number of exceptions and exclusions
+        """
+        counts = [self._count_force_terms(force) for force in self._hybrid_system.getForces()]
+        return sum(count[0] for count in counts), sum(count[1] for count in counts)
+
+    def _profile_step(self, step_name, function, *args):
+        """
+        Call a construction step, recording its wall time, the number of hybrid terms and exceptions it generated,
+        and the peak resident memory after it.
+
+        Parameters
+        ----------
+        step_name : str
+            name of the step in the construction profile
+        function : function
+            the construction step
+        args : list
+            positional arguments of the construction step
+
+        Returns
+        -------
+        result : object
+            the return value of the construction step
+        """
+        num_terms_before, num_exceptions_before = self._count_hybrid_terms()
+        start_time = time.time()
+        result = function(*args)
+        wall_time = time.time() - start_time
+        num_terms_after, num_exceptions_after = self._count_hybrid_terms()
+
+        self._construction_profile['steps'][step_name] = {'wall_time': wall_time,
+                                                          'num_terms': num_terms_after - num_terms_before,
+                                                          'num_exceptions': num_exceptions_after - num_exceptions_before,
+                                                          'peak_rss_MB': self._get_peak_rss()}
+        return result
+
+    def _finalize_construction_profile(self, total_wall_time):
+        """
+        Add the totals and the per-force term counts to the construction profile.
+
+        Parameters
+        ----------
+        total_wall_time : float
+            wall time of the whole construction in seconds
+        """
+        self._construction_profile['total_wall_time'] = total_wall_time
+        self._construction_profile['peak_rss_MB'] = self._get_peak_rss()
+        self._construction_profile['num_particles'] = self._hybrid_system.getNumParticles()
+        self._construction_profile['num_constraints'] = self._hybrid_system.getNumConstraints()
+        self._construction_profile['forces'] = dict()
+        for force_name, force in self._hybrid_system_forces.items():
+            num_terms, num_exceptions = self._count_force_terms(force)
+            self._construction_profile['forces'][force_name] = {'num_terms': num_terms, 'num_exceptions': num_exceptions}
+        self._construction_profile['num_terms'], self._construction_profile['num_exceptions'] = self._count_hybrid_terms()
+
+    def _log_construction_profile(self):
+        """
+        Log the construction profile, with the steps sorted by decreasing wall time.
+        """
+        profile = self._construction_profile
+        _logger.info(f"Hybrid construction: {profile['total_wall_time']:.3f} s, {profile['num_particles']} particles, "
+                     f"{profile['num_terms']} terms, {profile['num_exceptions']} exceptions/exclusions, peak RSS {profile['peak_rss_MB']:.1f} MB")
+        for step_name, step in sorted(profile['steps'].items(), key = lambda item: item[1]['wall_time'], reverse = True):
+            _logger.info(f"\t{step_name}: {step['wall_time']:.3f} s, {step['num_terms']} terms, {step['num_exceptions']} exceptions/exclusions, "
+                         f"peak RSS {step['peak_rss_MB']:.1f} MB")
 
     def _handle_virtual_sites(self):
         """
@@ -694,6 +914,244 @@ class HybridTopologyFactory(object):
         self._hybrid_system.addForce(standard_torsion_force)
         self._hybrid_system_forces['standard_torsion_force'] = standard_torsion_force
 
+    def _add_rb_torsion_force_terms(self):
+        """
+        This function adds the appropriate RBTorsionForce terms to the system. Core torsions are interpolated,
+        while environment and unique torsions are always on. Note that the Ryckaert-Bellemans convention measures
+        the dihedral as psi = theta - 180 degrees, so cos(psi) = -cos(theta).
+        """
+        energy_expression  = '(1-lambda_torsions)*U1 + lambda_torsions*U2;'
+        energy_expression += 'U1 = c0_1 + c1_1*cp + c2_1*cp^2 + c3_1*cp^3 + c4_1*cp^4 + c5_1*cp^5;'
+        energy_expression += 'U2 = c0_2 + c1_2*cp + c2_2*cp^2 + c3_2*cp^3 + c4_2*cp^4 + c5_2*cp^5;'
+        energy_expression += 'cp = -cos(theta);'
+
+        if self._has_functions:
+            try:
+                energy_expression += 'lambda_torsions = ' + self._functions['lambda_torsions']
+            except KeyError as e:
+                _logger.warning("Functions were provided, but no term was provided for torsions")
+                raise e
+
+        #create the force and add the relevant parameters; c{n}_1 are the old coefficients and c{n}_2 the new ones
+        custom_core_force = openmm.CustomTorsionForce(energy_expression)
+        for molecule_index in (1, 2):
+            for coefficient_index in range(6):
+                custom_core_force.addPerTorsionParameter(f"c{coefficient_index}_{molecule_index}")
+
+        if self._has_functions:
+            custom_core_force.addGlobalParameter('lambda', 0.0)
+            custom_core_force.addEnergyParameterDerivative('lambda')
+        else:
+            custom_core_force.addGlobalParameter('lambda_torsions', 0.0)
+
+        self._hybrid_system.addForce(custom_core_force)
+        self._hybrid_system_forces['core_rb_torsion_force'] = custom_core_force
+
+        #create and add the RB torsion term for unique/environment atoms
+        standard_rb_torsion_force = openmm.RBTorsionForce()
+        self._hybrid_system.addForce(standard_rb_torsion_force)
+        self._hybrid_system_forces['standard_rb_torsion_force'] = standard_rb_torsion_force
+
+    def _add_cmap_torsion_force_terms(self):
+        """
+        This function prepares the CMAPTorsionForce terms of the hybrid system. The standard CMAPTorsionForce (for
+        environment and unique terms) holds the maps of the old system followed by the maps of the new system. Core
+        terms are collected in one CMAPTorsionForce per endstate; these are combined into a CustomCVForce once they
+        are populated (see handle_cmap_torsion_force), since a CustomCVForce takes ownership of its collective variables.
+        """
+        standard_cmap_force = openmm.CMAPTorsionForce()
+        self._core_cmap_forces = {'old': openmm.CMAPTorsionForce(), 'new': openmm.CMAPTorsionForce()}
+        self._cmap_map_offsets = {'old': 0, 'new': 0}
+
+        for system_name in ('old', 'new'):
+            cmap_force = getattr(self, '_{}_system_forces'.format(system_name)).get('CMAPTorsionForce', None)
+            self._cmap_map_offsets[system_name] = standard_cmap_force.getNumMaps()
+            if cmap_force is None:
+                continue
+            for map_index in range(cmap_force.getNumMaps()):
+                size, energy = cmap_force.getMapParameters(map_index)
+                standard_cmap_force.addMap(size, energy)
+                self._core_cmap_forces[system_name].addMap(size, energy)
+
+        self._hybrid_system.addForce(standard_cmap_force)
+        self._hybrid_system_forces['standard_cmap_torsion_force'] = standard_cmap_force
+
+    def _get_gb_force(self, system_forces):
+        """
+        Retrieve the implicit solvent force of a system as a CustomGBForce. A GBSAOBCForce is converted into an
+        equivalent CustomGBForce so that both are treated identically.
+
+        Parameters
+        ----------
+        system_forces : dict of str : openmm.Force
+            dictionary of the forces of the system keyed by class name
+
+        Returns
+        -------
+        gb_force : openmm.CustomGBForce or None
+            the implicit solvent force, or None if the system has none
+        """
+        if 'GBSAOBCForce' in system_forces and 'CustomGBForce' in system_forces:
+            raise ValueError("Systems with both a GBSAOBCForce and a CustomGBForce are not supported.")
+        if 'GBSAOBCForce' in system_forces:
+            return self._convert_gbsaobc_to_custom_gb(system_forces['GBSAOBCForce'])
+        return system_forces.get('CustomGBForce', None)
+
+    @staticmethod
+    def _convert_gbsaobc_to_custom_gb(gbsa_force):
+        """
+        Build a CustomGBForce which reproduces a GBSAOBCForce (OBC2 parameters with the ACE surface area term).
+        The per-particle parameters are 'charge', 'radius' and 'scale', as in the GBSAOBCForce.
+
+        Parameters
+        ----------
+        gbsa_force : openmm.GBSAOBCForce
+            the force to convert
+
+        Returns
+        -------
+        custom_gb_force : openmm.CustomGBForce
+            the equivalent custom force, with all particles added
+        """
+        electrostatic_prefactor = -ONE_4PI_EPS0 * (1.0 / gbsa_force.getSoluteDielectric() - 1.0 / gbsa_force.getSolventDielectric())
+        surface_area_energy = gbsa_force.getSurfaceAreaEnergy()
+        if unit.is_quantity(surface_area_energy):
+            surface_area_energy = surface_area_energy.value_in_unit(unit.kilojoule_per_mole / unit.nanometer**2)
+        surface_area_prefactor = 4.0 * np.pi * surface_area_energy
+
+        custom_gb_force = openmm.CustomGBForce()
+        custom_gb_force.addPerParticleParameter('charge')
+        custom_gb_force.addPerParticleParameter('radius')
+        custom_gb_force.addPerParticleParameter('scale')
+
+        custom_gb_force.addComputedValue('I', "step(r+sr2-or1)*0.5*(1/L-1/U+0.25*(r-sr2^2/r)*(1/(U^2)-1/(L^2))+0.5*log(L/U)/r);"
+                                              "U=r+sr2; L=max(or1, D); D=abs(r-sr2); sr2=scale2*or2;"
+                                              "or1=radius1-0.009; or2=radius2-0.009", openmm.CustomGBForce.ParticlePairNoExclusions)
+        custom_gb_force.addComputedValue('B', "1/(1/or-tanh(psi-0.8*psi^2+4.85*psi^3)/radius);"
+                                              "psi=I*or; or=radius-0.009", openmm.CustomGBForce.SingleParticle)
+        custom_gb_force.addEnergyTerm("0.5*(%.16g)*charge^2/B + (%.16g)*(radius+0.14)^2*(radius/B)^6" % (electrostatic_prefactor, surface_area_prefactor),
+                                      openmm.CustomGBForce.SingleParticle)
+        custom_gb_force.addEnergyTerm("(%.16g)*charge1*charge2/f; f=sqrt(r^2+B1*B2*exp(-r^2/(4*B1*B2)))" % electrostatic_prefactor,
+                                      openmm.CustomGBForce.ParticlePairNoExclusions)
+
+        nonbonded_methods = {openmm.GBSAOBCForce.NoCutoff: openmm.CustomGBForce.NoCutoff,
+                             openmm.GBSAOBCForce.CutoffNonPeriodic: openmm.CustomGBForce.CutoffNonPeriodic,
+                             openmm.GBSAOBCForce.CutoffPeriodic: openmm.CustomGBForce.CutoffPeriodic}
+        custom_gb_force.setNonbondedMethod(nonbonded_methods[gbsa_force.getNonbondedMethod()])
+        custom_gb_force.setCutoffDistance(gbsa_force.getCutoffDistance())
+
+        for particle_index in range(gbsa_force.getNumParticles()):
+            charge, radius, scale = gbsa_force.getParticleParameters(particle_index)
+            custom_gb_force.addParticle([charge.value_in_unit(unit.elementary_charge), radius.value_in_unit(unit.nanometer), scale])
+
+        return custom_gb_force
+
+    def _hybrid_gb_expression(self, expression, computation_type, parameter_names, is_energy_term):
+        """
+        Make a CustomGBForce expression alchemical. Every per-particle parameter p is replaced by an interpolation of
+        p_old and p_new with lambda_electrostatics_core (unique atoms have p_old == p_new). Unique atoms are switched
+        off with a per-particle weight (1 - lambda_electrostatics_delete for unique old, lambda_electrostatics_insert for
+        unique new) that scales energy terms and the contributions of a particle to the computed values of others.
+        Unique old and unique new atoms never interact.
+
+        Parameters
+        ----------
+        expression : str
+            the original expression
+        computation_type : openmm.CustomGBForce.ComputationType
+            SingleParticle, ParticlePair or ParticlePairNoExclusions
+        parameter_names : list of str
+            the per-particle parameter names of the original force
+        is_energy_term : bool
+            whether the expression is an energy term (as opposed to a computed value)
+
+        Returns
+        -------
+        hybrid_expression : str
+            the alchemical expression
+        """
+        segments = [segment.strip() for segment in expression.split(';') if segment.strip()]
+
+        if computation_type == openmm.CustomGBForce.SingleParticle:
+            suffixes = ['']
+            scale = 'hybrid_weight' if is_energy_term else None
+        else:
+            suffixes = ['1', '2']
+            #the value of particle 1 accumulates contributions from particle 2
+            scale = 'hybrid_weight1*hybrid_weight2*hybrid_mask' if is_energy_term else 'hybrid_weight2*hybrid_mask'
+            segments.append('hybrid_mask = 1 - unique_old1*unique_new2 - unique_new1*unique_old2')
+
+        if scale is not None:
+            segments[0] = f"{scale}*({segments[0]})"
+
+        for suffix in suffixes:
+            for name in parameter_names:
+                segments.append(f"{name}{suffix} = {name}_old{suffix} + lambda_electrostatics_core*({name}_new{suffix} - {name}_old{suffix})")
+            segments.append(f"hybrid_weight{suffix} = 1 - unique_old{suffix}*lambda_electrostatics_delete - unique_new{suffix}*(1 - lambda_electrostatics_insert)")
+
+        if self._has_functions:
+            for parameter_name in ('lambda_electrostatics_core', 'lambda_electrostatics_insert', 'lambda_electrostatics_delete'):
+                try:
+                    segments.append(f"{parameter_name} = " + self._functions[parameter_name])
+                except KeyError as e:
+                    _logger.warning(f"Functions were provided, but no term was provided for {parameter_name}")
+                    raise e
+
+        return '; '.join(segments)
+
+    def _add_gb_force_terms(self):
+        """
+        Add the implicit solvent force to the hybrid system. The old and new CustomGBForces must share the same
+        functional form; each per-particle parameter is duplicated into an old and a new copy, and the expressions are
+        made alchemical with _hybrid_gb_expression. Particles are added in handle_gb_force.
+        """
+        old_gb_force, new_gb_force = self._old_gb_force, self._new_gb_force
+
+        def functional_form(force):
+            return ([force.getPerParticleParameterName(index) for index in range(force.getNumPerParticleParameters())],
+                    [force.getGlobalParameterName(index) for index in range(force.getNumGlobalParameters())],
+                    [tuple(force.getComputedValueParameters(index)) for index in range(force.getNumComputedValues())],
+                    [tuple(force.getEnergyTermParameters(index)) for index in range(force.getNumEnergyTerms())])
+
+        if functional_form(old_gb_force) != functional_form(new_gb_force):
+            raise ValueError("The old and new implicit solvent forces have different functional forms.")
+
+        parameter_names = functional_form(old_gb_force)[0]
+        hybrid_gb_force = openmm.CustomGBForce()
+        for name in parameter_names:
+            hybrid_gb_force.addPerParticleParameter(f"{name}_old")
+            hybrid_gb_force.addPerParticleParameter(f"{name}_new")
+        hybrid_gb_force.addPerParticleParameter('unique_old') # 1 = hybrid old atom, 0 otherwise
+        hybrid_gb_force.addPerParticleParameter('unique_new') # 1 = hybrid new atom, 0 otherwise
+
+        for index in range(old_gb_force.getNumGlobalParameters()):
+            hybrid_gb_force.addGlobalParameter(old_gb_force.getGlobalParameterName(index), old_gb_force.getGlobalParameterDefaultValue(index))
+
+        for index in range(old_gb_force.getNumTabulatedFunctions()):
+            hybrid_gb_force.addTabulatedFunction(old_gb_force.getTabulatedFunctionName(index), copy.deepcopy(old_gb_force.getTabulatedFunction(index)))
+
+        for index in range(old_gb_force.getNumComputedValues()):
+            name, expression, computation_type = old_gb_force.getComputedValueParameters(index)
+            hybrid_gb_force.addComputedValue(name, self._hybrid_gb_expression(expression, computation_type, parameter_names, False), computation_type)
+
+        for index in range(old_gb_force.getNumEnergyTerms()):
+            expression, computation_type = old_gb_force.getEnergyTermParameters(index)
+            hybrid_gb_force.addEnergyTerm(self._hybrid_gb_expression(expression, computation_type, parameter_names, True), computation_type)
+
+        if self._has_functions:
+            hybrid_gb_force.addGlobalParameter('lambda', 0.0)
+            hybrid_gb_force.addEnergyParameterDerivative('lambda')
+        else:
+            hybrid_gb_force.addGlobalParameter('lambda_electrostatics_core', 0.0)
+            hybrid_gb_force.addGlobalParameter('lambda_electrostatics_insert', 0.0)
+            hybrid_gb_force.addGlobalParameter('lambda_electrostatics_delete', 0.0)
+
+        hybrid_gb_force.setNonbondedMethod(old_gb_force.getNonbondedMethod())
+        hybrid_gb_force.setCutoffDistance(old_gb_force.getCutoffDistance())
+
+        self._hybrid_system.addForce(hybrid_gb_force)
+        self._hybrid_system_forces['gb_force'] = hybrid_gb_force
+
     def _add_nonbonded_force_terms(self):
         """
         Add the nonbonded force terms to the hybrid system. Note that as with the other forces,
@@ -819,8 +1277,13 @@ class HybridTopologyFactory(object):
 
 
         sterics_addition += "lambda_alpha = new_interaction*(1-lambda_sterics_insert) + old_interaction*lambda_sterics_delete;"
-        sterics_addition += "lambda_sterics = core_interaction*lambda_sterics_core + new_interaction*lambda_sterics_insert + old_interaction*lambda_sterics_delete;"
-        sterics_addition += "core_interaction = delta(unique_old1+unique_old2+unique_new1+unique_new2);new_interaction = max(unique_new1, unique_new2);old_interaction = max(unique_old1, unique_old2);"
+        if self._interpolate_core_sterics_in_nonbonded:
+            #core-core and core-environment pairs are handled by the standard nonbonded force, so every pair here involves a unique atom
+            sterics_addition += "lambda_sterics = new_interaction*lambda_sterics_insert + old_interaction*lambda_sterics_delete;"
+            sterics_addition += "new_interaction = max(unique_new1, unique_new2);old_interaction = max(unique_old1, unique_old2);"
+        else:
+            sterics_addition += "lambda_sterics = core_interaction*lambda_sterics_core + new_interaction*lambda_sterics_insert + old_interaction*lambda_sterics_delete;"
+            sterics_addition += "core_interaction = delta(unique_old1+unique_old2+unique_new1+unique_new2);new_interaction = max(unique_new1, unique_new2);old_interaction = max(unique_old1, unique_old2);"
 
         return sterics_addition
 
@@ -1299,6 +1762,136 @@ class HybridTopologyFactory(object):
                 added_torsions.append(old_index_list)
                 added_torsions.append(old_index_list_reversed)
 
+    def handle_rb_torsion_force(self):
+        """
+        Handle the Ryckaert-Bellemans torsions in the hybrid system. Terms containing core atoms (but no unique atoms)
+        are interpolated: each old term is scaled off and each new term is scaled on, so old and new terms need not be
+        matched. Unique terms are always on, and environment terms are taken from the old system.
+        """
+        for system_name in ('old', 'new'):
+            rb_torsion_force = getattr(self, '_{}_system_forces'.format(system_name)).get('RBTorsionForce', None)
+            if rb_torsion_force is None:
+                continue
+            hybrid_map = getattr(self, '_{}_to_hybrid_map'.format(system_name))
+
+            _logger.info(f"\thandle_rb_torsion_force: looping through {system_name}_system to add relevant terms...")
+            for torsion_index in range(rb_torsion_force.getNumTorsions()):
+                torsion_parameters = rb_torsion_force.getTorsionParameters(torsion_index)
+                hybrid_index_list = [hybrid_map[index] for index in torsion_parameters[:4]]
+                coefficients = list(torsion_parameters[4:])
+                interaction_group = self._determine_interaction_group(hybrid_index_list)
+
+                if interaction_group == InteractionGroup.core:
+                    _logger.debug(f"\t\thandle_rb_torsion_force: {system_name} torsion_index {torsion_index} is a core (to custom torsion force).")
+                    if system_name == 'old':
+                        hybrid_force_parameters = coefficients + [0.0] * 6
+                    else:
+                        hybrid_force_parameters = [0.0] * 6 + coefficients
+                    self._hybrid_system_forces['core_rb_torsion_force'].addTorsion(*hybrid_index_list, hybrid_force_parameters)
+
+                elif interaction_group == InteractionGroup.environment and system_name == 'new':
+                    #environment terms are the same in both systems and were added from the old system
+                    continue
+
+                else:
+                    _logger.debug(f"\t\thandle_rb_torsion_force: {system_name} torsion_index {torsion_index} is unique or environment (to standard RB torsion force).")
+                    self._hybrid_system_forces['standard_rb_torsion_force'].addTorsion(*hybrid_index_list, *coefficients)
+
+    def handle_cmap_torsion_force(self):
+        """
+        Handle the CMAP torsions in the hybrid system, following the same classification as handle_rb_torsion_force.
+        Core terms are interpolated with a CustomCVForce, (1-lambda_torsions)*U_cmap_old + lambda_torsions*U_cmap_new,
+        which is only added if there are core terms.
+        """
+        for system_name in ('old', 'new'):
+            cmap_force = getattr(self, '_{}_system_forces'.format(system_name)).get('CMAPTorsionForce', None)
+            if cmap_force is None:
+                continue
+            hybrid_map = getattr(self, '_{}_to_hybrid_map'.format(system_name))
+            map_offset = self._cmap_map_offsets[system_name]
+
+            _logger.info(f"\thandle_cmap_torsion_force: looping through {system_name}_system to add relevant terms...")
+            for torsion_index in range(cmap_force.getNumTorsions()):
+                torsion_parameters = cmap_force.getTorsionParameters(torsion_index)
+                map_index = torsion_parameters[0]
+                hybrid_index_list = [hybrid_map[index] for index in torsion_parameters[1:]]
+                interaction_group = self._determine_interaction_group(hybrid_index_list)
+
+                if interaction_group == InteractionGroup.core:
+                    self._core_cmap_forces[system_name].addTorsion(map_index, *hybrid_index_list)
+                elif interaction_group == InteractionGroup.environment and system_name == 'new':
+                    continue
+                else:
+                    self._hybrid_system_forces['standard_cmap_torsion_force'].addTorsion(map_index + map_offset, *hybrid_index_list)
+
+        num_core_cmap_torsions = sum(force.getNumTorsions() for force in self._core_cmap_forces.values())
+        _logger.info(f"\thandle_cmap_torsion_force: {num_core_cmap_torsions} core CMAP torsions.")
+        if num_core_cmap_torsions > 0:
+            energy_expression = '(1-lambda_torsions)*U_cmap_old + lambda_torsions*U_cmap_new;'
+            if self._has_functions:
+                try:
+                    energy_expression += 'lambda_torsions = ' + self._functions['lambda_torsions']
+                except KeyError as e:
+                    _logger.warning("Functions were provided, but no term was provided for torsions")
+                    raise e
+
+            core_cmap_force = openmm.CustomCVForce(energy_expression)
+            core_cmap_force.addCollectiveVariable('U_cmap_old', self._core_cmap_forces['old'])
+            core_cmap_force.addCollectiveVariable('U_cmap_new', self._core_cmap_forces['new'])
+            if self._has_functions:
+                core_cmap_force.addGlobalParameter('lambda', 0.0)
+                core_cmap_force.addEnergyParameterDerivative('lambda')
+            else:
+                core_cmap_force.addGlobalParameter('lambda_torsions', 0.0)
+
+            self._hybrid_system.addForce(core_cmap_force)
+            self._hybrid_system_forces['core_cmap_torsion_force'] = core_cmap_force
+
+        del self._core_cmap_forces
+
+    def handle_gb_force(self):
+        """
+        Add the hybrid particles and the exclusions of the old and new systems to the implicit solvent force.
+        Core atoms carry their old and new parameters, while unique atoms carry their own parameters twice, as they are
+        switched on or off through their unique_old/unique_new flags.
+        """
+        old_gb_force, new_gb_force = self._old_gb_force, self._new_gb_force
+        hybrid_gb_force = self._hybrid_system_forces['gb_force']
+
+        def interleave(old_parameters, new_parameters):
+            return [value for pair in zip(old_parameters, new_parameters) for value in pair]
+
+        _logger.info("\thandle_gb_force: looping through all particles in hybrid...")
+        for particle_index in range(self._hybrid_system.getNumParticles()):
+            if particle_index in self._atom_classes['unique_old_atoms']:
+                old_parameters = old_gb_force.getParticleParameters(self._hybrid_to_old_map[particle_index])
+                hybrid_parameters = interleave(old_parameters, old_parameters) + [1, 0]
+            elif particle_index in self._atom_classes['unique_new_atoms']:
+                new_parameters = new_gb_force.getParticleParameters(self._hybrid_to_new_map[particle_index])
+                hybrid_parameters = interleave(new_parameters, new_parameters) + [0, 1]
+            elif particle_index in self._atom_classes['core_atoms']:
+                old_parameters = old_gb_force.getParticleParameters(self._hybrid_to_old_map[particle_index])
+                new_parameters = new_gb_force.getParticleParameters(self._hybrid_to_new_map[particle_index])
+                hybrid_parameters = interleave(old_parameters, new_parameters) + [0, 0]
+            else:
+                old_parameters = old_gb_force.getParticleParameters(self._hybrid_to_old_map[particle_index])
+                hybrid_parameters = interleave(old_parameters, old_parameters) + [0, 0]
+
+            check_index = hybrid_gb_force.addParticle(hybrid_parameters)
+            assert (particle_index == check_index ), "Attempting to add incorrect particle to hybrid system"
+
+        added_exclusions = set()
+        for system_name in ('old', 'new'):
+            gb_force = getattr(self, '_{}_gb_force'.format(system_name))
+            hybrid_map = getattr(self, '_{}_to_hybrid_map'.format(system_name))
+            for exclusion_index in range(gb_force.getNumExclusions()):
+                index1, index2 = gb_force.getExclusionParticles(exclusion_index)
+                hybrid_pair = tuple(sorted([hybrid_map[index1], hybrid_map[index2]]))
+                if hybrid_pair not in added_exclusions:
+                    hybrid_gb_force.addExclusion(*hybrid_pair)
+                    added_exclusions.add(hybrid_pair)
+        _logger.info(f"\thandle_gb_force: {len(added_exclusions)} exclusions added.")
+
     def handle_nonbonded(self):
         """
 
@@ -1364,9 +1957,15 @@ class HybridTopologyFactory(object):
                 check_index = self._hybrid_system_forces['core_sterics_force'].addParticle([sigma_old, epsilon_old, sigma_new, epsilon_new, 0, 0])
                 assert (particle_index == check_index ), "Attempting to add incorrect particle to hybrid system"
 
-                #still add the particle to the regular nonbonded force, but with zeroed out parameters; add old charge to standard_nonbonded and zero sterics
-                check_index = self._hybrid_system_forces['standard_nonbonded_force'].addParticle(charge_old, 0.5*(sigma_old+sigma_new), 0.0)
-                assert (particle_index == check_index ), "Attempting to add incorrect particle to hybrid system"
+                if self._interpolate_core_sterics_in_nonbonded:
+                    #add the old parameters to the regular nonbonded force and interpolate the sterics with lambda_sterics_core
+                    check_index = self._hybrid_system_forces['standard_nonbonded_force'].addParticle(charge_old, sigma_old, epsilon_old)
+                    assert (particle_index == check_index ), "Attempting to add incorrect particle to hybrid system"
+                    self._hybrid_system_forces['standard_nonbonded_force'].addParticleParameterOffset('lambda_sterics_core', particle_index, 0, (sigma_new - sigma_old), (epsilon_new - epsilon_old))
+                else:
+                    #still add the particle to the regular nonbonded force, but with zeroed out parameters; add old charge to standard_nonbonded and zero sterics
+                    check_index = self._hybrid_system_forces['standard_nonbonded_force'].addParticle(charge_old, 0.5*(sigma_old+sigma_new), 0.0)
+                    assert (particle_index == check_index ), "Attempting to add incorrect particle to hybrid system"
 
                 # Charge is charge_old at lambda_electrostatics = 0, charge_new at lambda_electrostatics = 1
                 # TODO: We could also interpolate the Lennard-Jones here instead of core_sterics force so that core_sterics_force could just be softcore
@@ -1448,6 +2047,10 @@ class HybridTopologyFactory(object):
         TODO: we should also be adding the following interaction groups...
         7) Unique-new - Unique-new
         8) Unique-old - Unique-old
+
+        If the interaction groups are pruned, the same pairs are covered by (at most) three groups:
+        unique-old - (unique-old, core, environment), unique-new - (unique-new, core, environment) and, unless the core
+        sterics are interpolated in the standard nonbonded force, core - (core, environment).
         """
         #get the force objects for convenience:
         sterics_custom_force = self._hybrid_system_forces['core_sterics_force']
@@ -1458,6 +2061,15 @@ class HybridTopologyFactory(object):
         unique_new_atoms = self._atom_classes['unique_new_atoms']
         environment_atoms = self._atom_classes['environment_atoms']
 
+        if self._prune_interaction_groups:
+            #each alchemical class interacts with itself and everything it is allowed to see; sorted index lists keep the
+            #groups contiguous. Pairs within a class are counted once, since OpenMM deduplicates pairs present in both sets.
+            mapped_atoms = core_atoms.union(environment_atoms)
+            sterics_custom_force.addInteractionGroup(sorted(unique_old_atoms), sorted(unique_old_atoms.union(mapped_atoms)))
+            sterics_custom_force.addInteractionGroup(sorted(unique_new_atoms), sorted(unique_new_atoms.union(mapped_atoms)))
+            if not self._interpolate_core_sterics_in_nonbonded:
+                sterics_custom_force.addInteractionGroup(sorted(core_atoms), sorted(mapped_atoms))
+            return
 
         sterics_custom_force.addInteractionGroup(unique_old_atoms, core_atoms)
 
@@ -1467,9 +2079,11 @@ class HybridTopologyFactory(object):
 
         sterics_custom_force.addInteractionGroup(unique_new_atoms, environment_atoms)
 
-        sterics_custom_force.addInteractionGroup(core_atoms, environment_atoms)
+        #if the core sterics are interpolated in the standard nonbonded force, core-environment and core-core pairs are handled there
+        if not self._interpolate_core_sterics_in_nonbonded:
+            sterics_custom_force.addInteractionGroup(core_atoms, environment_atoms)
 
-        sterics_custom_force.addInteractionGroup(core_atoms, core_atoms)
+            sterics_custom_force.addInteractionGroup(core_atoms, core_atoms)
 
         sterics_custom_force.addInteractionGroup(unique_new_atoms, unique_new_atoms)
 
@@ -1989,6 +2603,21 @@ class HybridTopologyFactory(object):
             new_positions[idx, :] = hybrid_positions[self._new_to_hybrid_map[idx], :]
         return new_positions
 
+    @property
+    def construction_profile(self):
+        """
+        Timing and size report of the hybrid system construction.
+
+        Returns
+        -------
+        construction_profile : dict
+            'steps' maps each construction step to its 'wall_time' (s), the 'num_terms' and 'num_exceptions' (exceptions and
+            exclusions) it added to the hybrid system, and the 'peak_rss_MB' after it. 'total_wall_time', 'peak_rss_MB',
+            'num_particles', 'num_constraints', 'num_terms' and 'num_exceptions' summarize the construction, and 'forces'
+            gives the term and exception counts of each hybrid force.
+        """
+        return copy.deepcopy(self._construction_profile)
+
     @property
     def hybrid_system(self):
         """
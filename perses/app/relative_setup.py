@@ -800,6 +800,7 @@ class NonequilibriumSwitchingFEP(DaskClient):
 
         # use default functions if none specified
         self._protocol = protocol
+        self._lambda_protocol_class = LambdaProtocol(functions = self._protocol)
 
         self._write_ncmc_configuration = write_ncmc_configuration
 
@@ -1710,7 +1711,7 @@ class NonequilibriumSwitchingFEP(DaskClient):
         modify a thermodynamic state in place
         """
         if self.relative_transform:
-            thermodynamic_state.set_alchemical_parameters(current_lambda, LambdaProtocol(functions = self._protocol))
+            thermodynamic_state.set_alchemical_parameters(current_lambda, self._lambda_protocol_class)
             return thermodynamic_state
         else:
             raise Exception(f"modifying a local thermodynamic state when self.relative_transform = False is not supported.  Aborting!")
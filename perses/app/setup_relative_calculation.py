@@ -220,6 +220,18 @@ def getSetupOptions(filename):
     if 'softcore_v2' not in setup_options:
         setup_options['softcore_v2'] = False
         _logger.info(f"\t'softcore_v2' not specified: default to 'False'")
+
+    if 'interpolate_core_sterics_in_nonbonded' not in setup_options:
+        setup_options['interpolate_core_sterics_in_nonbonded'] = False
+        _logger.info(f"\t'interpolate_core_sterics_in_nonbonded' not specified: default to 'False'")
+
+    if 'prune_interaction_groups' not in setup_options:
+        setup_options['prune_interaction_groups'] = False
+        _logger.info(f"\t'prune_interaction_groups' not specified: default to 'False'")
+
+    if 'copy_systems' not in setup_options:
+        setup_options['copy_systems'] = True
+        _logger.info(f"\t'copy_systems' not specified: default to 'True' (i.e. the HybridTopologyFactory deep-copies the old and new systems)")
  
     _logger.info(f"\tCreating '{trajectory_directory}'...")
     assert (not os.path.exists(trajectory_directory)), f'Output trajectory directory "{trajectory_directory}" already exists. Refusing to overwrite'
@@ -432,7 +444,10 @@ def run_setup(setup_options):
                                                neglected_new_angle_terms = top_prop[f"{phase}_forward_neglected_angles"],
                                                neglected_old_angle_terms = top_prop[f"{phase}_reverse_neglected_angles"],
                                                softcore_LJ_v2 = setup_options['softcore_v2'],
-                                               interpolate_old_and_new_14s = setup_options['anneal_1,4s'])
+                                               interpolate_old_and_new_14s = setup_options['anneal_1,4s'],
+                                               interpolate_core_sterics_in_nonbonded = setup_options['interpolate_core_sterics_in_nonbonded'],
+                                               prune_interaction_groups = setup_options['prune_interaction_groups'],
+                                               copy_systems = setup_options['copy_systems'])
 
             ne_fep[phase] = SequentialMonteCarlo(factory = hybrid_factory,
                                                  lambda_protocol = setup_options['lambda_protocol'],
@@ -471,7 +486,10 @@ def run_setup(setup_options):
                                                neglected_new_angle_terms = top_prop[f"{phase}_forward_neglected_angles"],
                                                neglected_old_angle_terms = top_prop[f"{phase}_reverse_neglected_angles"],
                                                softcore_LJ_v2 = setup_options['softcore_v2'],
-                                               interpolate_old_and_new_14s = setup_options['anneal_1,4s'])
+                                               interpolate_old_and_new_14s = setup_options['anneal_1,4s'],
+                                               interpolate_core_sterics_in_nonbonded = setup_options['interpolate_core_sterics_in_nonbonded'],
+                                               prune_interaction_groups = setup_options['prune_interaction_groups'],
+                                               copy_systems = setup_options['copy_systems'])
 
         for phase in phases:
            # Define necessary vars to check energy bookkeeping
@@ -14,12 +14,101 @@ import dask.distributed as distributed
 import tqdm
 import time
 from scipy.special import logsumexp
+import concurrent.futures
+import multiprocessing
+from multiprocessing.managers import BaseManager
 
 # Instantiate logger
 logging.basicConfig(level = logging.NOTSET)
 _logger = logging.getLogger("parallelism")
 _logger.setLevel(logging.INFO)
 
+class LocalWorker(object):
+    """
+    Minimal stand-in for a `dask.distributed.Worker` inside a local process pool.
+    Functions that are run on all workers (e.g. `activate_LocallyOptimalAnnealing`) set attributes on this object,
+    which persist in the process for the lifetime of the pool.
+
+    Arguments
+    ---------
+    address : str
+        unique address of the worker process
+    """
+    def __init__(self, address):
+        self.address = address
+
+#the worker of the current process if it belongs to a local process pool (created on the first call to `get_worker`)
+_local_worker = None
+
+def _run_on_local_worker(barrier, func, arguments):
+    """
+    run a function on a local worker after every worker has picked up its copy;
+    the barrier guarantees that each process of the pool runs `func` exactly once.
+
+    Returns
+    -------
+    address : str
+        address of the worker that ran the function
+    result : object
+        the output of `func(*arguments)`
+    """
+    barrier.wait()
+    return get_worker().address, func(*arguments)
+
+def _local_worker_address():
+    """
+    return the address of the local worker
+    """
+    return get_worker().address
+
+def get_worker():
+    """
+    return the worker of the current process: the `dask.distributed.Worker` if we are in a dask worker,
+    else the `LocalWorker` of the local process pool, which is created the first time it is requested in a pool process.
+    """
+    global _local_worker
+    if _local_worker is not None:
+        return _local_worker
+    try:
+        return distributed.get_worker()
+    except ValueError as e:
+        if multiprocessing.current_process().name == 'MainProcess': #we are neither in a dask worker nor in a process pool
+            raise e
+        _local_worker = LocalWorker(address = f"local-{os.getpid()}")
+        return _local_worker
+
+class LocalAsCompleted(object):
+    """
+    iterator over `concurrent.futures.Future` objects in the order in which they complete;
+    like `dask.distributed.as_completed`, futures can be added while iterating.
+
+    Arguments
+    ---------
+    futures : list of concurrent.futures.Future, default ()
+        futures to iterate over
+    """
+    def __init__(self, futures = ()):
+        self.pending = set(futures)
+
+    def add(self, future):
+        """
+        add a future to the iterator
+        """
+        self.pending.add(future)
+
+    def __iter__(self):
+        while len(self.pending) > 0:
+            done, self.pending = concurrent.futures.wait(self.pending, return_when = concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future
+
+class _ActorManager(BaseManager):
+    """
+    manager that hosts actors of the local process backend
+    """
+    pass
+
+
 class Parallelism(object):
     """
     This class maintains a running parallelism (with support for the parallelism libraries and schedulers
@@ -32,22 +121,29 @@ class Parallelism(object):
         - launch and perform operations on actors
         - block until computation is complete with 'wait' or monitor progress
     """
-    supported_libraries = {'dask': ['LSF']}
+    jobqueue_clusters = {'LSF': 'LSFCluster', 'SLURM': 'SLURMCluster', 'PBS': 'PBSCluster', 'SGE': 'SGECluster'}
+    supported_libraries = {'dask': list(jobqueue_clusters.keys()) + ['local'], 'multiprocessing': ['local']}
 
     def activate_client(self,
                         library = ('dask', 'LSF'),
                         num_processes = 2,
-                        timeout = 1800):
+                        timeout = 1800,
+                        cluster_kwargs = None):
         """
         Parameters
         ----------
         library : tuple(str, str), default ('dask', 'LSF')
             parallelism and scheduler tuple
+            ('dask', 'local') runs a dask.distributed.LocalCluster and ('multiprocessing', 'local') a process pool
+            on the current machine
         num_processes : int or None
             number of workers to run with the new client
-            if None, num_processes will be adaptive
+            if None, num_processes will be adaptive (for ('multiprocessing', 'local'), one process per core)
         timeout : int
             number of seconds to wait to fulfill the workers order
+        cluster_kwargs : dict, default None
+            keyword arguments of the dask_jobqueue cluster (e.g. queue, cores, memory, walltime);
+            if None, the cluster is configured from the dask jobqueue configuration file
         """
         self.library = library
         if library is not None:
@@ -64,11 +160,11 @@ class Parallelism(object):
 
         if library[0] == 'dask':
             _logger.debug(f"detected dask parallelism...")
-            if library[1] == 'LSF':
-                _logger.debug(f"detected LSF scheduler")
-                from dask_jobqueue import LSFCluster
+            if library[1] in self.jobqueue_clusters:
+                _logger.debug(f"detected {library[1]} scheduler")
+                import dask_jobqueue
                 _logger.debug(f"creating cluster...")
-                cluster = LSFCluster()
+                cluster = getattr(dask_jobqueue, self.jobqueue_clusters[library[1]])(**({} if cluster_kwargs is None else cluster_kwargs))
                 if num_processes is None:
                     _logger.debug(f"adaptive cluster")
                     self._adapt = True
@@ -81,16 +177,62 @@ class Parallelism(object):
 
                 _logger.debug(f"creating client with cluster")
                 self.client = distributed.Client(cluster, timeout = timeout)
-                if not self._adapt:
-                    while len(self.client.nthreads()) != self.num_processes:
-                        _logger.debug(f"waiting for worker request fulfillment...")
-                        time.sleep(5)
+                self._wait_for_workers(1 if self._adapt else self.num_processes, timeout)
+                worker_threads = self.client.nthreads()
+                self.workers = {i: _worker for i, _worker in zip(range(len(worker_threads)), worker_threads.keys())}
+                _logger.debug(f"workers initialized: {self.workers}")
+            elif library[1] == 'local':
+                _logger.debug(f"detected local scheduler")
+                cluster = distributed.LocalCluster(n_workers = 0 if num_processes is None else num_processes,
+                                                   threads_per_worker = 1,
+                                                   processes = True)
+                if num_processes is None:
+                    _logger.debug(f"adaptive cluster")
+                    self._adapt = True
+                    cluster.adapt(minimum = 1, maximum = os.cpu_count(), interval = '1s')
+                else:
+                    self._adapt = False
+                    self.num_processes = num_processes
+                self.client = distributed.Client(cluster, timeout = timeout)
+                self._wait_for_workers(1 if self._adapt else self.num_processes, timeout)
                 worker_threads = self.client.nthreads()
                 self.workers = {i: _worker for i, _worker in zip(range(len(worker_threads)), worker_threads.keys())}
                 _logger.debug(f"workers initialized: {self.workers}")
             else:
                 raise Exception(f"{library[1]} is supported, but without client-activation functionality!")
 
+        elif library[0] == 'multiprocessing':
+            _logger.debug(f"detected multiprocessing parallelism...")
+            self._adapt = False
+            self.num_processes = os.cpu_count() if num_processes is None else num_processes
+            self.client = concurrent.futures.ProcessPoolExecutor(max_workers = self.num_processes)
+            self._manager = multiprocessing.Manager()
+            self._actor_managers = []
+            self._warned_unpinned_workers = False
+            self.workers = {}
+            addresses = self.run_all(_local_worker_address, (), workers = None)
+            self.workers = {i: _worker for i, _worker in enumerate(addresses.keys())}
+            _logger.debug(f"workers initialized: {self.workers}")
+
+    def _wait_for_workers(self, num_workers, timeout):
+        """
+        block until `num_workers` workers have registered with the scheduler of the dask client
+
+        Arguments
+        ---------
+        num_workers : int
+            number of workers to wait for
+        timeout : int
+            number of seconds to wait before raising a TimeoutError
+        """
+        _logger.debug(f"waiting for {num_workers} workers to register...")
+        try:
+            self.client.wait_for_workers(n_workers = num_workers, timeout = timeout)
+        except Exception as e:
+            _logger.error(f"only {len(self.client.nthreads())} of {num_workers} workers registered within {timeout} seconds")
+            raise e
+        _logger.debug(f"{len(self.client.nthreads())} workers registered")
+
     def deactivate_client(self):
         """
         deactivate a cluster that is maintained by a local client.  attributes associated with
@@ -108,6 +250,16 @@ class Parallelism(object):
                     _logger.debug(f"client closed successfully")
                 else:
                     _logger.warning(f"the client is NoneType.")
+            elif self.library[0] == 'multiprocessing':
+                _logger.debug(f"detected multiprocessing parallelism...")
+                for manager in self._actor_managers:
+                    manager.shutdown()
+                self._manager.shutdown()
+                self.client.shutdown(wait = True)
+                self.client = None
+                for _attr in ['_manager', '_actor_managers']:
+                    delattr(self, _attr)
+                _logger.debug(f"process pool closed successfully")
         else:
             _logger.warning(f"the library is NoneType.")
 
@@ -144,6 +296,9 @@ class Parallelism(object):
                 else:
                     scatter_future = self.client.scatter(df, workers)
                     return scatter_future
+            elif self.library[0] == 'multiprocessing':
+                #process pools pickle arguments on submission, so there is nothing to scatter ahead of time
+                return df
             else:
                 raise Exception(f"the client is not NoneType but the library is not supported")
 
@@ -158,7 +313,7 @@ class Parallelism(object):
         arguments : tuple of lists, default None
             if None, then the default workers are all workers
         workers : list of str, default None
-            worker address list
+            worker address list; ignored (with a warning) by ('multiprocessing', 'local'), which cannot pin tasks to a process
 
         Returns
         ---------
@@ -171,15 +326,86 @@ class Parallelism(object):
             else:
                 futures = [func(*plug) for plug in zip(*arguments)]
         else:
-            if workers is None:
-                _workers = list(self.workers.values())
+            _workers = list(self.workers.values()) if workers is None else workers
             if self.library[0] == 'dask':
                 futures = self.client.map(func, *arguments, workers = _workers)
+            elif self.library[0] == 'multiprocessing':
+                self._warn_unpinned_workers(workers)
+                futures = [self.client.submit(func, *plug) for plug in zip(*arguments)]
             else:
                 raise Exception(f"{self.library} is supported, but without deployment functionality!")
 
         return futures
 
+    def submit(self, func, *arguments, workers = None):
+        """
+        wrapper to submit a single function call to the client for scheduling
+
+        Arguments
+        ---------
+        func : function
+            python function to distribute
+        arguments : args
+            arguments of the function
+        workers : list of str, default None
+            worker address list; ignored (with a warning) by ('multiprocessing', 'local'), which cannot pin tasks to a process
+
+        Returns
+        ---------
+        future : <generalized> future object
+            future of the function call; if the client is None, the function is called immediately and a completed
+            concurrent.futures.Future is returned
+        """
+        if self.client is None:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(func(*arguments))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            if self.library[0] == 'dask':
+                _workers = list(self.workers.values()) if workers is None else workers
+                future = self.client.submit(func, *arguments, workers = _workers, pure = False)
+            elif self.library[0] == 'multiprocessing':
+                self._warn_unpinned_workers(workers)
+                future = self.client.submit(func, *arguments)
+            else:
+                raise Exception(f"{self.library} is supported, but without submission functionality!")
+
+        return future
+
+    def _warn_unpinned_workers(self, workers):
+        """
+        warn (once per client) that a worker list was requested from ('multiprocessing', 'local'), which cannot pin tasks to a process
+
+        Arguments
+        ---------
+        workers : list of str or None
+            the requested worker address list
+        """
+        if workers is not None and not self._warned_unpinned_workers:
+            _logger.warning(f"('multiprocessing', 'local') cannot pin tasks to a process; the requested workers {list(workers)} are ignored")
+            self._warned_unpinned_workers = True
+
+    def as_completed(self, futures = ()):
+        """
+        wrapper to iterate over futures as they complete; futures can be added to the returned iterator with `.add(future)`
+
+        Arguments
+        ---------
+        futures : list of <generalized> futures, default ()
+            futures that are to be iterated over
+
+        Returns
+        ---------
+        iterator : dask.distributed.as_completed or LocalAsCompleted
+            iterator yielding futures in order of completion
+        """
+        if self.client is not None and self.library[0] == 'dask':
+            return distributed.as_completed(futures)
+        else:
+            return LocalAsCompleted(futures)
+
     def run_all(self, func, arguments, workers):
         """
         distribute single function with single set of arguments to all workers
@@ -191,18 +417,22 @@ class Parallelism(object):
         arguments : tuple of args, default None
             if None, then the default workers are all workers
         workers : list of str, default None
-            worker address list
+            worker address list; ('multiprocessing', 'local') always runs on every process of the pool
 
         Returns
         ---------
         futures: <generalized> future object
-            futures of the map
+            futures of the map (a dict of {worker address: result} if the client is not None)
         """
         if self.client is None:
             futures = func(*arguments)
         else:
             if self.library[0] == 'dask':
                 futures = self.client.run(func, *arguments, workers = workers)
+            elif self.library[0] == 'multiprocessing':
+                barrier = self._manager.Barrier(self.num_processes)
+                _futures = [self.client.submit(_run_on_local_worker, barrier, func, arguments) for _ in range(self.num_processes)]
+                futures = dict(_future.result() for _future in _futures)
             else:
                 raise Exception(f"{self.library} is supported, but without deployment functionality!")
 
@@ -233,6 +463,16 @@ class Parallelism(object):
                 _errors = 'raise' if not omit_errors else 'skip'
                 results = self.client.gather(futures, errors = _errors)
                 return results
+            elif self.library[0] == 'multiprocessing':
+                results = []
+                for future in futures:
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        if not omit_errors:
+                            raise e
+                        _logger.warning(f"omitting failed future: {e}")
+                return results
             else:
                 raise Exception(f"{self.library} is supported, but without gather-results functionality!")
 
@@ -252,6 +492,9 @@ class Parallelism(object):
                 distributed.progress(future)
                 result = future.result()
                 return result
+            elif self.library[0] == 'multiprocessing':
+                #actor methods are called through a manager proxy, which returns the result directly
+                return future
             else:
                 raise Exception(f"{self.library} is supported, but without actor-gather functionality!")
 
@@ -266,7 +509,7 @@ class Parallelism(object):
 
         Returns
         ---------
-        actor : dask.distributed.Actor pointer (future)
+        actor : dask.distributed.Actor pointer (future) or multiprocessing proxy
         """
         if self.client is not None:
             if self.library[0] == 'dask':
@@ -274,6 +517,13 @@ class Parallelism(object):
                 distributed.progress(future)
                 actor = future.result()                    # Get back a pointer to that object
                 return actor
+            elif self.library[0] == 'multiprocessing':
+                _ActorManager.register(_class.__name__, _class)
+                manager = _ActorManager()
+                manager.start()
+                self._actor_managers.append(manager)
+                actor = getattr(manager, _class.__name__)() # proxy to the instance living in the manager process
+                return actor
             else:
                 raise Exception(f"{self.library} is supported, but without actor launch functionality!")
         else:
@@ -294,6 +544,9 @@ class Parallelism(object):
         else:
             if self.library[0] == 'dask':
                 distributed.progress(futures)
+            elif self.library[0] == 'multiprocessing':
+                for _ in tqdm.tqdm(concurrent.futures.as_completed(futures), total = len(futures)):
+                    pass
             else:
                 raise Exception(f"{self.library} is supported, but without actor launch functionality!")
 
@@ -309,5 +562,25 @@ class Parallelism(object):
         """
         if self.client is None:
             pass
+        elif self.library[0] == 'multiprocessing':
+            concurrent.futures.wait(futures)
         else:
             distributed.wait(futures)
+
+    def cancel(self, futures):
+        """
+        wrapper to cancel futures that are no longer needed; running futures of ('multiprocessing', 'local') cannot be cancelled and
+        will complete
+
+        Arguments
+        ---------
+        futures : list of <generalized> futures
+            futures that are to be cancelled
+        """
+        if self.client is None:
+            pass
+        elif self.library[0] == 'multiprocessing':
+            for future in futures:
+                future.cancel()
+        else:
+            self.client.cancel(futures)
@@ -25,9 +25,10 @@ from sys import getsizeof
 import time
 from collections import namedtuple
 from perses.annihilation.lambda_protocol import LambdaProtocol
-from perses.annihilation.lambda_protocol import RelativeAlchemicalState, LambdaProtocol
+from perses.annihilation.lambda_protocol import RelativeAlchemicalState, LambdaProtocol, ThermodynamicLengthOptimizer
 from perses.dispersed import *
 import random
+import operator
 import pymbar
 import dask.distributed as distributed
 from perses.dispersed.parallel import Parallelism
@@ -51,7 +52,10 @@ class SequentialMonteCarlo():
     WARNING: take care in writing trajectory file as saving positions to memory is costly.  Either do not write the configuration or save sparse positions.
     """
 
-    supported_resampling_methods = {'multinomial': multinomial_resample}
+    supported_resampling_methods = {'multinomial': multinomial_resample,
+                                    'systematic': systematic_resample,
+                                    'stratified': stratified_resample,
+                                    'residual': residual_resample}
     supported_observables = {'ESS': ESS, 'CESS': CESS}
 
     def __init__(self,
@@ -71,7 +75,9 @@ class SequentialMonteCarlo():
                  compute_endstate_correction = True,
                  external_parallelism = None,
                  internal_parallelism = {'library': ('dask', 'LSF'),
-                                         'num_processes': 2}
+                                         'num_processes': 2},
+                 snapshot_capacity = 1000,
+                 snapshot_memmap = False
                                          ):
         """
         Parameters
@@ -116,6 +122,16 @@ class SequentialMonteCarlo():
             if None, external worker arguments have to be specified, otherwise, no parallel computation will be conducted, and annealing will be conducted locally.
             internal_parallelism is used when the SequentialMonteCarlo class is allowed to create its own Parallelism.client object to allocate workers on a
             cluster.
+            use {'library': ('multiprocessing', 'local'), 'num_processes': None} to use all cores of the current machine, or
+            {'library': ('dask', 'SLURM'), 'num_processes': 4, 'cluster_kwargs': {...}} to submit workers to another job scheduler
+            (supported schedulers are listed in Parallelism.supported_libraries).
+        snapshot_capacity : int, default 1000
+            number of equilibrium snapshots per endstate held in the snapshot store from which particles are pulled (see `SnapshotStore`);
+            the oldest snapshots are overwritten (and pulled from the trajectory files instead) once the capacity is exceeded.
+            if the equilibrium data are decorrelated, only decorrelated snapshots are held, and the capacity is grown to hold all of them
+            if no trajectory files are written
+        snapshot_memmap : bool, default False
+            whether to back the snapshot stores with a memory-mapped file in the trajectory directory rather than memory
         """
         _logger.info(f"Initializing SequentialMonteCarlo")
 
@@ -127,6 +143,7 @@ class SequentialMonteCarlo():
 
         #use default protocol
         self.lambda_protocol = lambda_protocol
+        self.lambda_protocol_class = LambdaProtocol(functions = self.lambda_protocol)
 
         #handle both eq and neq parameters
         self.temperature = temperature
@@ -178,6 +195,12 @@ class SequentialMonteCarlo():
         # instantiating equilibrium file/rp collection dicts
         self._eq_dict = {0: [], 1: [], '0_decorrelated': None, '1_decorrelated': None, '0_reduced_potentials': [], '1_reduced_potentials': []}
         self._eq_files_dict = {0: [], 1: []}
+        self._eq_file_indices = {0: {}, 1: {}} #snapshot index: (file, index in file)
+        snapshot_filenames = {lambda_state: None for lambda_state in [0, 1]}
+        if snapshot_memmap:
+            assert self.write_traj, f"the snapshot store can only be memory-mapped if a trajectory directory and prefix are specified"
+            snapshot_filenames = {lambda_state: os.path.join(os.getcwd(), self.trajectory_directory, f"{self.trajectory_prefix}.eq.lambda_{lambda_state}.snapshots.npy") for lambda_state in [0, 1]}
+        self._snapshot_stores = {lambda_state: SnapshotStore(capacity = snapshot_capacity, filename = snapshot_filenames[lambda_state]) for lambda_state in [0, 1]}
         self._eq_timers = {0: [], 1: []}
         self._neq_timers = {'forward': [], 'reverse': []}
 
@@ -193,7 +216,7 @@ class SequentialMonteCarlo():
 
         #instantiate thermodynamic state
         lambda_alchemical_state = RelativeAlchemicalState.from_system(self.factory.hybrid_system)
-        lambda_alchemical_state.set_alchemical_parameters(0.0, LambdaProtocol(functions = self.lambda_protocol))
+        lambda_alchemical_state.set_alchemical_parameters(0.0, self.lambda_protocol_class)
         self.thermodynamic_state = CompoundThermodynamicState(ThermodynamicState(self.factory.hybrid_system, temperature = self.temperature),composable_states = [lambda_alchemical_state])
 
         # set the SamplerState for the lambda 0 and 1 equilibrium simulations
@@ -253,7 +276,8 @@ class SequentialMonteCarlo():
             _logger.debug(f"found internal parallelism; activating client with the following parallelism parameters: {self.parallelism_parameters}")
             #we have to activate the client
             self.parallelism.activate_client(library = self.parallelism_parameters['library'],
-                                             num_processes = self.parallelism_parameters['num_processes'])
+                                             num_processes = self.parallelism_parameters['num_processes'],
+                                             cluster_kwargs = self.parallelism_parameters.get('cluster_kwargs', None))
             workers = list(self.parallelism.workers.values())
         elif self.external_parallelism:
             #the client is already active
@@ -307,7 +331,8 @@ class SequentialMonteCarlo():
             protocols = {'forward': np.linspace(0,1, 1000), 'reverse': np.linspace(1,0,1000)},
             num_integration_steps = 1,
             return_timer = False,
-            rethermalize = False):
+            rethermalize = False,
+            target_uncertainty = None):
         """
         Conduct vanilla AIS (i.e. nonequilibrium switching FEP) with a given protocol (for each direction), specified annealing time per lambda, and support for rethermalization (i.e. velocity resampling)
         NOTE: AIS is NaN-safe
@@ -315,7 +340,7 @@ class SequentialMonteCarlo():
         Arguments
         ----------
         num_particles : int
-            number of particles to run in each direction
+            number of particles to run in each direction (the maximum number of particles if target_uncertainty is not None)
         protocols : dict of {direction : np.array}, default {'forward': np.linspace(0,1, 1000), 'reverse': np.linspace(1,0,1000)},
             the dictionary of forward and reverse protocols.  if None, the protocols will be trailblazed.
         num_integration_steps : int
@@ -324,6 +349,9 @@ class SequentialMonteCarlo():
             whether to time the annealing protocol
         rethermalize : bool, default False
             whether to rethermalize velocities after proposal
+        target_uncertainty : float, default None
+            if not None, particles are launched on-the-fly and the annealing of a direction stops as soon as the (jackknife) uncertainty of its
+            online free energy estimate falls below target_uncertainty (in kT), rather than after num_particles particles
         """
         _logger.debug(f"conducting vanilla AIS")
         directions = list(protocols.keys())
@@ -341,17 +369,101 @@ class SequentialMonteCarlo():
         remote_worker = 'remote' if self.parallelism.client is not None else self
         _logger.debug(f"\tthe remote worker is: {remote_worker}")
 
-        sMC_futures = {_direction: None for _direction in directions} # initialize futures with None objects (we only collect these once)
-        sMC_sampler_states = {_direction: np.array([self.pull_trajectory_snapshot(int(self.protocols[_direction][0])) for _ in range(num_particles)]) for _direction in directions}
-        #Note: we can also add functionality to launch jobs on-the-fly, but for now we just randomly pull equilibrium snapshots from a pre-computed equilibrium distribution
         self.sMC_timers = {_direction: None for _direction in directions} #the timers are collected once per particle
         sMC_cumulative_works = {_direction : None for _direction in directions} #again, theses are only collected once
         worker_retrieval = {} #this is an on-the-fly timer for each direction...
         self.particle_failures = {_direction: None for _direction in directions} #log the particle failures
         self.endstate_corrections = {_direction: None for _direction in directions} # log the endstate corrections
 
+        if target_uncertainty is not None:
+            collected_results, self.online_free_energy = self._anneal_until_converged(directions = directions,
+                                                                                      max_particles = num_particles,
+                                                                                      target_uncertainty = target_uncertainty,
+                                                                                      remote_worker = remote_worker,
+                                                                                      workers = workers,
+                                                                                      num_integration_steps = num_integration_steps,
+                                                                                      return_timer = return_timer,
+                                                                                      rethermalize = rethermalize)
+        else:
+            self.online_free_energy = {_direction: OnlineFreeEnergyEstimator() for _direction in directions}
+            collected_results = self._anneal_all(directions = directions,
+                                                 num_particles = num_particles,
+                                                 remote_worker = remote_worker,
+                                                 workers = workers,
+                                                 num_integration_steps = num_integration_steps,
+                                                 return_timer = return_timer,
+                                                 rethermalize = rethermalize)
+
+        #now we collect the finished futures
         for _direction in directions:
             worker_retrieval[_direction] = time.time()
+            _futures = collected_results[_direction]
+
+            #collect tuple results
+            _incremental_works = [_iter[0] for _iter in _futures]
+            _sampler_states = [_iter[1] for _iter in _futures]
+            _timers = [_iter[2] for _iter in _futures]
+            _passes = [_iter[3] for _iter in _futures]
+            return_endstate_corrections = [_iter[4] for _iter in _futures]
+            pass_indices = [index for index in range(len(_futures)) if _passes[index] == True]
+            successful_incremental_works = [item for index, item in enumerate(_incremental_works) if _passes[index] == True]
+            failed_annealing_jobs = [index for index, item in enumerate(_incremental_works) if _passes[index] == False]
+            assert all(q is not None for q in successful_incremental_works), f"all passing annealing jobs have been filtered but are still returning NoneType objects"
+            _logger.debug(f"\tfailed annealing jobs: {failed_annealing_jobs}")
+            self.particle_failures[_direction] = failed_annealing_jobs if len(failed_annealing_jobs) > 0 else None
+            self.endstate_corrections[_direction] = [item for index, item in enumerate(return_endstate_corrections) if _passes[index] == True]
+
+            #append the incremental works
+            _logger.debug(f"\tincremental works for direction {_direction}: {np.array(_incremental_works).shape}")
+            _concatenated_incremental_work = np.concatenate((np.array([np.zeros(len(successful_incremental_works))]).T, np.array(successful_incremental_works)), axis = 1)
+            sMC_cumulative_works[_direction] = np.cumsum(_concatenated_incremental_work, axis = 1)
+            _logger.debug(f"\tsMC cumulative works for direction {_direction}: {sMC_cumulative_works[_direction]}")
+            assert np.std(sMC_cumulative_works[_direction][:,0]) <= np.std(sMC_cumulative_works[_direction][:,-1]), f"the variance of the particle weights is not increasing..."
+            if target_uncertainty is None:
+                self.online_free_energy[_direction].add_particles(sMC_cumulative_works[_direction][:,-1])
+
+
+            #append the _timers
+            self.sMC_timers[_direction] = _timers if return_timer else None
+
+            print(f"\t{_direction} retrieval time: {time.time() - worker_retrieval[_direction]}")
+
+        _logger.debug(f"deactivating annealing workers...")
+        self._deactivate_annealing_workers()
+        self.compute_sMC_free_energy(sMC_cumulative_works)
+        _logger.debug(f"terminating AIS successfully!")
+
+    def _anneal_all(self, directions, num_particles, remote_worker, workers, num_integration_steps, return_timer, rethermalize):
+        """
+        internal method to anneal a fixed number of AIS particles in every direction along self.protocols
+
+        Arguments
+        ---------
+        directions : list of str
+            the directions to anneal
+        num_particles : int
+            number of particles to run in each direction
+        remote_worker : str or SequentialMonteCarlo
+            the remote worker
+        workers : list of str or None
+            the available workers
+        num_integration_steps : int
+            number of integration steps per proposal
+        return_timer : bool
+            whether to time the annealing protocol
+        rethermalize : bool
+            whether to rethermalize velocities after proposal
+
+        Returns
+        -------
+        collected_results : dict of {str: list}
+            the call_anneal_method results of the particles of every direction
+        """
+        sMC_futures = {_direction: None for _direction in directions} # initialize futures with None objects (we only collect these once)
+        sMC_sampler_states = {_direction: np.array([self.pull_trajectory_snapshot(int(self.protocols[_direction][0])) for _ in range(num_particles)]) for _direction in directions}
+        #Note: we randomly pull equilibrium snapshots from a pre-computed equilibrium distribution; see `_anneal_until_converged` to launch jobs on-the-fly
+
+        for _direction in directions:
             _logger.info(f"entering {_direction} direction to launch annealing jobs.")
             #make iterable lists for anneal deployment
             iterables = []
@@ -381,46 +493,103 @@ class SequentialMonteCarlo():
         all_futures = [item for sublist in list(sMC_futures.values()) for item in sublist]
         self.parallelism.progress(futures = all_futures)
 
-        #now we collect the finished futures
-        _collected_observables = {}
+        collected_results = {}
         for _direction in directions:
             _logger.debug(f"collecting annealing jobs in direction {_direction}...")
-            _futures = self.parallelism.gather_results(futures = sMC_futures[_direction], omit_errors = True)
+            collected_results[_direction] = self.parallelism.gather_results(futures = sMC_futures[_direction], omit_errors = True)
             if remote_worker == 'remote':
-                assert len(_futures) == num_particles, f"num_particles ({num_particles}) and the length of the collected futures ({len(_futures)}) do not match.  _all_anneal_method is supposed to be safe!"
+                assert len(collected_results[_direction]) == num_particles, f"num_particles ({num_particles}) and the length of the collected futures ({len(collected_results[_direction])}) do not match.  _all_anneal_method is supposed to be safe!"
 
+        return collected_results
 
-            #collect tuple results
-            _incremental_works = [_iter[0] for _iter in _futures]
-            _sampler_states = [_iter[1] for _iter in _futures]
-            _timers = [_iter[2] for _iter in _futures]
-            _passes = [_iter[3] for _iter in _futures]
-            return_endstate_corrections = [_iter[4] for _iter in _futures]
-            pass_indices = [index for index in range(num_particles) if _passes[index] == True]
-            successful_incremental_works = [item for index, item in enumerate(_incremental_works) if _passes[index] == True]
-            failed_annealing_jobs = [index for index, item in enumerate(_incremental_works) if _passes[index] == False]
-            assert all(q is not None for q in successful_incremental_works), f"all passing annealing jobs have been filtered but are still returning NoneType objects"
-            _logger.debug(f"\tfailed annealing jobs: {failed_annealing_jobs}")
-            self.particle_failures[_direction] = failed_annealing_jobs if len(failed_annealing_jobs) > 0 else None
-            self.endstate_corrections[_direction] = [item for index, item in enumerate(return_endstate_corrections) if _passes[index] == True]
-
-            #append the incremental works
-            _logger.debug(f"\tincremental works for direction {_direction}: {np.array(_incremental_works).shape}")
-            _concatenated_incremental_work = np.concatenate((np.array([np.zeros(len(successful_incremental_works))]).T, np.array(successful_incremental_works)), axis = 1)
-            sMC_cumulative_works[_direction] = np.cumsum(_concatenated_incremental_work, axis = 1)
-            _logger.debug(f"\tsMC cumulative works for direction {_direction}: {sMC_cumulative_works[_direction]}")
-            assert np.std(sMC_cumulative_works[_direction][:,0]) <= np.std(sMC_cumulative_works[_direction][:,-1]), f"the variance of the particle weights is not increasing..."
-
+    def _anneal_until_converged(self, directions, max_particles, target_uncertainty, remote_worker, workers, num_integration_steps, return_timer, rethermalize):
+        """
+        internal method to anneal AIS particles on-the-fly until the uncertainty of the online free energy estimate of every direction falls below a target.
+        a window of particles (two per worker) is kept in flight per direction; every completed particle updates the `OnlineFreeEnergyEstimator`
+        of its direction, and a new particle is only launched if the direction has not converged (and fewer than max_particles were launched).
+        particles that are still in flight when their direction converges are cancelled.
+        particles whose job raises are recorded as failures (and do not update the estimator).
 
-            #append the _timers
-            self.sMC_timers[_direction] = _timers if return_timer else None
+        Arguments
+        ---------
+        directions : list of str
+            the directions to anneal
+        max_particles : int
+            maximum number of particles to run in each direction
+        target_uncertainty : float
+            the target uncertainty (kT) of the free energy estimate of every direction
+        remote_worker : str or SequentialMonteCarlo
+            the remote worker
+        workers : list of str or None
+            the available workers
+        num_integration_steps : int
+            number of integration steps per proposal
+        return_timer : bool
+            whether to time the annealing protocol
+        rethermalize : bool
+            whether to rethermalize velocities after proposal
 
-            print(f"\t{_direction} retrieval time: {time.time() - worker_retrieval[_direction]}")
+        Returns
+        -------
+        collected_results : dict of {str: list}
+            the call_anneal_method results of the collected particles of every direction (in order of completion)
+        online_free_energy : dict of {str: OnlineFreeEnergyEstimator}
+            the online free energy estimator of every direction
+        """
+        window = max(1, 2 * len(self.parallelism.workers))
+        online_free_energy = {_direction: OnlineFreeEnergyEstimator() for _direction in directions}
+        collected_results = {_direction: [] for _direction in directions}
+        launched = {_direction: 0 for _direction in directions}
+        converged = {_direction: False for _direction in directions}
+        jobs = {} #future: direction
+        pending = self.parallelism.as_completed()
+
+        def submit_particle(_direction):
+            """submit the annealing of a new particle in the given direction"""
+            trajectory_filename = None if self.ncmc_save_interval is None else self.neq_traj_filename[_direction] + f".iteration_{launched[_direction]:04}.h5"
+            future = self.parallelism.submit(call_anneal_method,
+                                             remote_worker, #remote_worker
+                                             self.pull_trajectory_snapshot(int(self.protocols[_direction][0])), #sampler_state
+                                             self.protocols[_direction], #lambdas
+                                             trajectory_filename, #noneq_trajectory_filename
+                                             num_integration_steps, #num_integration_steps
+                                             return_timer, #return timer
+                                             False, #return_sampler_state
+                                             rethermalize, #rethermalize
+                                             True, # whether to compute incremental works
+                                             workers = workers)
+            jobs[future] = _direction
+            pending.add(future)
+            launched[_direction] += 1
 
-        _logger.debug(f"deactivating annealing workers...")
-        self._deactivate_annealing_workers()
-        self.compute_sMC_free_energy(sMC_cumulative_works)
-        _logger.debug(f"terminating AIS successfully!")
+        for _direction in directions:
+            _logger.info(f"launching {_direction} annealing jobs until the free energy uncertainty is below {target_uncertainty} kT.")
+            for _ in range(min(window, max_particles)):
+                submit_particle(_direction)
+
+        for future in pending:
+            _direction = jobs.pop(future)
+            if converged[_direction]: #the particle was cancelled or completed after convergence
+                continue
+            try:
+                result = future.result()
+            except Exception as e: #record the particle as failed (like an unsuccessful `call_anneal_method`) and carry on
+                _logger.warning(f"\t{_direction} annealing job failed with {type(e).__name__}: {e}; recording the particle as a failure.")
+                result = (None, None, None, False, None)
+            collected_results[_direction].append(result)
+            if result[3]:
+                online_free_energy[_direction].add_particles(np.sum(result[0]))
+
+            if online_free_energy[_direction].converged(target_uncertainty):
+                converged[_direction] = True
+                _logger.info(f"\t{_direction} free energy converged to {online_free_energy[_direction].free_energy} +/- {online_free_energy[_direction].uncertainty} kT after {len(collected_results[_direction])} particles.")
+                self.parallelism.cancel([_future for _future, _future_direction in jobs.items() if _future_direction == _direction])
+            elif launched[_direction] < max_particles:
+                submit_particle(_direction)
+            elif len(collected_results[_direction]) == max_particles:
+                _logger.warning(f"\t{_direction} free energy uncertainty ({online_free_energy[_direction].uncertainty} kT) did not reach the target of {target_uncertainty} kT with {max_particles} particles.")
+
+        return collected_results, online_free_energy
 
 
 
@@ -447,11 +616,13 @@ class SequentialMonteCarlo():
             if None, trailblazing is not conducted;
             else: the dict must have the following format:
                 {'criterion': str, 'threshold': float}
+            and can specify the number of candidate lambdas evaluated (on the annealing workers) per round of the binary search
+            with the optional 'num_candidates': int (default 1)
         resample : dict, default None
             the resample dict specifies the resampling criterion and threshold, as well as the resampling method used.  if None, no resampling is conduced;
             otherwise, the resample dict must take the following form:
             {'criterion': str, 'method': str, 'threshold': float}
-            the directions to run.
+            and can adapt the threshold with the optional keys {'decay': float, 'min_threshold': float} (see `_validate_resample`).
         num_integration_steps : int
             number of integration steps per proposal
         return_timer : bool, default False
@@ -478,29 +649,23 @@ class SequentialMonteCarlo():
             _logger.debug(f"protocols is None; attempting to parse 'trailblaze'")
             assert trailblaze is not None, f"both 'protocols' and 'trailblaze' are None; there is no annealing to conduct."
             if trailblaze is not None:
-                assert set(trailblaze.keys()) == set(['criterion', 'threshold']), f"the trailblaze keys are not supported"
+                assert set(['criterion', 'threshold']) <= set(trailblaze.keys()) <= set(['criterion', 'threshold', 'num_candidates']), f"the trailblaze keys are not supported"
                 assert trailblaze['criterion'] in list(self.supported_observables.keys()), f"the specified trailblazing criterion is not supported"
                 assert type(trailblaze['threshold']) == float, f"the specified trailblaze threshold is not a float"
                 _trailblaze = True
 
-        #create end-to-ends
+        #create end-to-ends; the starting and finish lines are set by the direction (and checked against the protocols, if given)
         _logger.debug(f"conducting end-to-end builds...")
-        if 'forward' in directions:
-            assert protocols['forward'][0] == 0.0 and protocols['forward'][-1] == 1.0, f"the forward protocol must start at 0.0 and end at 1.0"
-            starting_lines['forward'] = 0.0
-            finish_lines['forward'] = 1.0
-        if 'reverse' in directions:
-            assert protocols['reverse'][0] == 1.0 and protocols['reverse'][-1] == 0.0, f"the reverse protocol must start at 1.0 and end at 0.0"
-            starting_lines['reverse'] = 1.0
-            finish_lines['reverse'] = 0.0
+        for _direction in directions:
+            starting_lines[_direction], finish_lines[_direction] = (0.0, 1.0) if _direction == 'forward' else (1.0, 0.0)
+            if protocols is not None:
+                assert _direction in protocols, f"there is no protocol for the {_direction} direction"
+                assert protocols[_direction][0] == starting_lines[_direction] and protocols[_direction][-1] == finish_lines[_direction], f"the {_direction} protocol must start at {starting_lines[_direction]} and end at {finish_lines[_direction]}"
 
         #check resample
         if resample is not None:
             _logger.debug(f"resample is not None; conducting resampling assertions...")
-            assert set(resample.keys()) == set(['criterion', 'method', 'threshold']), f"'resample does not contain the appropriate keys.  see documentation'"
-            assert resample['criterion'] in list(self.supported_observables.keys()), f"the specified resampling criterion is not supported"
-            assert resample['method'] in list(self.supported_resampling_methods), f"the specified resampling method is not supported."
-            assert type(resample['threshold'] == float), f"the resampling thrshold must be a float"
+            self._validate_resample(resample)
             _resample = True
         else:
             _logger.debug(f"resampling is None")
@@ -524,21 +689,18 @@ class SequentialMonteCarlo():
         sMC_futures = {_direction: None for _direction in directions}
         _logger.debug(f"\tsMC_futures: {sMC_futures}")
 
-        sMC_sampler_states = {_direction: np.array([self.pull_trajectory_snapshot(int(self.protocols[_direction][0])) for _ in range(num_particles)]) for _direction in directions}
-        sMC_sampler_states = {_direction: None for _direction in directions}
+        sMC_sampler_states = {_direction: None for _direction in directions} #the sampler states are pulled in the first iteration
         _logger.debug(f"\tsMC_sampler_states: {sMC_sampler_states}")
 
         sMC_timers = {_direction: [] for _direction in directions}
         _logger.debug(f"sMC_timers: {sMC_timers}")
 
         sMC_incremental_works = {_direction: None for _direction in directions}
-        _logger.debug(f"\tsMC_incremental_works: {sMC_cumulative_works}")
-
 
         sMC_cumulative_works = {_direction : [np.zeros(num_particles)] for _direction in directions}
         _logger.debug(f"\tsMC_cumulative_works: {sMC_cumulative_works}")
 
-        sMC_observables = {_direction : [] for _direction in directions}
+        sMC_observables = {_direction : [1.0] for _direction in directions} #the normalized observable of the unweighted starting particles is 1
         _logger.debug(f"\tsMC_observables: {sMC_observables}")
 
         sMC_particle_ancestries = {_direction : [np.arange(num_particles)] for _direction in directions}
@@ -546,9 +708,11 @@ class SequentialMonteCarlo():
 
         worker_retrieval = {}
         _lambdas = {}
+        resample_thresholds = {_direction: resample['threshold'] for _direction in directions} if _resample else None
+        online_free_energy = {_direction: OnlineFreeEnergyEstimator(num_particles) for _direction in directions}
 
         #now we can launch annealing jobs and manage them on-the-fly
-        current_lambdas = starting_lines
+        current_lambdas = dict(starting_lines)
         iteration_number = 0
 
         _logger.debug(f"commencing annealing...")
@@ -575,11 +739,13 @@ class SequentialMonteCarlo():
                                                                                                  cumulative_works = sMC_cumulative_works[_direction][-2],
                                                                                                  observable = resample['criterion'],
                                                                                                  resampling_method = resample['method'],
-                                                                                                 resample_observable_threshold = resample['threshold'])
+                                                                                                 resample_observable_threshold = resample_thresholds[_direction])
+                    resample_thresholds[_direction] = self._update_resample_threshold(resample_thresholds[_direction], resample, resample_bool)
                     if resample_bool:
                         _logger.debug(f"\tresample is True")
                         sMC_observables[_direction][-1] = normalized_observable_value #update the previous observables with the resampled observable
                         sMC_cumulative_works[_direction][-1] = resampled_works #update the ultimate cumulative work
+                        online_free_energy[_direction].resample()
 
                         #we need a deepcopy to prevent annealing over the same sampler state in a single iteration with local annealing
                         new_sampler_states = np.array([copy.deepcopy(sMC_sampler_states[_direction][i]) for i in resampled_indices])
@@ -622,7 +788,8 @@ class SequentialMonteCarlo():
                                                                                                end_val = finish_lines[_direction],
                                                                                                observable = self.supported_observables[trailblaze['criterion']],
                                                                                                observable_threshold = trailblaze['threshold'] * sMC_observables[_direction][-1],
-                                                                                               initial_guess = initial_guess)
+                                                                                               initial_guess = initial_guess,
+                                                                                               num_candidates = trailblaze.get('num_candidates', 1))
                     sMC_incremental_works.update({_direction: incremental_works})
                     _logger.info(f"\t\tlambda increments: {current_lambdas[_direction]} to {_new_lambda}.")
                     _logger.info(f"\t\tnormalized observable: {normalized_observable}.  Observable threshold is {trailblaze['threshold'] * sMC_observables[_direction][-1]}")
@@ -631,15 +798,18 @@ class SequentialMonteCarlo():
                     _lambdas.update({_direction: np.array([current_lambdas[_direction], _new_lambda])})
                     #the current lambdas will be updated at the end of the loop
                 else:
-                    start_val, end_val = self.protocols[_direction][iteration_number], self.protocols[_direction][iteration_number + 1]
+                    start_val, end_val = protocols[_direction][iteration_number], protocols[_direction][iteration_number + 1]
                     _logger.debug(f"\tnot trailblazing; annealing lambda from {start_val} to {end_val}")
-                    self.thermodynamic_state.set_alchemical_parameters(start_val, LambdaProtocol(functions = self.lambda_protocol))
-                    current_rps = np.array([compute_reduced_potential(self.thermodynamic_state, sampler_state) for sampler_state in sampler_states])
+                    #compute the reduced potentials of all particles at both lambdas in one batch
+                    reduced_potentials = self._compute_reduced_potentials(sMC_sampler_states[_direction], [start_val, end_val])
+                    incremental_works = reduced_potentials[:,1] - reduced_potentials[:,0]
                     #if we are not trailblazing, then the local observable is computed from the resampling observable
-                    normalized_observable, incremental_works = compute_lambda_increment(new_val, sMC_sampler_states[_direction], resample['criterion'], current_rps, sMC_cumulative_works[_direction][-1])
+                    observable = self.supported_observables[resample['criterion'] if _resample else 'ESS']
+                    normalized_observable = observable(sMC_cumulative_works[_direction][-1], incremental_works)
                     sMC_incremental_works.update({_direction: incremental_works})
+                    self.protocols[_direction].append(end_val)
                     sMC_observables[_direction].append(normalized_observable)
-                    _lambdas.update({_direction: np.array(start_val, end_val)})
+                    _lambdas.update({_direction: np.array([start_val, end_val])})
                     #the current lambdas will be updated at the end of the loop
 
             #now we want to execute distributed/local annealing depending on the remote worker
@@ -667,7 +837,7 @@ class SequentialMonteCarlo():
 
                 for job in range(num_particles):
                     if self.ncmc_save_interval is not None: #check if we should make 'trajectory_filename' not None
-                        iterables[2][job] = self.neq_traj_filename[_direction] + f".iteration_{job:04}.h5"
+                        iterables[3][job] = self.neq_traj_filename[_direction] + f".iteration_{job:04}.h5"
 
 
                 scattered_futures = [self.parallelism.scatter(iterable) for iterable in iterables]
@@ -698,6 +868,8 @@ class SequentialMonteCarlo():
                 assert all(abs(i - j) < DISTRIBUTED_ERROR_TOLERANCE for i, j in zip(np.array(_incremental_works).flatten(), sMC_incremental_works[_direction])), f"the incremental works between the local and distributed platforms do not match"
                 #if this is true, we can update the cumulative work dict
                 sMC_cumulative_works[_direction].append(np.add(sMC_cumulative_works[_direction][-1], sMC_incremental_works[_direction]))
+                online_free_energy[_direction].update(sMC_incremental_works[_direction])
+                _logger.info(f"\t\tonline free energy estimate: {online_free_energy[_direction].free_energy} +/- {online_free_energy[_direction].uncertainty}")
 
                 #append the sampler_states
                 sMC_sampler_states[_direction] = np.array(_sampler_states)
@@ -724,6 +896,7 @@ class SequentialMonteCarlo():
             sMC_cumulative_works.update({_direction: np.array(_lst).T}) #the cumulative work dimensions should be num_particles * num_iterations
         self.compute_sMC_free_energy(sMC_cumulative_works)
         self.sMC_observables = sMC_observables
+        self.online_free_energy = online_free_energy
         if _resample:
             _logger.debug(f"computing particle ancestries and survival rates...")
             self.survival_rate = compute_survival_rate(sMC_particle_ancestries)
@@ -734,6 +907,246 @@ class SequentialMonteCarlo():
             self.particle_ancestries = None
 
 
+    def asynchronous_sMC(self,
+                         num_particles,
+                         protocols = {'forward': np.linspace(0,1, 1000), 'reverse': np.linspace(1,0,1000)},
+                         resample = None,
+                         resample_interval = None,
+                         segment_length = None,
+                         num_integration_steps = 1,
+                         return_timer = False,
+                         rethermalize = False):
+        """
+        Conduct SequentialMonteCarlo sampling along fixed protocols with asynchronous particle propagation.
+        Rather than annealing all particles in lock-step over every lambda increment, each particle is resubmitted as soon as its
+        last annealing segment returns; particles of a direction only synchronize when a resampling attempt is due.
+        Directions never synchronize with one another, so one direction can resample while the particles of the other direction are annealing.
+        With a dask client, the sampler states stay on the workers: after resampling, offspring are copied on the worker that holds their ancestor
+        and only moved to another worker when load balancing requires it (see `assign_offspring_workers`).
+
+        Arguments
+        ----------
+        num_particles : int
+            number of particles to run in each direction
+        protocols : dict of {direction : np.array}, default {'forward': np.linspace(0,1, 1000), 'reverse': np.linspace(1,0,1000)},
+            the dictionary of forward and/or reverse protocols; the keys are the directions to run.
+        resample : dict, default None
+            the resample dict specifies the resampling criterion and threshold, as well as the resampling method used.  if None, no resampling is conduced
+            (and the particles never synchronize, as in AIS); otherwise, the resample dict must take the following form:
+            {'criterion': str, 'method': str, 'threshold': float}
+            and can adapt the threshold with the optional keys {'decay': float, 'min_threshold': float} (see `_validate_resample`).
+        resample_interval : int, default None
+            number of lambda increments between resampling attempts; if None, resampling is attempted at every lambda increment
+        segment_length : int, default None
+            maximum number of lambda increments annealed in a single job; if None, a job anneals all of the increments up to the next resampling attempt
+        num_integration_steps : int
+            number of integration steps per proposal
+        return_timer : bool, default False
+            whether to time the annealing protocol
+        rethermalize : bool, default False
+            whether to rethermalize velocities after proposal
+        """
+        _logger.debug(f"conducting asynchronous sMC...")
+        directions = list(protocols.keys())
+        for _direction in directions:
+            assert _direction in ['forward', 'reverse'], f"direction {_direction} is not an appropriate direction"
+            assert type(protocols[_direction]) == np.ndarray, f"all dictionary values in 'protocols' must be np.ndarrays"
+        if resample is not None:
+            self._validate_resample(resample)
+        assert segment_length is None or segment_length > 0, f"the segment length must be a positive integer"
+        self.protocols = protocols
+
+        #the lambda indices at which the particles of each direction synchronize
+        num_increments = {_direction: len(protocols[_direction]) - 1 for _direction in directions}
+        _resample_interval = 1 if resample_interval is None else resample_interval
+        sync_points = {}
+        for _direction in directions:
+            sync_points[_direction] = [num_increments[_direction]] if resample is None else list(range(_resample_interval, num_increments[_direction], _resample_interval)) + [num_increments[_direction]]
+        _logger.debug(f"\tsynchronization points: {sync_points}")
+
+        self._activate_annealing_workers()
+        if self.internal_parallelism:
+            workers = None
+        elif self.external_parallelism:
+            workers = self.parallelism_parameters['available_workers']
+        remote_worker = 'remote' if self.parallelism.client is not None else self
+        _logger.debug(f"\tthe remote worker is: {remote_worker}")
+        #only dask can pin a particle to the worker that holds its sampler state
+        resident = self.parallelism.client is not None and self.parallelism.library[0] == 'dask'
+
+        sMC_sampler_states = {_direction: np.array([self.pull_trajectory_snapshot(int(protocols[_direction][0])) for _ in range(num_particles)]) for _direction in directions}
+        particle_workers = {_direction: [None] * num_particles for _direction in directions} #the worker holding each resident particle
+        particle_inputs = {_direction: [None] * num_particles for _direction in directions} #(sampler state, dependency) of each resident particle's next job
+        generations = {_direction: 0 for _direction in directions}
+        if resident:
+            for _direction in directions:
+                particle_inputs[_direction] = [(sampler_state, None) for sampler_state in sMC_sampler_states[_direction]]
+        sMC_incremental_works = {_direction: np.zeros((num_particles, num_increments[_direction])) for _direction in directions}
+        sMC_cumulative_works = {_direction: [np.zeros(num_particles)] for _direction in directions} #one entry per lambda index; filled at synchronization
+        sMC_observables = {_direction: [] for _direction in directions}
+        sMC_particle_ancestries = {_direction: [np.arange(num_particles)] for _direction in directions}
+        sMC_timers = {_direction: [[] for _ in range(num_particles)] for _direction in directions}
+        last_sync = {_direction: 0 for _direction in directions}
+        resample_thresholds = {_direction: resample['threshold'] for _direction in directions} if resample is not None else None
+        num_synchronized = {_direction: 0 for _direction in directions}
+        online_free_energy = {_direction: OnlineFreeEnergyEstimator(num_particles) for _direction in directions}
+
+        jobs = {} #future: (direction, particle index, start lambda index, end lambda index)
+        pending = self.parallelism.as_completed()
+
+        def submit_segment(_direction, particle, start):
+            """submit the annealing of a particle from lambda index `start` to the next job boundary"""
+            end = min(index for index in sync_points[_direction] if index > start)
+            if segment_length is not None:
+                end = min(end, start + segment_length)
+            if resident:
+                sampler_state, dependency = particle_inputs[_direction][particle]
+                particle_inputs[_direction][particle] = (None, None)
+                future = self.parallelism.submit(call_anneal_resident_method,
+                                                 remote_worker, #remote_worker
+                                                 (_direction, generations[_direction], particle), #particle_key
+                                                 sampler_state, #sampler_state (None if resident on the worker)
+                                                 protocols[_direction][start:end + 1], #lambdas
+                                                 None, #noneq_trajectory_filename
+                                                 num_integration_steps, #num_integration_steps
+                                                 return_timer, #return timer
+                                                 rethermalize, #rethermalize
+                                                 True, # whether to compute incremental works
+                                                 dependency, #dependency
+                                                 workers = workers if particle_workers[_direction][particle] is None else [particle_workers[_direction][particle]])
+                jobs[future] = (_direction, particle, start, end)
+                pending.add(future)
+                return
+            future = self.parallelism.submit(call_anneal_method,
+                                             remote_worker, #remote_worker
+                                             sMC_sampler_states[_direction][particle], #sampler_state
+                                             protocols[_direction][start:end + 1], #lambdas
+                                             None, #noneq_trajectory_filename
+                                             num_integration_steps, #num_integration_steps
+                                             return_timer, #return timer
+                                             True, #return_sampler_state
+                                             rethermalize, #rethermalize
+                                             True, # whether to compute incremental works
+                                             workers = workers)
+            jobs[future] = (_direction, particle, start, end)
+            pending.add(future)
+
+        start_timer = time.time()
+        for _direction in directions:
+            _logger.info(f"launching {_direction} annealing jobs.")
+            for particle in range(num_particles):
+                submit_segment(_direction, particle, 0)
+
+        for future in pending:
+            _direction, particle, start, end = jobs.pop(future)
+            _incremental_works, _sampler_state, _timers, _pass, _ = future.result()
+            if not _pass:
+                raise Exception(f"particle {particle} failed to anneal from lambda {protocols[_direction][start]} to {protocols[_direction][end]} in the {_direction} direction")
+            sMC_incremental_works[_direction][particle, start:end] = _incremental_works
+            if resident:
+                particle_workers[_direction][particle] = _sampler_state #the address of the worker holding the sampler state
+            else:
+                sMC_sampler_states[_direction][particle] = _sampler_state
+            if return_timer:
+                sMC_timers[_direction][particle].extend(list(_timers))
+
+            if end not in sync_points[_direction]: #annealing-only segment; advance the particle immediately
+                submit_segment(_direction, particle, end)
+                continue
+
+            num_synchronized[_direction] += 1
+            if num_synchronized[_direction] < num_particles: #wait for the rest of the particles of this direction
+                continue
+
+            #all particles of the direction reached the synchronization point
+            num_synchronized[_direction] = 0
+            previous_sync, last_sync[_direction] = last_sync[_direction], end
+            block_works = sMC_incremental_works[_direction][:, previous_sync:end]
+            sMC_cumulative_works[_direction] += list(sMC_cumulative_works[_direction][previous_sync] + np.cumsum(block_works, axis = 1).T)
+            for incremental_works in block_works.T:
+                online_free_energy[_direction].update(incremental_works)
+            _logger.info(f"\t{_direction} particles synchronized at lambda {protocols[_direction][end]} after {time.time() - start_timer} seconds.")
+            _logger.info(f"\tonline {_direction} free energy estimate: {online_free_energy[_direction].free_energy} +/- {online_free_energy[_direction].uncertainty}")
+
+            if end == num_increments[_direction]:
+                _logger.info(f"\tdirection {_direction} is complete.")
+                continue
+
+            normalized_observable_value, resampled_works, resampled_indices, resample_bool = self._resample(incremental_works = np.sum(block_works, axis = 1),
+                                                                                                             cumulative_works = sMC_cumulative_works[_direction][previous_sync],
+                                                                                                             observable = resample['criterion'],
+                                                                                                             resampling_method = resample['method'],
+                                                                                                             resample_observable_threshold = resample_thresholds[_direction])
+            resample_thresholds[_direction] = self._update_resample_threshold(resample_thresholds[_direction], resample, resample_bool)
+            sMC_observables[_direction].append(normalized_observable_value)
+            if resample_bool:
+                _logger.debug(f"\tresample is True")
+                sMC_cumulative_works[_direction][-1] = resampled_works
+                online_free_energy[_direction].resample()
+                if resident:
+                    self._resample_resident_particles(_direction, generations, resampled_indices, particle_workers, particle_inputs, remote_worker, workers)
+                else:
+                    #we need a deepcopy to prevent annealing over the same sampler state with local annealing
+                    sMC_sampler_states[_direction] = np.array([copy.deepcopy(sMC_sampler_states[_direction][i]) for i in resampled_indices])
+            sMC_particle_ancestries[_direction].append(np.array([sMC_particle_ancestries[_direction][-1][i] for i in resampled_indices]))
+
+            for particle in range(num_particles):
+                submit_segment(_direction, particle, end)
+
+        _logger.debug(f"deactivating annealing workers...")
+        self._deactivate_annealing_workers()
+        self.compute_sMC_free_energy({_direction: np.array(sMC_cumulative_works[_direction]).T for _direction in directions})
+        self.sMC_observables = sMC_observables
+        self.online_free_energy = online_free_energy
+        self.sMC_timers = sMC_timers if return_timer else None
+        if resample is not None:
+            self.survival_rate = compute_survival_rate(sMC_particle_ancestries)
+            self.particle_ancestries = {_direction : np.array([q.flatten() for q in sMC_particle_ancestries[_direction]]) for _direction in sMC_particle_ancestries.keys()}
+        else:
+            self.survival_rate = None
+            self.particle_ancestries = None
+
+    def _resample_resident_particles(self, _direction, generations, resampled_indices, particle_workers, particle_inputs, remote_worker, workers):
+        """
+        internal method to resample particles whose sampler states reside on the workers.  offspring are assigned to workers with
+        `assign_offspring_workers`; offspring that stay with their ancestor are copied on the worker, and only the sampler states of
+        the other offspring are transferred (directly between workers).  `generations`, `particle_workers`, and `particle_inputs` are updated in place.
+
+        Arguments
+        ---------
+        _direction : str
+            the direction of the particles
+        generations : dict of {str: int}
+            the current generation of the particles of every direction
+        resampled_indices : np.array of ints
+            the ancestor index of every offspring
+        particle_workers : dict of {str: list}
+            the worker holding every particle of every direction
+        particle_inputs : dict of {str: list}
+            the (sampler state, dependency) of the next annealing job of every particle of every direction
+        remote_worker : str
+            the remote worker
+        workers : list of str or None
+            the available workers
+        """
+        ancestor_workers = list(particle_workers[_direction])
+        offspring_workers, transfers = assign_offspring_workers(resampled_indices, ancestor_workers, workers)
+        _logger.debug(f"\t{np.sum(transfers)} of {len(resampled_indices)} resampled particles are transferred between workers")
+
+        for worker in set(ancestor_workers):
+            copies = [(ancestor, offspring) for offspring, ancestor in enumerate(resampled_indices) if ancestor_workers[ancestor] == worker and not transfers[offspring]]
+            exports = sorted(set(ancestor for offspring, ancestor in enumerate(resampled_indices) if ancestor_workers[ancestor] == worker and transfers[offspring]))
+            resample_future = self.parallelism.submit(resample_resident_particles, remote_worker, _direction, generations[_direction], copies, exports, workers = [worker])
+            for ancestor, offspring in copies:
+                particle_inputs[_direction][offspring] = (None, resample_future)
+            exported_states = {ancestor: self.parallelism.submit(operator.getitem, resample_future, ancestor, workers = [worker]) for ancestor in exports}
+            for offspring, ancestor in enumerate(resampled_indices):
+                if ancestor_workers[ancestor] == worker and transfers[offspring]:
+                    particle_inputs[_direction][offspring] = (exported_states[ancestor], None)
+
+        particle_workers[_direction] = offspring_workers
+        generations[_direction] += 1
+
     def compute_sMC_free_energy(self, cumulative_work_dict):
         """
         Method to compute the free energy of sMC_anneal type cumultaive work dicts, whether the dicts are constructed
@@ -751,23 +1164,49 @@ class SequentialMonteCarlo():
         self.dg_EXP = {}
         for _direction, _lst in cumulative_work_dict.items():
             self.cumulative_work[_direction] = _lst
-            self.dg_EXP[_direction] = np.array([pymbar.EXP(_lst[:,i]) for i in range(_lst.shape[1])])
+            self.dg_EXP[_direction] = vectorized_EXP(_lst)
             _logger.debug(f"cumulative_work for {_direction}: {self.cumulative_work[_direction]}")
         if len(list(self.cumulative_work.keys())) == 2:
             self.dg_BAR = pymbar.BAR(self.cumulative_work['forward'][:, -1], self.cumulative_work['reverse'][:, -1])
 
+    def thermodynamic_length_optimizer(self, direction = 'forward', **kwargs):
+        """
+        Estimate the thermodynamic length of the alchemical path from the works of a previous (pilot) AIS run in the given direction.
+        The returned optimizer emits a LambdaProtocol and/or a nonequilibrium lambda schedule that equalize the dissipation per step.
+        NOTE: the pilot should not be resampled, since resampling decorrelates consecutive cumulative works.
+
+        Arguments
+        ---------
+        direction : str, default 'forward'
+            the direction of the pilot run ('forward' or 'reverse')
+        kwargs : dict
+            additional keyword arguments passed to ThermodynamicLengthOptimizer
+
+        Returns
+        -------
+        optimizer : perses.annihilation.lambda_protocol.ThermodynamicLengthOptimizer
+        """
+        assert direction in self.cumulative_work.keys() and len(self.cumulative_work[direction]) > 0, f"there are no pilot works in the {direction} direction"
+        incremental_works = np.diff(np.asarray(self.cumulative_work[direction]), axis = 1)
+        return ThermodynamicLengthOptimizer.from_incremental_works(np.asarray(self.protocols[direction]),
+                                                                   incremental_works,
+                                                                   lambda_protocol = self.lambda_protocol_class,
+                                                                   **kwargs)
+
     def minimize_sampler_states(self):
         """
         simple wrapper function to minimize the input sampler states
         """
         # initialize by minimizing
         for state in self.lambda_endstates['forward']: # 0.0, 1.0
-            self.thermodynamic_state.set_alchemical_parameters(state, LambdaProtocol(functions = self.lambda_protocol))
+            self.thermodynamic_state.set_alchemical_parameters(state, self.lambda_protocol_class)
             minimize(self.thermodynamic_state, self.sampler_states[int(state)])
 
     def pull_trajectory_snapshot(self, endstate):
         """
-        Draw randomly a single snapshot from self._eq_files_dict
+        Draw randomly a single (decorrelated, if the equilibrium data were decorrelated) equilibrium snapshot.
+        The snapshot is taken from the snapshot store of the endstate if it holds it; otherwise, it is loaded from the equilibrium trajectory files
+        (if they were written).
 
         Parameters
         ----------
@@ -780,14 +1219,25 @@ class SequentialMonteCarlo():
         """
         #pull a random index
         assert endstate in [0,1], f"the endstate ({endstate}) is not 0 or 1"
-        index = random.choice(self._eq_dict[f"{endstate}_decorrelated"])
-        files = [key for key in self._eq_files_dict[endstate].keys() if index in self._eq_files_dict[endstate][key]]
-        assert len(files) == 1, f"files: {files} doesn't have one entry; index: {index}, eq_files_dict: {self._eq_files_dict[endstate]}"
-        file = files[0]
-        file_index = self._eq_files_dict[endstate][file].index(index)
+        store = self._snapshot_stores[endstate]
+        decorrelated_indices = self._eq_dict[f"{endstate}_decorrelated"]
+        if decorrelated_indices is None:
+            index = random.choice(list(store.keys()))
+        elif len(self._eq_file_indices[endstate]) > 0: #decorrelated snapshots evicted from the store are loaded from the equilibrium files
+            index = random.choice(decorrelated_indices)
+        else:
+            index = random.choice([index for index in decorrelated_indices if index in store])
 
-        #now we load file as a traj and create a sampler state with it
+        if index in store:
+            return store[index]
+
+        assert index in self._eq_file_indices[endstate], f"the snapshot {index} is neither in the snapshot store nor in the equilibrium files"
+        file, file_index = self._eq_file_indices[endstate][index]
+
+        #now we load file as a traj and create a sampler state with it;
+        #the equilibrium files hold the full hybrid system (unlike the annealing trajectories, which are written on the atom_selection_indices subset)
         traj = md.load_frame(file, file_index)
+        assert traj.n_atoms == self.factory.hybrid_topology.n_atoms, f"the equilibrium file {file} holds {traj.n_atoms} atoms rather than the {self.factory.hybrid_topology.n_atoms} atoms of the hybrid system"
         positions = traj.openmm_positions(0)
         box_vectors = traj.openmm_boxes(0)
         sampler_state = SamplerState(positions, box_vectors = box_vectors)
@@ -839,7 +1289,7 @@ class SequentialMonteCarlo():
         EquilibriumFEPTask_list = []
         for state in endstates: #iterate through the specified endstates (0 or 1) to create appropriate EquilibriumFEPTask inputs
             _logger.debug(f"\tcreating lambda state {state} EquilibriumFEPTask")
-            self.thermodynamic_state.set_alchemical_parameters(float(state), lambda_protocol = LambdaProtocol(functions = self.lambda_protocol))
+            self.thermodynamic_state.set_alchemical_parameters(float(state), lambda_protocol = self.lambda_protocol_class)
             input_dict = {'thermodynamic_state': copy.deepcopy(self.thermodynamic_state),
                           'nsteps_equil': n_steps_per_equilibration,
                           'topology': self.factory.hybrid_topology,
@@ -851,7 +1301,8 @@ class SequentialMonteCarlo():
                           'timer': timer,
                           '_minimize': minimize,
                           'file_iterator': 0,
-                          'timestep': self.timestep}
+                          'timestep': self.timestep,
+                          'return_snapshots': True}
 
 
             if self.write_traj:
@@ -889,7 +1340,9 @@ class SequentialMonteCarlo():
             else:
                 _parallel_processes = min(len(endstates), self.parallelism_parameters['num_processes'])
 
-            self.parallelism.activate_client(library = self.parallelism_parameters['library'], num_processes = _parallel_processes)
+            self.parallelism.activate_client(library = self.parallelism_parameters['library'],
+                                             num_processes = _parallel_processes,
+                                             cluster_kwargs = self.parallelism_parameters.get('cluster_kwargs', None))
             scatter_futures = self.parallelism.scatter(EquilibriumFEPTask_list)
             futures = self.parallelism.deploy(run_equilibrium, (scatter_futures,))
         else:
@@ -908,36 +1361,100 @@ class SequentialMonteCarlo():
         #the rest of the function is independent of the dask workers...
 
 
+        new_snapshots = {} #state: (snapshot indices, positions, box vectors)
         for state, eq_result in zip(endstates, eq_results):
             _logger.debug(f"\tcomputing equilibrium task future for state = {state}")
+            num_snapshots = len(self._eq_dict[f"{state}_reduced_potentials"])
+            positions, box_vectors = eq_result.outputs['snapshots']
+            new_snapshots[state] = (range(num_snapshots, num_snapshots + len(positions)), positions, box_vectors)
             self._eq_dict[state].extend(eq_result.outputs['files'])
             self._eq_dict[f"{state}_reduced_potentials"].extend(eq_result.outputs['reduced_potentials'])
             self.sampler_states.update({state: eq_result.sampler_state})
             self._eq_timers[state].append(eq_result.outputs['timers'])
 
         _logger.debug(f"collections complete.")
-        if decorrelate: # if we want to decorrelate all sample
+        if not decorrelate:
+            for state in endstates:
+                self._snapshot_stores[state].extend(*new_snapshots[state])
+        else: # if we want to decorrelate all sample
             _logger.debug(f"decorrelating data")
             for state in endstates:
                 _logger.debug(f"\tdecorrelating lambda = {state} data.")
                 traj_filename = self.eq_trajectory_filename[state]
-                if os.path.exists(traj_filename[:-2] + f'0000' + '.h5'):
-                    _logger.debug(f"\tfound traj filename: {traj_filename[:-2] + f'0000' + '.h5'}; proceeding...")
+                if (traj_filename is not None and os.path.exists(traj_filename[:-2] + f'0000' + '.h5')) or len(self._eq_dict[f"{state}_reduced_potentials"]) > 0:
+                    _logger.debug(f"\tfound equilibrium snapshots; proceeding...")
                     [t0, g, Neff_max, A_t, uncorrelated_indices] = compute_timeseries(np.array(self._eq_dict[f"{state}_reduced_potentials"]))
                     _logger.debug(f"\tt0: {t0}; Neff_max: {Neff_max}; uncorrelated_indices: {uncorrelated_indices}")
                     self._eq_dict[f"{state}_decorrelated"] = uncorrelated_indices
 
                     #now we just have to turn the file tuples into an array
                     _logger.debug(f"\treorganizing decorrelated data; files w/ num_snapshots are: {self._eq_dict[state]}")
+                    uncorrelated_set = set(uncorrelated_indices)
                     iterator, corrected_dict = 0, {}
+                    self._eq_file_indices[state] = {}
                     for tupl in self._eq_dict[state]:
                         new_list = [i + iterator for i in range(tupl[1])]
                         iterator += len(new_list)
-                        decorrelated_list = [i for i in new_list if i in uncorrelated_indices]
+                        decorrelated_list = [i for i in new_list if i in uncorrelated_set]
                         corrected_dict[tupl[0]] = decorrelated_list
+                        self._eq_file_indices[state].update({index: (tupl[0], file_index) for file_index, index in enumerate(new_list) if index in uncorrelated_set})
                     self._eq_files_dict[state] = corrected_dict
                     _logger.debug(f"\t corrected_dict for state {state}: {corrected_dict}")
 
+                    #the store only holds decorrelated snapshots; unless the evicted ones can be loaded from the equilibrium files, it holds all of them
+                    store = self._snapshot_stores[state]
+                    capacity = store.capacity if len(self._eq_file_indices[state]) > 0 else max(store.capacity, len(uncorrelated_indices))
+                    store.retain(uncorrelated_indices, capacity = capacity)
+                    new_indices, positions, box_vectors = new_snapshots[state]
+                    for snapshot_index, index in enumerate(new_indices):
+                        if index in uncorrelated_set:
+                            store.add(index, positions[snapshot_index], None if box_vectors is None else box_vectors[snapshot_index])
+
+    def _validate_resample(self, resample):
+        """
+        assert that a resample dict is supported.  the resample dict must contain the keys {'criterion': str, 'method': str, 'threshold': float}
+        where 'method' is one of supported_resampling_methods ('systematic', 'stratified', and 'residual' resampling have a lower variance than 'multinomial').
+        the threshold is adaptive if the optional keys are given:
+            'decay' : float in (0, 1], default 1.
+                the factor by which the threshold is multiplied after every resampling event, so that resampling gets rarer as
+                the particles are resampled (fewer redundant particles are propagated)
+            'min_threshold' : float, default 0.
+                the lower bound of the decayed threshold
+
+        Arguments
+        ---------
+        resample : dict
+            the resample dict
+        """
+        assert set(['criterion', 'method', 'threshold']) <= set(resample.keys()) <= set(['criterion', 'method', 'threshold', 'decay', 'min_threshold']), f"'resample does not contain the appropriate keys.  see documentation'"
+        assert resample['criterion'] in list(self.supported_observables.keys()), f"the specified resampling criterion is not supported"
+        assert resample['method'] in list(self.supported_resampling_methods), f"the specified resampling method is not supported."
+        assert isinstance(resample['threshold'], (int, float)), f"the resampling threshold must be a float"
+        assert 0. < resample.get('decay', 1.) <= 1., f"the resampling threshold decay must be in (0, 1]"
+        assert resample.get('min_threshold', 0.) <= resample['threshold'], f"the minimum resampling threshold cannot exceed the resampling threshold"
+
+    def _update_resample_threshold(self, threshold, resample, resample_bool):
+        """
+        decay the resampling threshold after a resampling event (see `_validate_resample`)
+
+        Arguments
+        ---------
+        threshold : float
+            the current resampling threshold
+        resample : dict
+            the resample dict
+        resample_bool : bool
+            whether the particles were resampled
+
+        Returns
+        -------
+        threshold : float
+            the resampling threshold of the next resampling attempt
+        """
+        if not resample_bool:
+            return threshold
+        return max(resample.get('min_threshold', 0.), threshold * resample.get('decay', 1.))
+
     def _resample(self,
                   incremental_works,
                   cumulative_works,
@@ -1005,13 +1522,47 @@ class SequentialMonteCarlo():
         """
         internal method to compute observables and incremental works locally
         """
-        self.thermodynamic_state.set_alchemical_parameters(new_val, LambdaProtocol(functions = self.lambda_protocol))
-        new_rps = np.array([compute_reduced_potential(self.thermodynamic_state, sampler_state) for sampler_state in sampler_states])
+        new_rps = compute_reduced_potential_matrix(self.thermodynamic_state, list(sampler_states), [new_val], self.lambda_protocol_class)[:,0]
         _observable = observable(cumulative_works, new_rps - current_rps)
         incremental_works = new_rps - current_rps
         return _observable, incremental_works
 
 
+    def _compute_reduced_potentials(self, sampler_states, lambdas):
+        """
+        internal method to compute the reduced potentials of sampler states at several global lambdas;
+        the particles are split into one batch per annealing worker (if they are active), and each batch is evaluated with a single context
+        (see `compute_reduced_potential_matrix`); else the reduced potentials are computed locally.
+
+        Arguments
+        ----------
+        sampler_states : np.array(openmmtools.states.SamplerState)
+            numpy array of sampler states
+        lambdas : array-like of floats
+            global lambdas at which to compute the reduced potentials
+
+        Returns
+        -------
+        reduced_potentials : np.ndarray of shape (len(sampler_states), len(lambdas))
+            unitless reduced potentials (kT)
+        """
+        lambdas = np.asarray(lambdas, dtype = np.float64)
+        remote_worker = 'remote' if self.parallelism.client is not None else self
+        if remote_worker is self:
+            if not hasattr(self, 'annealing_class'):
+                return compute_reduced_potential_matrix(self.thermodynamic_state, list(sampler_states), lambdas, self.lambda_protocol_class)
+            return call_reduced_potentials_method(self, list(sampler_states), lambdas)
+
+        workers = self.parallelism_parameters['available_workers'] if self.external_parallelism else None
+        num_batches = max(1, min(len(sampler_states), len(workers) if workers is not None else len(self.parallelism.workers)))
+        batches = [[sampler_states[index] for index in batch] for batch in np.array_split(np.arange(len(sampler_states)), num_batches)]
+        iterables = [[remote_worker] * num_batches, batches, [lambdas] * num_batches]
+        scattered_futures = [self.parallelism.scatter(iterable) for iterable in iterables]
+        futures = self.parallelism.deploy(func = call_reduced_potentials_method,
+                                          arguments = tuple(scattered_futures),
+                                          workers = workers)
+        return np.concatenate(self.parallelism.gather_results(futures), axis = 0)
+
     def binary_search(self,
                   sampler_states,
                   cumulative_works,
@@ -1021,10 +1572,13 @@ class SequentialMonteCarlo():
                   observable_threshold,
                   max_iterations=100,
                   initial_guess = None,
-                  precision_threshold = 1e-6):
+                  precision_threshold = 1e-6,
+                  num_candidates = 1):
         """
-        Given corresponding start_val and end_val of observables, conduct a binary search to find min value for which the observable threshold
-        is exceeded.
+        Given corresponding start_val and end_val of observables, conduct a (bracketing) binary search to find min value for which the observable threshold
+        is exceeded.  In every round, the reduced potentials of all particles at `num_candidates` evenly-spaced lambdas inside the bracket are computed
+        in a single (distributed) call, and the bracket is shrunk to the pair of consecutive candidates between which the observable drops below the threshold.
+
         Arguments
         ----------
         sampler_states : np.array(openmmtools.states.SamplerState)
@@ -1036,15 +1590,18 @@ class SequentialMonteCarlo():
         end_val: float
             end value of binary search
         observable : function
-            function to compute an observable
+            function to compute an observable; must accept incremental works of shape (num_candidates, num_particles)
         observable_threshold : float
             the threshold of the observable used to satisfy the binary search criterion
-        max_iterations: int, default 20
-            maximum number of interations to conduct
+        max_iterations: int, default 100
+            maximum number of rounds to conduct
         initial_guess: float, default None
-            guess where the threshold is achieved
+            guess where the threshold is achieved; if not None, it is the only candidate of the first round
         precision_threshold: float, default None
             precision threshold below which, the max iteration will break
+        num_candidates : int, default 1
+            number of candidate lambdas per round; the bracket shrinks by a factor of (num_candidates + 1) per round,
+            so num_candidates = 1 is a bisection and num_candidates = 31 needs 5x fewer rounds
 
         Returns
         -------
@@ -1055,41 +1612,42 @@ class SequentialMonteCarlo():
         _incremental_works : np.ndarray of floats
             the incremental works of the lambda update
         """
-        _base_end_val = end_val
+        assert num_candidates >= 1, f"at least one candidate lambda must be evaluated per round"
         right_bound = end_val
         left_bound = start_val
         _logger.debug(f"\t\tmin, max values: {start_val}, {end_val}. ")
-        self.thermodynamic_state.set_alchemical_parameters(start_val, LambdaProtocol(functions = self.lambda_protocol))
-        current_rps = np.array([compute_reduced_potential(self.thermodynamic_state, sampler_state) for sampler_state in sampler_states])
+        evaluations = {} #candidate lambda: (observable, incremental works)
 
-        if initial_guess is not None:
-            midpoint = initial_guess
-        else:
-            midpoint = (left_bound + right_bound) * 0.5
+        candidates = np.array([initial_guess]) if initial_guess is not None else np.linspace(left_bound, right_bound, num_candidates + 2)[1:-1]
+        reduced_potentials = self._compute_reduced_potentials(sampler_states, np.concatenate(([start_val], candidates)))
+        current_rps, reduced_potentials = reduced_potentials[:,0], reduced_potentials[:,1:]
 
         for iteration in range(max_iterations):
             if iteration != 0:
-                midpoint = (left_bound + right_bound) * 0.5
-
-            _observable, _incremental_works = self.compute_lambda_increment(new_val = midpoint,
-                                             sampler_states = sampler_states,
-                                             observable = observable,
-                                             current_rps = current_rps,
-                                             cumulative_works = cumulative_works)
-            if _observable <= observable_threshold:
-                right_bound = midpoint
+                candidates = np.linspace(left_bound, right_bound, num_candidates + 2)[1:-1]
+                reduced_potentials = self._compute_reduced_potentials(sampler_states, candidates)
+
+            _incremental_works = reduced_potentials.T - current_rps
+            _observables = np.atleast_1d(observable(cumulative_works, _incremental_works))
+            evaluations.update({candidate: (_observables[index], _incremental_works[index]) for index, candidate in enumerate(candidates)})
+
+            #candidates are ordered from the left to the right bound; bracket the first candidate that drops below the threshold
+            below_threshold = np.where(_observables <= observable_threshold)[0]
+            if len(below_threshold) > 0:
+                right_bound = candidates[below_threshold[0]]
+                if below_threshold[0] > 0:
+                    left_bound = candidates[below_threshold[0] - 1]
             else:
-                left_bound = midpoint
+                left_bound = candidates[-1]
 
             if precision_threshold is not None:
                 if abs(right_bound - left_bound) <= precision_threshold:
-                    midpoint = right_bound
-                    _observable, _incremental_works = self.compute_lambda_increment(new_val = midpoint,
-                                                     sampler_states = sampler_states,
-                                                     observable = observable,
-                                                     current_rps = current_rps,
-                                                     cumulative_works = cumulative_works)
                     break
 
+        midpoint = right_bound
+        if midpoint not in evaluations:
+            _incremental_works = self._compute_reduced_potentials(sampler_states, [midpoint])[:,0] - current_rps
+            evaluations[midpoint] = (observable(cumulative_works, _incremental_works), _incremental_works)
+        _observable, _incremental_works = evaluations[midpoint]
 
         return midpoint, _observable, _incremental_works
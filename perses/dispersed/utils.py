@@ -30,6 +30,7 @@ import dask.distributed as distributed
 import tqdm
 import time
 from scipy.special import logsumexp
+from perses.dispersed.parallel import get_worker
 import openmmtools.cache as cache
 from openmmtools import utils
 
@@ -99,6 +100,91 @@ cache.global_context_cache.platform = configure_platform(utils.get_fastest_platf
 #########
 
 #smc functions
+def multiple_time_step_splitting(fast_force_group, slow_force_group, inner_steps = 2, alchemical_update = False):
+    """
+    Build an openmmtools LangevinIntegrator splitting string for multiple time step (RESPA-like) integration, in which
+    the fast force group is integrated with an inner timestep of timestep / inner_steps and the slow force group with the
+    outer timestep.  With HybridTopologyFactory(alchemical_force_group = ...), the alchemical forces can be placed in their own group.
+
+    The splitting is symmetric: the slow group is kicked by half an outer step at the start and the end of the step, and
+    the inner velocity Verlet steps surround the (outer) O step (and the H step that updates the alchemical parameters).
+
+    Arguments
+    ---------
+    fast_force_group : int
+        the force group integrated with the inner timestep
+    slow_force_group : int
+        the force group integrated with the outer timestep
+    inner_steps : int, default 2
+        the number of inner steps per outer step
+    alchemical_update : bool, default False
+        whether to include the 'H' step of the nonequilibrium (alchemical) integrators
+
+    Returns
+    -------
+    splitting : str
+        the splitting string, e.g. 'V1 V0 R R V0 V0 R O H R V0 V0 R R V0 V1' for 3 inner steps with alchemical_update
+    """
+    assert inner_steps >= 1, f"the number of inner steps must be a positive integer; got {inner_steps}"
+    assert fast_force_group != slow_force_group, f"the fast and slow force groups must differ"
+    fast, slow = f"V{fast_force_group}", f"V{slow_force_group}"
+    center = ['O', 'H'] if alchemical_update else ['O']
+
+    steps = [slow]
+    for inner_step in range(inner_steps):
+        if inner_steps % 2 == 0 and inner_step == inner_steps // 2:
+            steps += center #between the two central inner steps
+        if inner_steps % 2 == 1 and inner_step == inner_steps // 2:
+            steps += [fast, 'R'] + center + ['R', fast] #inside the central inner step
+        else:
+            steps += [fast, 'R', 'R', fast]
+    steps.append(slow)
+    return ' '.join(steps)
+
+def assign_offspring_workers(resampled_indices, ancestor_workers, workers = None):
+    """
+    assign the offspring of a resampling event to workers.  every offspring stays on the worker that holds its ancestor's sampler state
+    unless that worker already holds its share (ceil(num_particles / num_workers)) of the offspring, in which case the offspring is
+    moved to the least loaded worker.
+
+    Arguments
+    ---------
+    resampled_indices : np.array of ints
+        the ancestor index of every offspring
+    ancestor_workers : list
+        the worker holding the sampler state of every ancestor
+    workers : list, default None
+        the workers to balance the offspring over; if None, the workers holding the ancestors
+
+    Returns
+    -------
+    offspring_workers : list
+        the worker of every offspring
+    transfers : np.array of bools
+        whether the sampler state of every offspring has to be transferred from the worker of its ancestor
+    """
+    if workers is None:
+        workers = sorted(set(ancestor_workers), key = str)
+    num_offspring = len(resampled_indices)
+    capacity = int(np.ceil(num_offspring / len(workers)))
+    load = {worker: 0 for worker in workers}
+
+    offspring_workers = [None] * num_offspring
+    for offspring, ancestor in enumerate(resampled_indices):
+        worker = ancestor_workers[ancestor]
+        if worker in load and load[worker] < capacity:
+            offspring_workers[offspring] = worker
+            load[worker] += 1
+
+    for offspring in range(num_offspring):
+        if offspring_workers[offspring] is None:
+            worker = min(workers, key = lambda _worker: load[_worker])
+            offspring_workers[offspring] = worker
+            load[worker] += 1
+
+    transfers = np.array([offspring_workers[offspring] != ancestor_workers[ancestor] for offspring, ancestor in enumerate(resampled_indices)])
+    return offspring_workers, transfers
+
 def compute_survival_rate(sMC_particle_ancestries):
     """
     compute the time-series survival rate as a function of resamples
@@ -179,6 +265,87 @@ def multinomial_resample(total_works, num_resamples):
 
     return resampled_works, resampled_indices
 
+def _resampled_works(total_works, num_resamples):
+    """
+    the (uniform) works of the particles after resampling
+    """
+    return np.array([np.average(total_works)] * num_resamples)
+
+def systematic_resample(total_works, num_resamples):
+    """
+    from a numpy array of total works, resample the particle indices N times with a single uniform offset
+    (systematic resampling) conditioned on the weights w_i \propto e^{-cumulative_works_i}.
+    Every particle is resampled either floor(N * w_i) or ceil(N * w_i) times.
+    Parameters
+    ----------
+    total_works : np.array of floats
+        generalized accumulated works at time t for all particles
+    num_resamples : int, default len(sampler_states)
+        number of resamples to conduct; default doesn't change the number of particles
+
+    Returns
+    -------
+    resampled_works : np.array([1.0/num_resamples]*num_resamples)
+        resampled works (uniform)
+    resampled_indices : np.array of ints
+        resampled indices
+    """
+    cumulative_weights = np.cumsum(np.exp(-total_works - logsumexp(-total_works)))
+    positions = (np.random.random() + np.arange(num_resamples)) / num_resamples
+    resampled_indices = np.minimum(np.searchsorted(cumulative_weights, positions), len(total_works) - 1)
+    return _resampled_works(total_works, num_resamples), resampled_indices
+
+def stratified_resample(total_works, num_resamples):
+    """
+    from a numpy array of total works, resample the particle indices N times with one uniform draw in each of N
+    equal strata of the cumulative weights (stratified resampling) conditioned on the weights w_i \propto e^{-cumulative_works_i}
+    Parameters
+    ----------
+    total_works : np.array of floats
+        generalized accumulated works at time t for all particles
+    num_resamples : int, default len(sampler_states)
+        number of resamples to conduct; default doesn't change the number of particles
+
+    Returns
+    -------
+    resampled_works : np.array([1.0/num_resamples]*num_resamples)
+        resampled works (uniform)
+    resampled_indices : np.array of ints
+        resampled indices
+    """
+    cumulative_weights = np.cumsum(np.exp(-total_works - logsumexp(-total_works)))
+    positions = (np.random.random(num_resamples) + np.arange(num_resamples)) / num_resamples
+    resampled_indices = np.minimum(np.searchsorted(cumulative_weights, positions), len(total_works) - 1)
+    return _resampled_works(total_works, num_resamples), resampled_indices
+
+def residual_resample(total_works, num_resamples):
+    """
+    from a numpy array of total works, deterministically keep floor(N * w_i) copies of every particle and resample the
+    remaining particles from a multinomial distribution of the residual weights (residual resampling),
+    where w_i \propto e^{-cumulative_works_i}
+    Parameters
+    ----------
+    total_works : np.array of floats
+        generalized accumulated works at time t for all particles
+    num_resamples : int, default len(sampler_states)
+        number of resamples to conduct; default doesn't change the number of particles
+
+    Returns
+    -------
+    resampled_works : np.array([1.0/num_resamples]*num_resamples)
+        resampled works (uniform)
+    resampled_indices : np.array of ints
+        resampled indices
+    """
+    expected_counts = num_resamples * np.exp(-total_works - logsumexp(-total_works))
+    counts = np.floor(expected_counts).astype(int)
+    num_residual = num_resamples - np.sum(counts)
+    if num_residual > 0:
+        residual_weights = expected_counts - counts
+        counts += np.random.multinomial(num_residual, residual_weights / np.sum(residual_weights))
+    resampled_indices = np.repeat(np.arange(len(total_works)), counts)
+    return _resampled_works(total_works, num_resamples), resampled_indices
+
 def ESS(works_prev, works_incremental):
     """
     compute the effective sample size (ESS) as given in Eq 3.15 in https://arxiv.org/abs/1303.3123.
@@ -187,18 +354,18 @@ def ESS(works_prev, works_incremental):
     works_prev: np.array
         np.array of floats representing the accumulated works at t-1 (unnormalized)
     works_incremental: np.array
-        np.array of floats representing the incremental works at t (unnormalized)
+        np.array of floats representing the incremental works at t (unnormalized);
+        if of shape (num_candidates, num_particles), the ESS of every candidate is computed at once
 
     Returns
     -------
-    normalized_ESS: float
-        effective sample size
-    """
-    prev_weights_normalized = np.exp(-works_prev - logsumexp(-works_prev))
-    incremental_weights_unnormalized = np.exp(-works_incremental)
-    ESS = np.dot(prev_weights_normalized, incremental_weights_unnormalized)**2 / np.dot(np.power(prev_weights_normalized, 2), np.power(incremental_weights_unnormalized, 2))
-    normalized_ESS = ESS / len(prev_weights_normalized)
-    assert normalized_ESS >= 0.0 - DISTRIBUTED_ERROR_TOLERANCE and normalized_ESS <= 1.0 + DISTRIBUTED_ERROR_TOLERANCE, f"the normalized ESS ({normalized_ESS} is not between 0 and 1)"
+    normalized_ESS: float or np.array of floats
+        effective sample size (of every candidate)
+    """
+    log_prev_weights_normalized = -works_prev - logsumexp(-works_prev)
+    log_weights = log_prev_weights_normalized - np.asarray(works_incremental)
+    normalized_ESS = np.exp(2 * logsumexp(log_weights, axis = -1) - logsumexp(2 * log_weights, axis = -1)) / len(log_prev_weights_normalized)
+    assert np.all(normalized_ESS >= 0.0 - DISTRIBUTED_ERROR_TOLERANCE) and np.all(normalized_ESS <= 1.0 + DISTRIBUTED_ERROR_TOLERANCE), f"the normalized ESS ({normalized_ESS} is not between 0 and 1)"
     return normalized_ESS
 
 def CESS(works_prev, works_incremental):
@@ -209,20 +376,205 @@ def CESS(works_prev, works_incremental):
     works_prev: np.array
         np.array of floats representing the accumulated works at t-1 (unnormalized)
     works_incremental: np.array
-        np.array of floats representing the incremental works at t (unnormalized)
+        np.array of floats representing the incremental works at t (unnormalized);
+        if of shape (num_candidates, num_particles), the CESS of every candidate is computed at once
 
     Returns
     -------
-    CESS: float
-        conditional effective sample size
-    """
-    prev_weights_normalization = np.exp(logsumexp(-works_prev))
-    prev_weights_normalized = np.exp(-works_prev) / prev_weights_normalization
-    incremental_weights_unnormalized = np.exp(-works_incremental)
-    CESS = np.dot(prev_weights_normalized, incremental_weights_unnormalized)**2 / np.dot(prev_weights_normalized, np.power(incremental_weights_unnormalized, 2))
-    assert CESS >= 0.0 - DISTRIBUTED_ERROR_TOLERANCE and CESS <= 1.0 + DISTRIBUTED_ERROR_TOLERANCE, f"the CESS ({CESS} is not between 0 and 1)"
+    CESS: float or np.array of floats
+        conditional effective sample size (of every candidate)
+    """
+    log_prev_weights_normalized = -works_prev - logsumexp(-works_prev)
+    works_incremental = np.asarray(works_incremental)
+    CESS = np.exp(2 * logsumexp(log_prev_weights_normalized - works_incremental, axis = -1) - logsumexp(log_prev_weights_normalized - 2 * works_incremental, axis = -1))
+    assert np.all(CESS >= 0.0 - DISTRIBUTED_ERROR_TOLERANCE) and np.all(CESS <= 1.0 + DISTRIBUTED_ERROR_TOLERANCE), f"the CESS ({CESS} is not between 0 and 1)"
     return CESS
 
+class OnlineFreeEnergyEstimator(object):
+    """
+    Streaming estimate of the (reduced) free energy difference sampled by a population of importance-sampling particles,
+    with an incremental jackknife or bootstrap uncertainty.
+
+    The estimator keeps the log weights of the particles since the last resampling event (a segment) and the accumulated
+    log normalizing constant of the completed segments, i.e. log Z_t / Z_0 = sum_k log sum_i W_i^{(k-1)} exp(-w_i^{(k)}),
+    so the estimate stays valid across resampling.  The uncertainty is computed from replica estimates that are updated alongside:
+    leave-one-particle-out replicas (jackknife) or Poisson-weighted replicas (an online bootstrap, whose weights can be drawn for particles
+    as they arrive).  Since a resampled particle is not the particle with the same index before resampling, leave-one-out replicas are only
+    defined for a population that was never resampled: at the first resampling event, jackknife replicas are replaced by bootstrap replicas.  Particles can either be annealed together (`update` with the incremental works of every lambda increment, and `resample`)
+    or arrive one at a time with their total works (`add_particles`, as in AIS).
+    """
+    supported_uncertainty_methods = ['jackknife', 'bootstrap']
+
+    def __init__(self, num_particles = 0, uncertainty_method = 'jackknife', num_bootstraps = 100):
+        """
+        Parameters
+        ----------
+        num_particles : int, default 0
+            the number of particles annealed together; 0 if particles are added with `add_particles`
+        uncertainty_method : str, default 'jackknife'
+            how to estimate the uncertainty; one of supported_uncertainty_methods.  the jackknife is only used until the first resampling event
+        num_bootstraps : int, default 100
+            number of bootstrap replicas (if uncertainty_method is 'bootstrap')
+        """
+        assert uncertainty_method in self.supported_uncertainty_methods, f"the uncertainty method {uncertainty_method} is not supported (supported methods are {self.supported_uncertainty_methods})"
+        self.uncertainty_method = uncertainty_method
+        self.num_bootstraps = num_bootstraps
+        self._replica_method = uncertainty_method #the jackknife is replaced by the bootstrap at the first resampling event
+        self._log_weights = np.zeros(num_particles)
+        self._log_normalizer = 0.
+        self._bootstrap_counts = np.random.poisson(1., size = (num_bootstraps, num_particles)) if uncertainty_method == 'bootstrap' else None
+        self._replica_log_normalizers = np.zeros(num_bootstraps if uncertainty_method == 'bootstrap' else num_particles)
+        self.num_resamples = 0
+        self.free_energies, self.uncertainties, self.effective_sample_sizes = [], [], []
+
+    @property
+    def num_particles(self):
+        """int : the number of particles"""
+        return len(self._log_weights)
+
+    def add_particles(self, works):
+        """
+        add independent particles with their total (reduced) works
+
+        Parameters
+        ----------
+        works : float or np.array of floats
+            the total works of the new particles
+        """
+        assert self.num_resamples == 0, f"particles cannot be added to a resampled population"
+        works = np.atleast_1d(works)
+        self._log_weights = np.concatenate((self._log_weights, -works))
+        if self._replica_method == 'bootstrap':
+            self._bootstrap_counts = np.concatenate((self._bootstrap_counts, np.random.poisson(1., size = (self.num_bootstraps, len(works)))), axis = 1)
+        else:
+            self._replica_log_normalizers = np.concatenate((self._replica_log_normalizers, np.zeros(len(works))))
+        self._record()
+
+    def update(self, incremental_works):
+        """
+        update the particles with the incremental (reduced) works of a lambda increment
+
+        Parameters
+        ----------
+        incremental_works : np.array of floats
+            the incremental works of every particle
+        """
+        self._log_weights = self._log_weights - np.asarray(incremental_works)
+        self._record()
+
+    def resample(self, num_particles = None):
+        """
+        fold the current segment into the accumulated normalizing constants and reset the weights of the (resampled) particles to uniform;
+        the replicas of the new segment are bootstrap replicas, since the particles of the new segment are not those of the last segment
+
+        Parameters
+        ----------
+        num_particles : int, default None
+            the number of particles after resampling; if None, the number of particles is unchanged
+        """
+        num_particles = self.num_particles if num_particles is None else num_particles
+        self._log_normalizer = self._log_normalizer + self._segment_log_normalizer()
+        if self._replica_method == 'jackknife':
+            #there are no previous segments, so the bootstrap replicas start from the current (first) segment
+            self._replica_method = 'bootstrap'
+            self._bootstrap_counts = np.random.poisson(1., size = (self.num_bootstraps, self.num_particles))
+            self._replica_log_normalizers = np.zeros(self.num_bootstraps)
+        self._replica_log_normalizers = self._replica_log_normalizers + self._replica_segment_log_normalizers()
+        self._log_weights = np.zeros(num_particles)
+        self._bootstrap_counts = np.random.poisson(1., size = (self.num_bootstraps, num_particles))
+        self.num_resamples += 1
+
+    def _segment_log_normalizer(self):
+        """
+        the log normalizing constant of the current segment
+        """
+        return logsumexp(self._log_weights) - np.log(self.num_particles)
+
+    def _replica_segment_log_normalizers(self):
+        """
+        the log normalizing constants of the current segment of every replica
+        """
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            if self._replica_method == 'bootstrap':
+                return logsumexp(self._log_weights + np.log(self._bootstrap_counts), axis = 1) - np.log(np.sum(self._bootstrap_counts, axis = 1))
+            log_sum = logsumexp(self._log_weights)
+            return log_sum + np.log1p(-np.exp(self._log_weights - log_sum)) - np.log(self.num_particles - 1)
+
+    @property
+    def free_energy(self):
+        """float : the (reduced) free energy estimate, -log Z_t / Z_0"""
+        if self.num_particles == 0:
+            return np.nan
+        return -(self._log_normalizer + self._segment_log_normalizer())
+
+    @property
+    def uncertainty(self):
+        """float : the standard error of the free energy estimate"""
+        if self.num_particles < 2:
+            return np.nan
+        replica_free_energies = -(self._replica_log_normalizers + self._replica_segment_log_normalizers())
+        replica_free_energies = replica_free_energies[np.isfinite(replica_free_energies)]
+        if len(replica_free_energies) < 2:
+            return np.nan
+        if self._replica_method == 'bootstrap':
+            return np.std(replica_free_energies, ddof = 1)
+        num_replicas = len(replica_free_energies)
+        return np.sqrt((num_replicas - 1) / num_replicas * np.sum((replica_free_energies - np.mean(replica_free_energies))**2))
+
+    @property
+    def effective_sample_size(self):
+        """float : the normalized effective sample size of the current segment"""
+        if self.num_particles == 0:
+            return np.nan
+        return np.exp(2 * logsumexp(self._log_weights) - logsumexp(2 * self._log_weights)) / self.num_particles
+
+    def converged(self, target_uncertainty):
+        """
+        whether the uncertainty of the free energy estimate is below a target
+
+        Parameters
+        ----------
+        target_uncertainty : float
+            the target standard error (kT)
+
+        Returns
+        -------
+        converged : bool
+        """
+        uncertainty = self.uncertainty
+        return bool(np.isfinite(uncertainty) and uncertainty <= target_uncertainty)
+
+    def _record(self):
+        """
+        append the current estimates to the history
+        """
+        self.free_energies.append(self.free_energy)
+        self.uncertainties.append(self.uncertainty)
+        self.effective_sample_sizes.append(self.effective_sample_size)
+
+def vectorized_EXP(works):
+    """
+    vectorized exponential averaging (EXP) free energy estimates and uncertainties of every column of a work matrix
+    (equivalent to pymbar.EXP applied to every column)
+
+    Parameters
+    ----------
+    works : np.ndarray of shape (num_samples, num_columns)
+        (reduced) works
+
+    Returns
+    -------
+    free_energies : np.ndarray of shape (num_columns, 2)
+        the free energy estimate and its uncertainty of every column
+    """
+    works = np.asarray(works)
+    max_arg = np.max(-works, axis = 0)
+    x = np.exp(-works - max_arg)
+    Ex = np.mean(x, axis = 0)
+    DeltaF = -(np.log(Ex) + max_arg)
+    dDeltaF = np.sqrt(np.std(x, axis = 0)**2 / (works.shape[0] * Ex**2))
+    return np.stack((DeltaF, dDeltaF), axis = 1)
+
 def compute_timeseries(reduced_potentials):
     """
     Use pymbar timeseries to compute the uncorrelated samples in an array of reduced potentials.  Returns the uncorrelated sample indices.
@@ -253,6 +605,135 @@ def compute_timeseries(reduced_potentials):
 
     return [t0, g, Neff_max, A_t, full_uncorrelated_indices]
 
+class SnapshotStore(object):
+    """
+    Fixed-capacity ring buffer of configurations (positions and box vectors) keyed by an arbitrary hashable key, e.g. the index of an
+    equilibrium snapshot or a (particle, lambda index) tuple.  Retrieval is a dictionary lookup and an array slice, so sampler states
+    can be pulled without parsing trajectory files.  When the buffer is full, the oldest snapshot is overwritten.
+
+    The buffer lives in memory, or, if a filename is given, in a single memory-mapped .npy file of shape (capacity, n_atoms + 3, 3)
+    (the positions followed by the box vectors of every snapshot), so that large buffers spill to disk.
+    The arrays are allocated when the first snapshot is added.
+    """
+    def __init__(self, capacity = 1000, filename = None):
+        """
+        Parameters
+        ----------
+        capacity : int, default 1000
+            maximum number of snapshots held in the buffer
+        filename : str, default None
+            .npy file backing the buffer; if None, the buffer is held in memory
+        """
+        assert capacity > 0, f"the capacity of the snapshot store must be positive"
+        self.capacity = capacity
+        self.filename = filename
+        self._buffer = None
+        self._slots = {} #key: slot
+        self._keys = [None] * capacity #slot: key
+        self._next_slot = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def keys(self):
+        """
+        the keys of the snapshots in the buffer
+        """
+        return self._slots.keys()
+
+    def _allocate(self, n_atoms):
+        """
+        allocate the (memory-mapped) buffer for snapshots of n_atoms atoms
+        """
+        shape = (self.capacity, n_atoms + 3, 3)
+        if self.filename is None:
+            self._buffer = np.zeros(shape)
+        else:
+            _logger.debug(f"memory-mapping snapshot store to {self.filename}")
+            if os.path.dirname(self.filename):
+                os.makedirs(os.path.dirname(self.filename), exist_ok = True)
+            self._buffer = np.lib.format.open_memmap(self.filename, mode = 'w+', dtype = np.float64, shape = shape)
+
+    def add(self, key, positions, box_vectors = None):
+        """
+        add a snapshot to the buffer, overwriting the oldest snapshot if the buffer is full
+
+        Parameters
+        ----------
+        key : hashable
+            key of the snapshot
+        positions : np.ndarray of shape (n_atoms, 3)
+            positions in nm
+        box_vectors : np.ndarray of shape (3, 3), default None
+            box vectors in nm
+        """
+        positions = np.asarray(positions)
+        if self._buffer is None:
+            self._allocate(positions.shape[0])
+        if key in self._slots: #overwrite the snapshot in place
+            slot = self._slots[key]
+        else:
+            slot = self._next_slot
+            self._next_slot = (self._next_slot + 1) % self.capacity
+            if self._keys[slot] is not None:
+                del self._slots[self._keys[slot]]
+            self._slots[key], self._keys[slot] = slot, key
+        self._buffer[slot, :-3] = positions
+        self._buffer[slot, -3:] = np.nan if box_vectors is None else np.asarray(box_vectors)
+
+    def extend(self, keys, positions, box_vectors = None):
+        """
+        add several snapshots to the buffer
+
+        Parameters
+        ----------
+        keys : iterable of hashables
+            keys of the snapshots
+        positions : np.ndarray of shape (n_snapshots, n_atoms, 3)
+            positions in nm
+        box_vectors : np.ndarray of shape (n_snapshots, 3, 3), default None
+            box vectors in nm
+        """
+        for index, key in enumerate(keys):
+            self.add(key, positions[index], None if box_vectors is None else box_vectors[index])
+
+    def retain(self, keys, capacity = None):
+        """
+        keep only the snapshots of the given keys (in the given order) and discard the others, optionally resizing the buffer;
+        keys that are not in the buffer are ignored, and if more snapshots are kept than the capacity, the first ones are discarded
+
+        Parameters
+        ----------
+        keys : iterable of hashables
+            keys of the snapshots to keep
+        capacity : int, default None
+            the new capacity of the buffer; if None, the capacity is unchanged
+        """
+        capacity = self.capacity if capacity is None else capacity
+        assert capacity > 0, f"the capacity of the snapshot store must be positive"
+        keys = [key for key in keys if key in self._slots]
+        snapshots = [np.array(self._buffer[self._slots[key]]) for key in keys]
+        self.capacity, self._buffer = capacity, None
+        self._slots, self._keys, self._next_slot = {}, [None] * capacity, 0
+        for key, snapshot in zip(keys, snapshots):
+            self.add(key, snapshot[:-3], snapshot[-3:])
+
+    def __getitem__(self, key):
+        """
+        a new sampler state with the snapshot of the given key
+
+        Returns
+        -------
+        sampler_state : openmmtools.states.SamplerState
+            sampler state with positions and box vectors (if applicable)
+        """
+        snapshot = np.array(self._buffer[self._slots[key]])
+        box_vectors = None if np.isnan(snapshot[-3:]).any() else snapshot[-3:] * unit.nanometers
+        return SamplerState(snapshot[:-3] * unit.nanometers, box_vectors = box_vectors)
+
 def run_equilibrium(task):
     """
     Run n_iterations*nsteps_equil integration steps.  n_iterations mcmc moves are conducted in the initial equilibration, returning n_iterations
@@ -276,7 +757,8 @@ def run_equilibrium(task):
          timer: (<bool, default False>; whether to time all parts of the equilibrium run),
          _minimize: (<bool, default False>; whether to minimize the sampler_state before conducting equilibration),
          file_iterator: (<int, default 0>; which index to begin writing files),
-         timestep: (<unit.Quantity=float*unit.femtoseconds>; dynamical timestep)
+         timestep: (<unit.Quantity=float*unit.femtoseconds>; dynamical timestep),
+         return_snapshots: (<bool, optional, default False>; whether to return the positions and box vectors (nm) of all atoms at every iteration)
          }
 
     Returns
@@ -322,6 +804,8 @@ def run_equilibrium(task):
     #create a numpy array for the trajectory
     trajectory_positions, trajectory_box_lengths, trajectory_box_angles = list(), list(), list()
     reduced_potentials = list()
+    return_snapshots = inputs.get('return_snapshots', False)
+    snapshot_positions, snapshot_box_vectors = list(), list()
 
     #loop through iterations and apply MCMove, then collect positions into numpy array
     _logger.debug(f"conducting {inputs['n_iterations']} of production")
@@ -344,6 +828,10 @@ def run_equilibrium(task):
         trajectory_box_lengths.append([a,b,c])
         trajectory_box_angles.append([alpha, beta, gamma])
 
+        if return_snapshots:
+            snapshot_positions.append(sampler_state.positions.value_in_unit_system(unit.md_unit_system))
+            snapshot_box_vectors.append(np.array(sampler_state.box_vectors.value_in_unit_system(unit.md_unit_system)))
+
         #if tajectory positions is too large, we have to write it to disk and start fresh
         if np.array(trajectory_positions).nbytes > inputs['max_size']:
             trajectory = md.Trajectory(np.array(trajectory_positions), subset_topology, unitcell_lengths=np.array(trajectory_box_lengths), unitcell_angles=np.array(trajectory_box_angles))
@@ -382,7 +870,10 @@ def run_equilibrium(task):
     if not timer:
         timers = {}
 
-    out_task = EquilibriumFEPTask(sampler_state = sampler_state, inputs = task.inputs, outputs = {'reduced_potentials': reduced_potentials, 'files': file_numsnapshots, 'timers': timers})
+    outputs = {'reduced_potentials': reduced_potentials, 'files': file_numsnapshots, 'timers': timers}
+    if return_snapshots:
+        outputs['snapshots'] = (np.array(snapshot_positions), np.array(snapshot_box_vectors))
+    out_task = EquilibriumFEPTask(sampler_state = sampler_state, inputs = task.inputs, outputs = outputs)
     return out_task
 
 def write_equilibrium_trajectory(trajectory: md.Trajectory, trajectory_filename: str) -> float:
@@ -456,6 +947,138 @@ def compute_reduced_potential(thermodynamic_state: states.ThermodynamicState, sa
     sampler_state.apply_to_context(context, ignore_velocities=True)
     return thermodynamic_state.reduced_potential(context)
 
+def compute_reduced_potentials_at_lambdas(thermodynamic_state, sampler_state, global_lambdas, lambda_protocol):
+    """
+    Compute the reduced potentials of a single configuration of a hybrid system at many values of global lambda.
+
+    The energy is decomposed by force group: the force groups whose forces do not depend on any of the protocol's
+    alchemical parameters are evaluated once, and every set of force groups depending on the same alchemical parameters
+    is evaluated once per distinct value of those parameters along `global_lambdas`.  The fewer alchemical forces share a
+    force group with lambda-independent forces, the fewer energy evaluations are needed; if all forces are in one group,
+    one evaluation per distinct lambda is conducted.
+    Note: energy parameter derivatives are not used since the hybrid energies (softcore and interpolated valence terms)
+    are not linear in the alchemical parameters.
+
+    Arguments
+    ----------
+    thermodynamic_state : openmmtools.states.CompoundThermodynamicState
+        the thermodynamic state of the hybrid system (with a RelativeAlchemicalState)
+    sampler_state : openmmtools.states.SamplerState
+        the configuration whose reduced potentials are computed
+    global_lambdas : array-like of float
+        the global lambdas at which to compute the reduced potentials
+    lambda_protocol : perses.annihilation.lambda_protocol.LambdaProtocol
+        the protocol mapping global lambda onto the alchemical parameters
+
+    Returns
+    -------
+    reduced_potentials : np.ndarray of shape (len(global_lambdas),)
+        unitless reduced potentials (kT)
+    """
+    return compute_reduced_potential_matrix(thermodynamic_state, [sampler_state], global_lambdas, lambda_protocol)[0]
+
+def compute_reduced_potential_matrix(thermodynamic_state, configurations, global_lambdas, lambda_protocol, box_vectors = None):
+    """
+    Compute the reduced potentials of many configurations of a hybrid system at many values of global lambda with a single context.
+
+    The context is pulled from the global context cache once and the decomposition of the energy into force groups (see
+    `compute_reduced_potentials_at_lambdas`) is planned once; every configuration is then set on the context and evaluated at all lambdas.
+
+    Arguments
+    ----------
+    thermodynamic_state : openmmtools.states.CompoundThermodynamicState
+        the thermodynamic state of the hybrid system (with a RelativeAlchemicalState)
+    configurations : list of openmmtools.states.SamplerState or np.ndarray of shape (n_configurations, n_atoms, 3)
+        the configurations whose reduced potentials are computed; arrays (or simtk.unit.Quantity arrays) are in nanometers
+    global_lambdas : array-like of float
+        the global lambdas at which to compute the reduced potentials
+    lambda_protocol : perses.annihilation.lambda_protocol.LambdaProtocol
+        the protocol mapping global lambda onto the alchemical parameters
+    box_vectors : np.ndarray of shape (n_configurations, 3, 3), default None
+        the box vectors (nanometers) of every configuration if `configurations` is an array of a periodic system;
+        ignored for sampler states, which carry their own box vectors
+
+    Returns
+    -------
+    reduced_potentials : np.ndarray of shape (n_configurations, len(global_lambdas))
+        unitless reduced potentials (kT)
+    """
+    if type(cache.global_context_cache) == cache.DummyContextCache:
+        integrator = openmm.VerletIntegrator(1.0) #we won't take any steps, so use a simple integrator
+        context, integrator = cache.global_context_cache.get_context(thermodynamic_state, integrator)
+    else:
+        context, integrator = cache.global_context_cache.get_context(thermodynamic_state)
+
+    if len(configurations) > 0 and isinstance(configurations[0], SamplerState):
+        positions = [sampler_state.positions for sampler_state in configurations]
+        box_vectors = [sampler_state.box_vectors for sampler_state in configurations]
+    else:
+        if isinstance(configurations, unit.Quantity):
+            configurations = configurations.value_in_unit(unit.nanometer)
+        positions = np.asarray(configurations, dtype = np.float64)
+        if box_vectors is not None and isinstance(box_vectors, unit.Quantity):
+            box_vectors = box_vectors.value_in_unit(unit.nanometer)
+        box_vectors = [None] * len(positions) if box_vectors is None else box_vectors
+
+    parameter_values = lambda_protocol.evaluate(global_lambdas)
+    context_parameters = context.getParameters()
+    protocol_parameters = [name for name in lambda_protocol.parameter_names if name in context_parameters]
+    columns = {name: lambda_protocol.parameter_names.index(name) for name in protocol_parameters}
+
+    #find the alchemical parameters that each force group depends on
+    group_parameters = {}
+    for force in context.getSystem().getForces():
+        group = force.getForceGroup()
+        group_parameters.setdefault(group, set())
+        if hasattr(force, 'getNumGlobalParameters'):
+            for parameter_index in range(force.getNumGlobalParameters()):
+                parameter_name = force.getGlobalParameterName(parameter_index)
+                if parameter_name in columns:
+                    group_parameters[group].add(parameter_name)
+
+    #cluster the force groups by the parameters they depend on, and find the distinct parameter values of every cluster
+    independent_groups = set(group for group, parameters in group_parameters.items() if len(parameters) == 0)
+    dependent_clusters = {}
+    for group, parameters in group_parameters.items():
+        if len(parameters) > 0:
+            dependent_clusters.setdefault(frozenset(parameters), set()).add(group)
+    cluster_plans = []
+    for parameters, groups in dependent_clusters.items():
+        parameters = sorted(parameters)
+        cluster_values = parameter_values[:, [columns[name] for name in parameters]]
+        unique_values, inverse = np.unique(cluster_values, axis=0, return_inverse=True)
+        cluster_plans.append((parameters, groups, unique_values, np.ravel(inverse)))
+
+    kT = (kB * thermodynamic_state.temperature).value_in_unit(unit.kilojoule_per_mole)
+    energies = np.zeros((len(positions), len(parameter_values)))
+    volumes = np.zeros(len(positions))
+    initial_parameters = {name: context.getParameter(name) for name in protocol_parameters}
+    try:
+        for index, (_positions, _box_vectors) in enumerate(zip(positions, box_vectors)):
+            if _box_vectors is not None:
+                context.setPeriodicBoxVectors(*_box_vectors)
+            context.setPositions(_positions)
+            if len(independent_groups) > 0:
+                energies[index] += context.getState(getEnergy=True, groups=independent_groups).getPotentialEnergy().value_in_unit(unit.kilojoule_per_mole)
+            for parameters, groups, unique_values, inverse in cluster_plans:
+                unique_energies = np.zeros(len(unique_values))
+                for value_index, values in enumerate(unique_values):
+                    for name, value in zip(parameters, values):
+                        context.setParameter(name, float(value))
+                    unique_energies[value_index] = context.getState(getEnergy=True, groups=groups).getPotentialEnergy().value_in_unit(unit.kilojoule_per_mole)
+                energies[index] += unique_energies[inverse]
+            if thermodynamic_state.pressure is not None:
+                volumes[index] = context.getState().getPeriodicBoxVolume().value_in_unit(unit.nanometer**3)
+    finally:
+        for name, value in initial_parameters.items():
+            context.setParameter(name, value)
+
+    reduced_potentials = energies / kT
+    if thermodynamic_state.pressure is not None:
+        pV = (thermodynamic_state.pressure * volumes * unit.nanometer**3 * unit.AVOGADRO_CONSTANT_NA).value_in_unit(unit.kilojoule_per_mole)
+        reduced_potentials += (pV / kT)[:, np.newaxis]
+    return reduced_potentials
+
 def create_endstates(first_thermostate, last_thermostate):
     """
     utility function to generate unsampled endstates
@@ -534,7 +1157,7 @@ def activate_LocallyOptimalAnnealing(thermodynamic_state,
     supported_integrators = ['langevin', 'hmc']
 
     if remote_worker == 'remote':
-        _class = distributed.get_worker()
+        _class = get_worker()
     else:
         _class = remote_worker
 
@@ -558,7 +1181,7 @@ def deactivate_worker_attributes(remote_worker):
     """
     if remote_worker == 'remote':
         _logger.debug(f"\t\tremote_worker is True, getting worker")
-        _class = distributed.get_worker()
+        _class = get_worker()
     else:
         _logger.debug(f"\t\tremote worker is not True; getting local worker as 'self'")
         _class = remote_worker
@@ -583,7 +1206,7 @@ def call_anneal_method(remote_worker,
     the LocallyOptimalAnnealing.anneal method.
     """
     if remote_worker == 'remote':
-        _class = distributed.get_worker()
+        _class = get_worker()
     else:
         _class = remote_worker
 
@@ -599,11 +1222,143 @@ def call_anneal_method(remote_worker,
 
 
 
+def call_anneal_resident_method(remote_worker,
+                                particle_key,
+                                sampler_state,
+                                lambdas,
+                                noneq_trajectory_filename = None,
+                                num_integration_steps = 1,
+                                return_timer = False,
+                                rethermalize = False,
+                                compute_incremental_work = True,
+                                dependency = None):
+    """
+    this function calls LocallyOptimalAnnealing.anneal on a sampler state that stays on the worker;
+    the annealed sampler state is stored in the `particle_states` of the worker's annealing class under `particle_key`,
+    and the address of the worker is returned in place of the sampler state, so the configuration never travels through the scheduler.
+
+    Arguments
+    ---------
+    particle_key : tuple
+        key of the particle in the worker's `particle_states`
+    sampler_state : openmmtools.states.SamplerState or None
+        the sampler state to anneal; if None, the resident sampler state of `particle_key` is annealed
+    dependency : <generalized> future, default None
+        ignored; a future that has to complete before the annealing starts (e.g. the resampling of the worker's particles)
+
+    Returns
+    -------
+    incremental_work : np.array
+        incremental works of the annealing
+    address : str or int
+        the address of the worker holding the annealed sampler state (0 for local annealing)
+    timer : np.array
+        timers
+    _pass : bool
+        whether the annealing protocol passed
+    endstate_corrections : dict or None
+        the endstate corrections
+    """
+    if remote_worker == 'remote':
+        _class = get_worker()
+    else:
+        _class = remote_worker
+
+    annealing_class = _class.annealing_class
+    if not hasattr(annealing_class, 'particle_states'):
+        annealing_class.particle_states = {}
+    if sampler_state is None:
+        sampler_state = annealing_class.particle_states[particle_key]
+    else:
+        #a transferred sampler state may be shared by several offspring on this worker
+        sampler_state = copy.deepcopy(sampler_state)
+
+    incremental_work, new_sampler_state, timer, _pass, endstate_corrections = annealing_class.anneal(sampler_state = sampler_state,
+                                                                                                   lambdas = lambdas,
+                                                                                                   noneq_trajectory_filename = noneq_trajectory_filename,
+                                                                                                   num_integration_steps = num_integration_steps,
+                                                                                                   return_timer = return_timer,
+                                                                                                   return_sampler_state = True,
+                                                                                                   rethermalize = rethermalize,
+                                                                                                   compute_incremental_work = compute_incremental_work)
+    if _pass:
+        annealing_class.particle_states[particle_key] = new_sampler_state
+
+    address = _class.address if remote_worker == 'remote' else 0
+    return incremental_work, address, timer, _pass, endstate_corrections
+
+def resample_resident_particles(remote_worker, direction, generation, copies, exports):
+    """
+    resample the particles that reside on a worker: the sampler state of every (ancestor, offspring) pair in `copies` is copied within
+    the worker to the offspring of the next generation, the sampler states of the ancestors in `exports` are returned for transfer
+    to other workers, and the sampler states of the ancestor generation are removed from the worker.
+
+    Arguments
+    ---------
+    direction : str
+        the direction of the particles
+    generation : int
+        the generation of the ancestors; the particle keys are (direction, generation, index) and offspring are
+        stored as (direction, generation + 1, offspring index)
+    copies : list of (int, int)
+        (ancestor index, offspring index) pairs to copy within the worker
+    exports : list of int
+        ancestor indices whose sampler states are transferred to other workers
+
+    Returns
+    -------
+    exported_states : dict of {int: openmmtools.states.SamplerState}
+        the sampler states of the exported ancestors
+    """
+    if remote_worker == 'remote':
+        _class = get_worker()
+    else:
+        _class = remote_worker
+
+    particle_states = _class.annealing_class.particle_states
+    exported_states = {ancestor: particle_states[(direction, generation, ancestor)] for ancestor in exports}
+    remaining_uses = {}
+    for ancestor, offspring in copies:
+        remaining_uses[ancestor] = remaining_uses.get(ancestor, 0) + 1
+    for ancestor, offspring in copies:
+        remaining_uses[ancestor] -= 1
+        sampler_state = particle_states[(direction, generation, ancestor)]
+        #the last offspring of an ancestor that is not exported takes over the sampler state without copying
+        if remaining_uses[ancestor] > 0 or ancestor in exported_states:
+            sampler_state = copy.deepcopy(sampler_state)
+        particle_states[(direction, generation + 1, offspring)] = sampler_state
+
+    for key in [key for key in particle_states.keys() if key[:2] == (direction, generation)]:
+        del particle_states[key]
+
+    return exported_states
+
+def call_reduced_potentials_method(remote_worker, sampler_states, lambdas):
+    """
+    compute the reduced potentials of a batch of sampler states at an array of global lambdas with the thermodynamic state and lambda protocol
+    of the worker's LocallyOptimalAnnealing; this distributes the evaluation of trailblazing candidates over the annealing workers.
+
+    Returns
+    -------
+    reduced_potentials : np.ndarray of shape (len(sampler_states), len(lambdas))
+        unitless reduced potentials (kT)
+    """
+    if remote_worker == 'remote':
+        _class = get_worker()
+    else:
+        _class = remote_worker
+
+    annealing_class = _class.annealing_class
+    return compute_reduced_potential_matrix(annealing_class.thermodynamic_state, sampler_states, lambdas, annealing_class.lambda_protocol_class)
+
+
 class LocallyOptimalAnnealing():
     """
     Actor for locally optimal annealed importance sampling.
     The initialize method will create an appropriate context and the appropriate storage objects,
     but must be called explicitly.
+    The annealing context is owned by the actor and stays alive between calls to `anneal`; if the sampler state passed to `anneal`
+    is the one that the previous call returned, its positions and velocities are not transferred to the context again.
     """
     supported_integrators = ['langevin', 'hmc']
 
@@ -623,6 +1378,8 @@ class LocallyOptimalAnnealing():
 
         try:
             self.context_cache = cache.global_context_cache
+            self.context, self._context_integrator = None, None
+            self._resident_state = None
 
             if measure_shadow_work:
                 measure_heat = True
@@ -650,6 +1407,7 @@ class LocallyOptimalAnnealing():
             #create temperatures
             self.beta = 1.0 / (kB*temperature)
             self.temperature = temperature
+            self._kT = (kB * self.thermodynamic_state.temperature).value_in_unit(unit.kilojoule_per_mole)
 
             self.save_interval = ncmc_save_interval
 
@@ -758,22 +1516,25 @@ class LocallyOptimalAnnealing():
         else:
             endstate_rps = None
 
-        if compute_incremental_work:
-            self.dummy_sampler_state = copy.deepcopy(sampler_state) #use dummy to not update velocities and save bandwidth
         self.thermodynamic_state.set_alchemical_parameters(lambdas[0], lambda_protocol = self.lambda_protocol_class)
-        self.context, integrator = self.context_cache.get_context(self.thermodynamic_state, self.integrator)
-        self.sampler_state.apply_to_context(self.context, ignore_velocities=False)
+        integrator = self.activate_context()
+        if not self.is_resident(self.sampler_state):
+            self.sampler_state.apply_to_context(self.context, ignore_velocities=False)
+        self._resident_state = None
+
+        #precompute the alchemical parameters along the schedule so that only the changing globals are pushed to the context
+        self.prepare_schedule(lambdas)
 
         for idx, _lambda in enumerate(lambdas[1:]): #skip the first lambda
             try:
                 if return_timer:
                     start_timer = time.time()
                 if compute_incremental_work: #compute incremental work and update the context
-                    _incremental_work = self.compute_incremental_work(_lambda)
+                    _incremental_work = self.compute_incremental_work(_lambda, schedule_index = idx + 1)
                     assert np.isfinite(_incremental_work) #check to make sure that the incremental work doesn't blow up; not checking velocities
                     incremental_work[idx] = _incremental_work
-                else: #simply update the context from the thermodynamic state
-                    self.update_context(_lambda)
+                else: #simply update the context from the schedule
+                    self.update_context(_lambda, schedule_index = idx + 1)
 
                 integrator.step(num_integration_steps)
 
@@ -790,6 +1551,9 @@ class LocallyOptimalAnnealing():
 
         self.attempt_termination(noneq_trajectory_filename)
 
+        #the schedule only updated the lambda parameters; bring the full alchemical state up to date
+        self.thermodynamic_state.set_alchemical_parameters(lambdas[-1], lambda_protocol = self.lambda_protocol_class)
+
         #determine corrected endstates
         if self.compute_endstate_correction:
             self.thermodynamic_state.set_alchemical_parameters(lambdas[-1], lambda_protocol = self.lambda_protocol_class)
@@ -819,6 +1583,8 @@ class LocallyOptimalAnnealing():
             else:
                 self.sampler_state.update_from_context(self.context, ignore_velocities=False)
                 assert not self.sampler_state.has_nan()
+                #the context holds this particle; if it comes back for the next round, we need not transfer it again
+                self._resident_state = self._state_arrays(self.sampler_state)
             if not compute_incremental_work:
                 incremental_work = None
 
@@ -828,6 +1594,75 @@ class LocallyOptimalAnnealing():
 
 
 
+    def activate_context(self):
+        """
+        create the annealing context (once) and bring it up to date with the thermodynamic state;
+        the context is owned by the actor rather than the global context cache, so nothing else moves its configuration between rounds.
+
+        Returns
+        -------
+        integrator : openmm.Integrator
+            the integrator bound to the annealing context
+        """
+        if self.context is None:
+            self._context_integrator = copy.deepcopy(self.integrator)
+            self.context = self.thermodynamic_state.create_context(self._context_integrator, self.context_cache.platform)
+            self._work_force_groups = self._alchemical_force_groups()
+        else:
+            self.thermodynamic_state.apply_to_context(self.context)
+        return self._context_integrator
+
+    def _alchemical_force_groups(self):
+        """
+        the force groups of the annealing context whose forces depend on the alchemical parameters of the protocol;
+        only these contribute to the incremental work.
+
+        Returns
+        -------
+        groups : set of int or -1
+            the alchemical force groups; -1 (all groups) if every force group is alchemical
+        """
+        parameter_names = set(self.lambda_protocol_class.parameter_names)
+        groups, all_groups = set(), set()
+        for force in self.context.getSystem().getForces():
+            all_groups.add(force.getForceGroup())
+            if hasattr(force, 'getNumGlobalParameters'):
+                if any(force.getGlobalParameterName(index) in parameter_names for index in range(force.getNumGlobalParameters())):
+                    groups.add(force.getForceGroup())
+        return -1 if groups == all_groups else groups
+
+    def _state_arrays(self, sampler_state):
+        """
+        unitless copies of the positions, velocities, and box vectors of a sampler state
+        """
+        arrays = []
+        for quantity in [sampler_state.positions, sampler_state.velocities, sampler_state.box_vectors]:
+            arrays.append(None if quantity is None else np.array(quantity.value_in_unit_system(unit.md_unit_system)))
+        return arrays
+
+    def is_resident(self, sampler_state):
+        """
+        whether the sampler state is the configuration left in the annealing context by the last call to `anneal`
+
+        Arguments
+        ---------
+        sampler_state : openmmtools.states.SamplerState
+            the sampler state to check
+
+        Returns
+        -------
+        resident : bool
+            if True, the positions and velocities of the context are those of the sampler state
+        """
+        if self._resident_state is None or sampler_state.velocities is None:
+            return False
+        for resident, array in zip(self._resident_state, self._state_arrays(sampler_state)):
+            if (resident is None) != (array is None):
+                return False
+            if resident is not None and not np.array_equal(resident, array):
+                return False
+        return True
+
     def attempt_termination(self, noneq_trajectory_filename):
         """
         Attempt to terminate the annealing protocol and return the Particle attributes.
@@ -852,38 +1687,55 @@ class LocallyOptimalAnnealing():
         self._trajectory_box_lengths = []
         self._trajectory_box_angles = []
 
-    def compute_incremental_work(self, _lambda):
+    def prepare_schedule(self, lambdas):
+        """
+        precompute the table of alchemical parameters (and the mask of parameters that change at each step)
+        for a lambda schedule; `update_context` uses it to set only the context parameters that change.
+
+        Arguments
+        ---------
+        lambdas : np.array
+            numpy array of the lambdas to run
+        """
+        context_parameters = set(self.context.getParameters().keys())
+        self._schedule_parameters = np.array([name for name in self.lambda_protocol_class.parameter_names if name in context_parameters])
+        columns = [self.lambda_protocol_class.parameter_names.index(name) for name in self._schedule_parameters]
+        values, changes = self.lambda_protocol_class.schedule_table(lambdas)
+        self._schedule_values, self._schedule_changes = values[:, columns], changes[:, columns]
+
+    def compute_incremental_work(self, _lambda, schedule_index = None):
         """
         compute the incremental work of a lambda update on the thermodynamic state.
-        function also updates the thermodynamic state and the context
+        function also updates the thermodynamic state and the context.
+        the work is computed from the potential energy of the alchemical force groups of the context, without transferring the configuration;
+        the volume is unchanged by the update, so the pV contribution to the reduced potential cancels.
 
         Arguments
         ---------
         _lambda : float
             the lambda value used to update the importance sample
-        sampler_state : openmmtools.states.SamplerState
-            sampler state with which to update
+        schedule_index : int, default None
+            the row of the schedule prepared with `prepare_schedule` that corresponds to `_lambda`;
+            if None, the full thermodynamic state is applied to the context
 
         Return
         ------
         _incremental_work : float or None
             the incremental work returned from the lambda update; if None, then there is a numerical instability
         """
-        self.dummy_sampler_state.update_from_context(self.context, ignore_velocities=True)
-        assert not self.dummy_sampler_state.has_nan()
-        old_rp = self.thermodynamic_state.reduced_potential(self.dummy_sampler_state)
+        old_energy = self.context.getState(getEnergy=True, groups=self._work_force_groups).getPotentialEnergy().value_in_unit(unit.kilojoule_per_mole)
+        assert np.isfinite(old_energy)
 
         #update thermodynamic state and context
-        self.update_context(_lambda)
+        self.update_context(_lambda, schedule_index = schedule_index)
 
-        self.dummy_sampler_state.update_from_context(self.context, ignore_velocities=True)
-        assert not self.dummy_sampler_state.has_nan()
-        new_rp = self.thermodynamic_state.reduced_potential(self.dummy_sampler_state)
-        _incremental_work = new_rp - old_rp
+        new_energy = self.context.getState(getEnergy=True, groups=self._work_force_groups).getPotentialEnergy().value_in_unit(unit.kilojoule_per_mole)
+        assert np.isfinite(new_energy)
+        _incremental_work = (new_energy - old_energy) / self._kT
 
         return _incremental_work
 
-    def update_context(self, _lambda):
+    def update_context(self, _lambda, schedule_index = None):
         """
         utility function to update the class context
 
@@ -891,9 +1743,21 @@ class LocallyOptimalAnnealing():
         ---------
         _lambda : float
             the lambda value that the self.context will be updated to
+        schedule_index : int, default None
+            the row of the schedule prepared with `prepare_schedule` that corresponds to `_lambda`;
+            if given, only the parameters that changed since the previous row are set on the thermodynamic state and context.
+            if None, the full thermodynamic state is applied to the context
         """
-        self.thermodynamic_state.set_alchemical_parameters(_lambda, lambda_protocol = self.lambda_protocol_class)
-        self.thermodynamic_state.apply_to_context(self.context)
+        if schedule_index is None:
+            self.thermodynamic_state.set_alchemical_parameters(_lambda, lambda_protocol = self.lambda_protocol_class)
+            self.thermodynamic_state.apply_to_context(self.context)
+            return
+
+        changed = self._schedule_changes[schedule_index]
+        for parameter_name, value in zip(self._schedule_parameters[changed], self._schedule_values[schedule_index, changed]):
+            value = float(value)
+            setattr(self.thermodynamic_state, parameter_name, value)
+            self.context.setParameter(parameter_name, value)
 
 
     def save_configuration(self, iteration, sampler_state, context):
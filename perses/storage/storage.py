@@ -94,7 +94,7 @@ class NetCDFStorage(object):
         """
         self._ncfile.close()
 
-    def write_configuration(self, varname, positions, topology, iteration=None, frame=None, nframes=None):
+    def write_configuration(self, varname, positions, topology, iteration=None, frame=None, nframes=None, zlib=False, least_significant_digit=None):
         """Write a configuration (or one of a sequence of configurations) to be stored as a native NetCDF array
 
         Parameters
@@ -111,6 +111,10 @@ class NetCDFStorage(object):
             If these coordinates are part of multiple frames in a sequence, the frame number
         nframes : int, optional, default=None
             If these coordinates are part of multiple frames in a sequence, the total number of frames in the sequence
+        zlib : bool, optional, default=False
+            If True, the positions variable is created with zlib compression
+        least_significant_digit : int, optional, default=None
+            If not None, positions (in angstroms) are quantized to this many decimal digits before compression
 
         """
         ncgrp = self._find_group()
@@ -140,12 +144,13 @@ class NetCDFStorage(object):
 
             # Create variables
             # TODO: Handle cases with no iteration but with specified frames
+            compression = {'zlib': zlib, 'least_significant_digit': least_significant_digit}
             if (iteration is not None) and (frame is not None):
-                ncgrp.createVariable(varname, np.float32, dimensions=(frames_dimension_name, atoms_dimension_name, 'spatial'), chunksizes=(1,natoms,3))
+                ncgrp.createVariable(varname, np.float32, dimensions=(frames_dimension_name, atoms_dimension_name, 'spatial'), chunksizes=(1,natoms,3), **compression)
             elif (iteration is not None):
-                ncgrp.createVariable(varname, np.float32, dimensions=(atoms_dimension_name, 'spatial'), chunksizes=(natoms,3))
+                ncgrp.createVariable(varname, np.float32, dimensions=(atoms_dimension_name, 'spatial'), chunksizes=(natoms,3), **compression)
             else:
-                ncgrp.createVariable(varname, np.float32, dimensions=(atoms_dimension_name, 'spatial'), chunksizes=(natoms,3))
+                ncgrp.createVariable(varname, np.float32, dimensions=(atoms_dimension_name, 'spatial'), chunksizes=(natoms,3), **compression)
 
         # Write Topology
         if (frame is None) or (frame == 0):
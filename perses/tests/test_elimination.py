@@ -711,3 +711,130 @@ def test_alchemical_elimination_peptide():
         f = partial(check_alchemical_null_elimination, topology_proposal, testsystem.positions, ncmc_nsteps=ncmc_nsteps)
         f.description = "Testing alchemical elimination using alanine dipeptide with %d NCMC steps" % ncmc_nsteps
         yield f
+
+def test_hybrid_cache():
+    """
+    Test that the hybrid cache evicts least recently used entries to stay within its estimated memory bound
+    and reports hit/miss statistics.
+    """
+    from perses.annihilation.ncmc_switching import HybridCache
+
+    class DummyEntry(object):
+        def __init__(self, nbytes):
+            self.nbytes = nbytes
+            self.released = False
+        def release(self):
+            self.released = True
+
+    cache = HybridCache(max_bytes=250)
+    entries = {key: DummyEntry(100) for key in ['a', 'b', 'c']}
+    cache['a'] = entries['a']
+    cache['b'] = entries['b']
+    assert cache['a'] is entries['a'] # 'a' is now the most recently used entry
+    cache['c'] = entries['c'] # evicts 'b'
+    assert 'b' not in cache and 'a' in cache and 'c' in cache
+    assert entries['b'].released and not entries['a'].released
+    assert cache.nbytes == 200
+    try:
+        cache['b']
+        raise Exception("the evicted entry was retrieved")
+    except KeyError:
+        pass
+
+    statistics = cache.statistics
+    assert statistics['hits'] == 1 and statistics['misses'] == 1 and statistics['evictions'] == 1
+    assert statistics['entries'] == 2
+
+    # an entry that exceeds the bound by itself is still cached
+    cache['d'] = DummyEntry(1000)
+    assert len(cache) == 1 and 'd' in cache
+
+def test_switching_work_statistics():
+    """
+    Test that the streaming switching work statistics match batch estimates.
+    """
+    from perses.annihilation.ncmc_switching import SwitchingWorkStatistics
+    from scipy.special import logsumexp
+    works = np.random.normal(loc=5.0, scale=2.0, size=200)
+    statistics = SwitchingWorkStatistics()
+    for work in works:
+        statistics.update(work)
+    assert statistics.n == len(works)
+    assert np.isclose(statistics.mean, np.mean(works))
+    assert np.isclose(statistics.variance, np.var(works, ddof=1))
+    assert np.isclose(statistics.free_energy_EXP, -logsumexp(-works) + np.log(len(works)))
+    assert np.allclose(statistics.works, works)
+
+def generate_alanine_dipeptide_null_proposal():
+    """
+    Generate a vacuum alanine dipeptide null proposal in which the N-methyl group is deleted and reinserted, and its positions.
+    """
+    from openmmtools import testsystems
+    from perses.rjmc.topology_proposal import TopologyProposal
+    testsystem = testsystems.AlanineDipeptideVacuum()
+    new_to_old_atom_map = { index : index for index in range(testsystem.system.getNumParticles()) if (index > 3) } # all atoms but N-methyl
+    topology_proposal = TopologyProposal(
+        old_system=testsystem.system, old_topology=testsystem.topology,
+        old_chemical_state_key='AA', new_chemical_state_key='AA',
+        new_system=testsystem.system, new_topology=testsystem.topology,
+        logp_proposal=0.0, new_to_old_atom_map=new_to_old_atom_map, metadata=dict())
+    return topology_proposal, testsystem.positions
+
+def test_external_and_native_switching_agree():
+    """
+    Test that external and integrator native NCMC switching give the same work for a vacuum alanine dipeptide proposal
+    when run with the same seed and without collisions.
+    """
+    from openmmtools.states import SamplerState
+    from perses.annihilation.ncmc_switching import NCMCEngine
+    topology_proposal, positions = generate_alanine_dipeptide_null_proposal()
+    platform = openmm.Platform.getPlatformByName('Reference')
+
+    logP_works, final_positions = [], []
+    for integrator_native_switching in [False, True]:
+        ncmc_engine = NCMCEngine(temperature=temperature, nsteps=20, platform=platform, integrator_native_switching=integrator_native_switching,
+                                 collision_rate=0.0/unit.picoseconds, random_seed=1234)
+        [_, final_sampler_state, logP_work, _, _] = ncmc_engine.integrate(topology_proposal, SamplerState(positions), SamplerState(positions))
+        logP_works.append(logP_work)
+        final_positions.append(final_sampler_state.positions.value_in_unit(unit.nanometers))
+
+    assert np.isfinite(logP_works[0])
+    assert np.isclose(logP_works[0], logP_works[1], rtol=1e-6, atol=1e-6), f"external ({logP_works[0]}) and native ({logP_works[1]}) switching works differ"
+    assert np.allclose(final_positions[0], final_positions[1], atol=1e-6)
+
+def test_ncmc_work_readout_and_trajectory_atoms():
+    """
+    Test that the protocol work is read out every `work_readout_interval` steps in both switching modes, with the same total
+    work as an unstrided switch, and that only the `trajectory_atom_indices` are written to the stored NCMC trajectory.
+    """
+    import tempfile
+    from openmmtools.states import SamplerState
+    from perses.storage import NetCDFStorage
+    from perses.annihilation.ncmc_switching import NCMCEngine
+    topology_proposal, positions = generate_alanine_dipeptide_null_proposal()
+    platform = openmm.Platform.getPlatformByName('Reference')
+    nsteps, write_ncmc_interval = 20, 10
+    trajectory_atom_indices = [4, 5, 6, 7, 8]
+
+    expected_readouts = {(None, False): nsteps + 1, (None, True): 2, (5, False): nsteps // 5 + 1, (5, True): nsteps // 5 + 1}
+    final_works = []
+    for (work_readout_interval, integrator_native_switching), nreadouts in expected_readouts.items():
+        tmpfile = tempfile.NamedTemporaryFile()
+        storage = NetCDFStorage(tmpfile.name, mode='w')
+        ncmc_engine = NCMCEngine(temperature=temperature, nsteps=nsteps, platform=platform, storage=storage,
+                                 integrator_native_switching=integrator_native_switching, work_readout_interval=work_readout_interval,
+                                 write_ncmc_interval=write_ncmc_interval, trajectory_atom_indices=trajectory_atom_indices,
+                                 collision_rate=0.0/unit.picoseconds, random_seed=1234)
+        [_, _, logP_work, _, _] = ncmc_engine.integrate(topology_proposal, SamplerState(positions), SamplerState(positions), iteration=0)
+
+        protocol_work = np.array(storage._ncfile['/NCMCEngine/protocolwork'][0])
+        assert len(protocol_work) == nreadouts
+        assert protocol_work[0] == 0.0
+        assert np.isclose(protocol_work[-1], -logP_work)
+        final_works.append(protocol_work[-1])
+
+        ncmc_positions = storage._ncfile['/NCMCEngine/ncmcpositions_0']
+        assert ncmc_positions.shape == (nsteps // write_ncmc_interval, len(trajectory_atom_indices), 3)
+        storage.close()
+
+    assert np.allclose(final_works, final_works[0], rtol=1e-6, atol=1e-6)
@@ -41,3 +41,163 @@ def test_lambda_protocol_naked_charges():
                   'lambda_electrostatics_insert':
                   lambda x: 2.0 * x if x < 0.5 else 1.0}
     lp = LambdaProtocol(functions=naked_charge_functions)
+
+def test_compiled_lambda_protocol():
+    """
+    Tests that the compiled (tabulated) protocol reproduces the python lambda functions for arrays of global lambda
+    """
+    global_lambdas = np.concatenate([np.linspace(0., 1., 101), np.random.uniform(0., 1., 50)])
+    nonlinear_functions = {'lambda_sterics_core': lambda x: x**2}
+    for protocol in ['default', 'namd', 'quarters', nonlinear_functions]:
+        lp = LambdaProtocol(functions=protocol)
+        values = lp.evaluate(global_lambdas)
+        assert values.shape == (len(global_lambdas), len(lp.parameter_names))
+        for index, name in enumerate(lp.parameter_names):
+            exact = np.array([lp.functions[name](l) for l in global_lambdas])
+            assert np.allclose(values[:, index], exact, rtol=0., atol=1e-12), f"compiled {name} deviates from its function"
+
+    # a single global lambda yields a single row
+    lp = LambdaProtocol(functions='default')
+    assert lp.evaluate(0.3).shape == (1, 9)
+    assert lp.evaluate_dict(1.)['lambda_sterics_delete'] == 1.
+
+def test_lambda_protocol_schedule_table():
+    """
+    Tests that the schedule table flags exactly the parameters that change between consecutive steps
+    """
+    lp = LambdaProtocol(functions='quarters')
+    lambdas = np.linspace(0., 1., 21)
+    values, changes = lp.schedule_table(lambdas)
+    assert values.shape == changes.shape == (21, 9)
+    assert changes[0].all()
+    for step in range(1, len(lambdas)):
+        for index, name in enumerate(lp.parameter_names):
+            changed = lp.functions[name](lambdas[step]) != lp.functions[name](lambdas[step - 1])
+            assert changes[step, index] == changed, f"change mask of {name} is wrong at step {step}"
+
+    # in the 'quarters' protocol, the insert electrostatics are constant over the first three quarters
+    column = lp.parameter_names.index('lambda_electrostatics_insert')
+    assert not changes[1:16, column].any()
+
+def test_thermodynamic_length_optimizer():
+    """
+    Tests that the thermodynamic length optimizer concentrates lambda steps where the pilot work variance is large
+    and emits a valid LambdaProtocol
+    """
+    pilot_lambdas = np.linspace(0., 1., 11)
+    # the second half of the protocol is 9 times more dissipative (3 times longer) than the first
+    work_variances = np.array([1.] * 5 + [9.] * 5)
+    optimizer = ThermodynamicLengthOptimizer(pilot_lambdas, work_variances)
+    assert np.isclose(optimizer.thermodynamic_length, 20.)
+
+    lambdas = optimizer.optimal_lambdas(8)
+    assert lambdas[0] == 0. and lambdas[-1] == 1.
+    assert np.all(np.diff(lambdas) > 0.)
+    # a quarter of the length is covered in the first half
+    assert np.isclose(lambdas[2], 0.5)
+    assert np.allclose(optimizer.optimal_lambdas(8, direction='reverse'), lambdas[::-1])
+
+    # the optimal protocol is the pilot protocol evaluated at the optimal lambdas
+    lp = optimizer.optimal_protocol()
+    base = LambdaProtocol()
+    values = lp.evaluate(np.linspace(0., 1., 9))
+    for index, name in enumerate(lp.parameter_names):
+        assert np.allclose(values[:, index], [base.functions[name](l) for l in lambdas])
+
+    # the optimal protocol is exactly tabulated on its own nodes and can be expressed algebraically
+    assert lp._tabulated.all()
+    assert all(isinstance(function, PiecewiseLinearFunction) for function in lp.functions.values())
+    global_lambdas = np.random.uniform(0., 1., 50)
+    exact = base.evaluate(optimizer.pilot_lambda(global_lambdas))
+    assert np.allclose(lp.evaluate(global_lambdas), exact, rtol=0., atol=1e-12)
+    expressions = lp.to_expressions(variable='x')
+    for index, name in enumerate(lp.parameter_names):
+        values = np.array([eval(expressions[name], {'max': max, 'x': l}) for l in global_lambdas])
+        assert np.allclose(values, exact[:, index], rtol=0., atol=1e-9), f"expression of {name} deviates from the optimal protocol"
+
+    # per-component incremental works from reverse pilot runs
+    incremental_works = {'lambda_sterics_core': np.random.normal(size=(50, 10)), 'lambda_electrostatics_core': np.random.normal(size=(50, 10))}
+    optimizer = ThermodynamicLengthOptimizer.from_incremental_works(pilot_lambdas[::-1], incremental_works)
+    assert optimizer.component_lengths.shape == (2,)
+
+def test_lambda_protocol_expressions():
+    """
+    Tests that the algebraic expressions of the predefined protocols reproduce the python lambda functions
+    """
+    global_lambdas = np.concatenate([np.linspace(0., 1., 25), np.random.uniform(0., 1., 50)])
+    for protocol in ['default', 'namd', 'quarters']:
+        lp = LambdaProtocol(functions=protocol)
+        expressions = lp.to_expressions(variable='x')
+        assert set(expressions.keys()) == set(lp.parameter_names)
+        for name, expression in expressions.items():
+            values = np.array([eval(expression, {'max': max, 'x': l}) for l in global_lambdas])
+            exact = np.array([lp.functions[name](l) for l in global_lambdas])
+            assert np.allclose(values, exact, rtol=0., atol=1e-12), f"expression {expression} of {name} deviates from its function"
+
+@raises(ValueError)
+def test_lambda_protocol_expressions_nonlinear():
+    lp = LambdaProtocol(functions={'lambda_sterics_core': lambda x: x**2})
+    lp.to_expressions()
+
+_exponent = 2
+
+def _global_power(x):
+    return x**_exponent
+
+def test_lambda_protocol_validation_memoization():
+    """
+    Tests that protocols are validated and compiled once per distinct protocol, and that naked charges are reported by lambda range
+    """
+    lp1 = LambdaProtocol(functions='namd')
+    lp2 = LambdaProtocol(functions='namd')
+    assert lp1.fingerprint is not None and lp1.fingerprint == lp2.fingerprint
+    assert lp1._table is lp2._table
+    assert lp1.fingerprint != LambdaProtocol(functions='quarters').fingerprint
+
+    # functions that differ only in a closed-over constant have different fingerprints
+    def make_function(power):
+        return lambda x: x**power
+    assert LambdaProtocol(functions={'lambda_sterics_core': make_function(2)}).fingerprint != LambdaProtocol(functions={'lambda_sterics_core': make_function(3)}).fingerprint
+
+    # functions that differ only in the value of a module-level global have different fingerprints and tables
+    global _exponent
+    fingerprints = []
+    for exponent in [2, 3]:
+        _exponent = exponent
+        lp = LambdaProtocol(functions={'lambda_sterics_core': _global_power})
+        column = lp.parameter_names.index('lambda_sterics_core')
+        assert np.allclose(lp._table[:, column], lp._grid**exponent)
+        fingerprints.append(lp.fingerprint)
+    assert fingerprints[0] != fingerprints[1]
+
+    # bound methods (and functions referring to mutable objects) are not memoized, so differently configured instances give different protocols
+    class Slope(object):
+        def __init__(self, slope):
+            self.slope = slope
+        def function(self, x):
+            return min(1.0, self.slope * x)
+    lps = [LambdaProtocol(functions={'lambda_sterics_core': Slope(slope).function}) for slope in [2.0, 4.0]]
+    assert all(lp.fingerprint is None for lp in lps)
+    column = lps[0].parameter_names.index('lambda_sterics_core')
+    assert not np.allclose(lps[0]._table[:, column], lps[1]._table[:, column])
+    slope = Slope(2.0)
+    assert LambdaProtocol(functions={'lambda_sterics_core': lambda x: slope.function(x)}).fingerprint is None
+
+    # the memoized protocols are bounded, evicting the least recently used
+    max_compiled_protocols = LambdaProtocol.max_compiled_protocols
+    try:
+        LambdaProtocol.max_compiled_protocols = 2
+        for slope in [2.0, 3.0, 4.0]:
+            LambdaProtocol(functions={'lambda_sterics_core': lambda x, slope=slope: min(1.0, slope * x)})
+        assert len(LambdaProtocol._compiled_protocols) == 2
+    finally:
+        LambdaProtocol.max_compiled_protocols = max_compiled_protocols
+
+    naked_charge_functions = {'lambda_sterics_insert': lambda x: 0.0 if x < 0.5 else 2.0 * (x - 0.5),
+                              'lambda_electrostatics_insert': lambda x: 2.0 * x if x < 0.5 else 1.0}
+    for _ in range(2): # failing protocols are never memoized
+        try:
+            LambdaProtocol(functions=naked_charge_functions)
+            raise Exception("naked charges were not detected")
+        except AssertionError as e:
+            assert 'unique new atoms' in str(e) and '[0.0008333, 0.5]' in str(e), str(e)
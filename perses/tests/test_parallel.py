@@ -51,6 +51,54 @@ def test_Parallelism_distributed():
     run_parallelism(_parallel, data)
 
 
+def test_Parallelism_multiprocessing():
+    """
+    following function will create a local process pool Parallelism instance and run all of the used methods.
+    """
+    _parallel = parallel.Parallelism()
+
+    #test client activation
+    _parallel.activate_client(library = ('multiprocessing', 'local'), num_processes = 2)
+    assert _parallel.client is not None
+    assert _parallel.num_processes == 2
+    assert len(_parallel.workers) == 2
+
+    #run_all has to hit every process exactly once
+    addresses = _parallel.run_all(parallel._local_worker_address, (), workers = list(_parallel.workers.values()))
+    assert sorted(addresses.keys()) == sorted(_parallel.workers.values())
+    assert all(key == value for key, value in addresses.items())
+
+    data = np.arange(10)
+    run_parallelism(_parallel, data)
+
+    #results of the pool have to match the serial results
+    futures = _parallel.deploy(dummy_function, (_parallel.scatter(data),))
+    _parallel.wait(futures)
+    assert _parallel.gather_results(futures) == [dummy_function(i) for i in data]
+
+    #requesting workers from the process pool is reported, since tasks cannot be pinned to a process
+    import logging
+    class RecordingHandler(logging.Handler):
+        def __init__(self):
+            super(RecordingHandler, self).__init__(level = logging.WARNING)
+            self.messages = []
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+    handler = RecordingHandler()
+    logging.getLogger("parallelism").addHandler(handler)
+    _parallel._warned_unpinned_workers = False
+    try:
+        workers = [_parallel.workers[0]]
+        futures = _parallel.deploy(dummy_function, (list(data),), workers = workers)
+        assert _parallel.gather_results(futures) == [dummy_function(i) for i in data]
+        assert _parallel.submit(dummy_function, 1, workers = workers).result() == dummy_function(1)
+        assert len(handler.messages) == 1 and 'ignored' in handler.messages[0]
+    finally:
+        logging.getLogger("parallelism").removeHandler(handler)
+
+    _parallel.deactivate_client()
+    assert not hasattr(_parallel, 'client')
+
 @nottest
 @skipIf(istravis, "Skip helper function on travis")
 def run_parallelism(_parallel, data):
@@ -105,6 +153,16 @@ def run_parallelism(_parallel, data):
         pass
 
 
+    #submit and resubmit futures as they complete
+    pending = _parallel.as_completed([_parallel.submit(dummy_function, i) for i in data])
+    completed = []
+    for future in pending:
+        result = future.result()
+        completed.append(result)
+        if result < len(data):
+            pending.add(_parallel.submit(dummy_function, result + len(data)))
+    assert sorted(completed) == list(range(2 * len(data))), f"as_completed returned {sorted(completed)}"
+
     #attempt a run all
     run_all_futures = _parallel.run_all(dummy_function,
                                         (data,),
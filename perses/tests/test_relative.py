@@ -562,3 +562,208 @@ def test_HybridTopologyFactory_energies(molecule_perturbation_list = [['naphthal
     for molecule_pair in molecule_perturbation_list:
         print(f"\tconduct energy comparison for {molecule_pair[0]} --> {molecule_pair[1]}")
         HybridTopologyFactory_energies(current_mol = molecule_pair[0], proposed_mol = molecule_pair[1])
+
+def test_gbsaobc_conversion():
+    """
+    Test that the CustomGBForce built from a GBSAOBCForce by the HybridTopologyFactory reproduces its energy.
+    """
+    from openmmtools.testsystems import AlanineDipeptideImplicit
+    testsystem = AlanineDipeptideImplicit()
+    gbsa_force = [force for force in testsystem.system.getForces() if force.__class__.__name__ == 'GBSAOBCForce'][0]
+    custom_gb_force = HybridTopologyFactory._convert_gbsaobc_to_custom_gb(gbsa_force)
+
+    energies = []
+    for force in [copy.deepcopy(gbsa_force), custom_gb_force]:
+        system = openmm.System()
+        for particle_index in range(testsystem.system.getNumParticles()):
+            system.addParticle(testsystem.system.getParticleMass(particle_index))
+        system.addForce(force)
+        energies.append(utils.compute_potential(system, testsystem.positions, platform = openmm.Platform.getPlatformByName("Reference")))
+
+    assert abs(energies[0] - energies[1]) < 1e-4 * abs(energies[0]), f"GBSAOBCForce energy {energies[0]} does not match the CustomGBForce energy {energies[1]}"
+
+def test_copy_on_write_construction():
+    """
+    Test that building the hybrid system without copying the input systems leaves them unmodified and yields the same hybrid system
+    """
+    topology_proposal, old_positions, new_positions = utils.generate_solvated_hybrid_test_topology(vacuum = True)
+    old_system_xml = openmm.XmlSerializer.serialize(topology_proposal.old_system)
+    new_system_xml = openmm.XmlSerializer.serialize(topology_proposal.new_system)
+
+    copied_factory = HybridTopologyFactory(topology_proposal, old_positions, new_positions, copy_systems = True)
+    uncopied_factory = HybridTopologyFactory(topology_proposal, old_positions, new_positions, copy_systems = False)
+
+    assert openmm.XmlSerializer.serialize(copied_factory.hybrid_system) == openmm.XmlSerializer.serialize(uncopied_factory.hybrid_system)
+    assert openmm.XmlSerializer.serialize(topology_proposal.old_system) == old_system_xml
+    assert openmm.XmlSerializer.serialize(topology_proposal.new_system) == new_system_xml
+
+def test_construction_profile():
+    """
+    Test that the construction profile accounts for every term and exception of the hybrid system
+    """
+    topology_proposal, old_positions, new_positions = utils.generate_solvated_hybrid_test_topology(vacuum = True)
+    factory = HybridTopologyFactory(topology_proposal, old_positions, new_positions, log_construction_profile = True)
+    profile = factory.construction_profile
+
+    assert profile['num_particles'] == factory.hybrid_system.getNumParticles()
+    assert sum(step['num_terms'] for step in profile['steps'].values()) == profile['num_terms']
+    assert sum(step['num_exceptions'] for step in profile['steps'].values()) == profile['num_exceptions']
+    assert 'handle_nonbonded' in profile['steps']
+    assert all(step['wall_time'] >= 0.0 for step in profile['steps'].values())
+
+def test_pruned_interaction_groups():
+    """
+    Test that pruning the interaction groups of the custom sterics force does not change the hybrid energy
+    """
+    topology_proposal, old_positions, new_positions = utils.generate_solvated_hybrid_test_topology(vacuum = True)
+    platform = openmm.Platform.getPlatformByName("Reference")
+    energies = []
+    for prune_interaction_groups in [False, True]:
+        factory = HybridTopologyFactory(topology_proposal, old_positions, new_positions, prune_interaction_groups = prune_interaction_groups)
+        energies.append(utils.compute_potential(factory.hybrid_system, factory.hybrid_positions, platform = platform))
+
+    assert abs(energies[0] - energies[1]) < 1e-6 * unit.kilojoules_per_mole, f"energies differ: {energies}"
+
+def test_alchemical_force_group():
+    """
+    Test that only the lambda-dependent custom forces are moved to the alchemical force group and that the energy is unchanged
+    """
+    topology_proposal, old_positions, new_positions = utils.generate_solvated_hybrid_test_topology(vacuum = True)
+    platform = openmm.Platform.getPlatformByName("Reference")
+    reference_factory = HybridTopologyFactory(topology_proposal, old_positions, new_positions)
+    factory = HybridTopologyFactory(topology_proposal, old_positions, new_positions, alchemical_force_group = 1)
+    for name, force in factory._hybrid_system_forces.items():
+        if name.startswith('standard'):
+            assert force.getForceGroup() == 0, f"{name} was moved out of the environment force group"
+    assert factory._hybrid_system_forces['core_sterics_force'].getForceGroup() == 1
+    assert factory._hybrid_system_forces['core_bond_force'].getForceGroup() == 1
+
+    reference_energy = utils.compute_potential(reference_factory.hybrid_system, reference_factory.hybrid_positions, platform = platform)
+    energy = utils.compute_potential(factory.hybrid_system, factory.hybrid_positions, platform = platform)
+    assert abs(energy - reference_energy) < 1e-6 * unit.kilojoules_per_mole
+
+def _add_rb_torsion_force(system):
+    """
+    Add a RBTorsionForce over the first torsions of the PeriodicTorsionForce of a system
+    """
+    torsion_force = [force for force in system.getForces() if force.__class__.__name__ == 'PeriodicTorsionForce'][0]
+    rb_force = openmm.RBTorsionForce()
+    for index in range(min(10, torsion_force.getNumTorsions())):
+        i, j, k, l, _, _, _ = torsion_force.getTorsionParameters(index)
+        rb_force.addTorsion(i, j, k, l, 0.5, -1.0, 0.3, 0.2, 0.1, 0.05)
+    system.addForce(rb_force)
+
+def _add_cmap_torsion_force(system):
+    """
+    Add a CMAPTorsionForce over pairs of consecutive torsions of the PeriodicTorsionForce of a system
+    """
+    torsion_force = [force for force in system.getForces() if force.__class__.__name__ == 'PeriodicTorsionForce'][0]
+    cmap_force = openmm.CMAPTorsionForce()
+    size = 24
+    cmap_force.addMap(size, list(np.sin(np.linspace(0., 6. * np.pi, size * size))))
+    for index in range(min(10, torsion_force.getNumTorsions() - 1)):
+        first_torsion = torsion_force.getTorsionParameters(index)[:4]
+        second_torsion = torsion_force.getTorsionParameters(index + 1)[:4]
+        cmap_force.addTorsion(0, *first_torsion, *second_torsion)
+    system.addForce(cmap_force)
+
+def _add_gbsaobc_force(system):
+    """
+    Add a GBSAOBCForce with the charges of the NonbondedForce of a system
+    """
+    nonbonded_force = [force for force in system.getForces() if force.__class__.__name__ == 'NonbondedForce'][0]
+    gbsa_force = openmm.GBSAOBCForce()
+    for particle_index in range(nonbonded_force.getNumParticles()):
+        charge, _, _ = nonbonded_force.getParticleParameters(particle_index)
+        gbsa_force.addParticle(charge, 0.15, 0.8)
+    system.addForce(gbsa_force)
+
+def compare_endstate_energies_with_force(add_force, mol_name = "naphthalene", ref_mol_name = "benzene"):
+    """
+    Add a force (with `add_force(system)`) to a small molecule system and build hybrid systems with an identical atom map
+    and with a map of one of its rings (as in `compare_energies`).  With the identical map, the hybrid energies at lambda = 0 and 1
+    must reproduce the energy of the system; with the ring map, the unique atoms are duplicated, and the hybrid energies at lambda = 0 and 1 must agree.
+    """
+    from openmmtools import states
+    from perses.utils.openeye import createSystemFromIUPAC
+    from openmoltools.openeye import iupac_to_oemol, generate_conformers
+
+    mol = iupac_to_oemol(mol_name)
+    mol = generate_conformers(mol, max_confs=1)
+    m, system, positions, topology = createSystemFromIUPAC(mol_name)
+    add_force(system)
+
+    refmol = iupac_to_oemol(ref_mol_name)
+    refmol = generate_conformers(refmol, max_confs=1)
+    atom_map = SmallMoleculeSetProposalEngine._get_mol_atom_map(mol, refmol)
+
+    platform = openmm.Platform.getPlatformByName("Reference")
+    for effective_atom_map in [{index: index for index in range(system.getNumParticles())}, {value: value for value in atom_map.values()}]:
+        top_proposal = TopologyProposal(new_topology=topology, new_system=system, old_topology=topology, old_system=system, new_to_old_atom_map=effective_atom_map, new_chemical_state_key="n1", old_chemical_state_key='n2')
+        factory = HybridTopologyFactory(top_proposal, positions, positions)
+        nonalch_zero, nonalch_one, alch_zero, alch_one = utils.generate_endpoint_thermodynamic_states(factory.hybrid_system, top_proposal)
+
+        rp_list = []
+        for state, state_positions in [(nonalch_zero, positions), (alch_zero, factory.hybrid_positions), (alch_one, factory.hybrid_positions), (nonalch_one, positions)]:
+            integrator = openmm.VerletIntegrator(1)
+            context = state.create_context(integrator, platform)
+            samplerstate = states.SamplerState(positions = state_positions, box_vectors = state.system.getDefaultPeriodicBoxVectors())
+            samplerstate.apply_to_context(context)
+            rp_list.append(state.reduced_potential(context))
+            del context, integrator
+
+        nonalch_zero_rp, alch_zero_rp, alch_one_rp, nonalch_one_rp = rp_list
+        assert abs(alch_zero_rp - alch_one_rp) < 1e-6, f"the hybrid energies at lambda = 0 ({alch_zero_rp}) and 1 ({alch_one_rp}) differ"
+        if len(effective_atom_map) == system.getNumParticles():
+            assert abs(nonalch_zero_rp - alch_zero_rp) < 1e-6, f"the hybrid energy at lambda = 0 ({alch_zero_rp}) does not match the old system energy ({nonalch_zero_rp})"
+            assert abs(nonalch_one_rp - alch_one_rp) < 1e-6, f"the hybrid energy at lambda = 1 ({alch_one_rp}) does not match the new system energy ({nonalch_one_rp})"
+
+def test_rb_torsion_endstate_energies():
+    """
+    Test that hybrid systems with a RBTorsionForce reproduce the endstate energies
+    """
+    compare_endstate_energies_with_force(_add_rb_torsion_force)
+
+def test_cmap_torsion_endstate_energies():
+    """
+    Test that hybrid systems with a CMAPTorsionForce reproduce the endstate energies
+    """
+    compare_endstate_energies_with_force(_add_cmap_torsion_force)
+
+def test_gbsaobc_endstate_energies():
+    """
+    Test that hybrid systems with implicit solvent reproduce the endstate energies
+    """
+    compare_endstate_energies_with_force(_add_gbsaobc_force)
+
+def test_interpolate_core_sterics_in_nonbonded():
+    """
+    Test that interpolating the core sterics in the standard NonbondedForce gives the hybrid energies of the default construction
+    at lambda = 0, 0.5 and 1.  The mixed epsilons of the two constructions only agree at intermediate lambda if the core epsilons
+    do not change, so the core epsilons of the new system are set to the old ones (the sigmas and charges still change).
+    """
+    from perses.annihilation.lambda_protocol import RelativeAlchemicalState
+    topology_proposal, old_positions, new_positions = utils.generate_solvated_hybrid_test_topology(vacuum = True)
+    old_nonbonded_force = [force for force in topology_proposal.old_system.getForces() if force.__class__.__name__ == 'NonbondedForce'][0]
+    new_nonbonded_force = [force for force in topology_proposal.new_system.getForces() if force.__class__.__name__ == 'NonbondedForce'][0]
+    for new_index, old_index in topology_proposal.new_to_old_atom_map.items():
+        charge, sigma, _ = new_nonbonded_force.getParticleParameters(new_index)
+        new_nonbonded_force.setParticleParameters(new_index, charge, sigma, old_nonbonded_force.getParticleParameters(old_index)[2])
+
+    platform = openmm.Platform.getPlatformByName("Reference")
+    energies = {}
+    for interpolate_core_sterics_in_nonbonded in [False, True]:
+        factory = HybridTopologyFactory(topology_proposal, old_positions, new_positions, interpolate_core_sterics_in_nonbonded = interpolate_core_sterics_in_nonbonded)
+        alchemical_state = RelativeAlchemicalState.from_system(factory.hybrid_system)
+        integrator = openmm.VerletIntegrator(1.0 * unit.femtoseconds)
+        context = openmm.Context(factory.hybrid_system, integrator, platform)
+        context.setPositions(factory.hybrid_positions)
+        for lambda_value in [0.0, 0.5, 1.0]:
+            alchemical_state.set_alchemical_parameters(lambda_value)
+            alchemical_state.apply_to_context(context)
+            energies[(interpolate_core_sterics_in_nonbonded, lambda_value)] = context.getState(getEnergy = True).getPotentialEnergy()
+        del context, integrator
+
+    for lambda_value in [0.0, 0.5, 1.0]:
+        default_energy, energy = energies[(False, lambda_value)], energies[(True, lambda_value)]
+        assert abs(energy - default_energy) < 1e-4 * unit.kilojoules_per_mole, f"at lambda = {lambda_value}, the energy {energy} does not match the default construction energy {default_energy}"
@@ -100,6 +100,7 @@ def sMC_setup():
     assert all(sum([ne_fep._eq_dict[state][i][-1] for i in range(len(ne_fep._eq_dict[state]))]) == 10 for state in [0,1]), f"there should be 10 snapshots per endstate"
     assert all(len(ne_fep._eq_dict[f"{state}_reduced_potentials"]) == 10 for state in [0,1]), f"there should be 10 reduced potentials per endstate"
     assert all(len(ne_fep._eq_dict[f"{state}_decorrelated"]) <= 10 for state in [0,1]), f"the decorrelated indices must be less than or equal to the total number of snapshots"
+    assert all(set(ne_fep._snapshot_stores[state].keys()) == set(ne_fep._eq_dict[f"{state}_decorrelated"]) for state in [0,1]), f"the snapshot stores should hold the decorrelated snapshots of every endstate"
 
     #now to check for decorrelation in ne_fep._eq_files_dict...
     _filenames_0, _filenames_1 = [ne_fep._eq_dict[0][i][0] for i in range(len(ne_fep._eq_dict[0]))], [ne_fep._eq_dict[1][i][0] for i in range(len(ne_fep._eq_dict[1]))]
@@ -144,6 +145,15 @@ def test_local_AIS():
                                                                        compute_incremental_work = True)
     if _pass: #the function is nan-safe
         assert  incremental_work is not None and sampler_state is not None and timer is not None, f"no returns can be None if the method passes"
+        #the annealing context is kept alive and holds the returned particle
+        context = ne_fep.annealing_class.context
+        assert ne_fep.annealing_class.is_resident(sampler_state), f"the returned sampler state should be resident in the annealing context"
+        assert not ne_fep.annealing_class.is_resident(ne_fep.sampler_states[0]), f"a different sampler state cannot be resident in the annealing context"
+        incremental_work, sampler_state, timer, _pass, endstates = call_anneal_method(remote_worker = ne_fep,
+                                                                           sampler_state = sampler_state,
+                                                                           lambdas = np.array([1e-6, 2e-6]),
+                                                                           return_sampler_state = True)
+        assert ne_fep.annealing_class.context is context, f"the annealing context should be reused between rounds"
     ne_fep._deactivate_annealing_workers()
 
     #3. call a dummy compute_sMC_free_energy with artificial values
@@ -160,6 +170,192 @@ def test_local_AIS():
                return_timer = True,
                rethermalize = False)
 
+    #test AIS that stops once the free energy uncertainty is below a target
+    ne_fep.AIS(num_particles = 10,
+               protocols = {'forward': np.linspace(0,1,9), 'reverse': np.linspace(1,0,9)},
+               num_integration_steps = 1,
+               target_uncertainty = 1e6)
+    for _direction in ['forward', 'reverse']:
+        assert ne_fep.online_free_energy[_direction].num_particles < 10, f"AIS should stop once the target uncertainty is reached"
+        assert np.isclose(ne_fep.online_free_energy[_direction].free_energy, ne_fep.dg_EXP[_direction][-1,0]), f"the online free energy does not match the EXP estimate"
+
+    try:
+        os.system(f"rm -r {trajectory_directory}")
+    except Exception as e:
+        print(e)
+
+def test_local_sMC():
+    """
+    test the sMC method with local annealing along a given protocol, with and without resampling
+    """
+    import random
+    ne_fep = sMC_setup()
+    num_particles, num_lambdas = 10, 9
+    protocols = {'forward': np.linspace(0,1,num_lambdas), 'reverse': np.linspace(1,0,num_lambdas)}
+    ne_fep.sMC(num_particles = num_particles,
+               protocols = protocols,
+               resample = {'criterion': 'ESS', 'method': 'multinomial', 'threshold': 0.5},
+               num_integration_steps = 1)
+
+    for _direction in ['forward', 'reverse']:
+        assert np.allclose(ne_fep.protocols[_direction], protocols[_direction]), f"the sMC protocol should be the given protocol"
+        assert ne_fep.cumulative_work[_direction].shape == (num_particles, num_lambdas), f"the cumulative works should be of shape (num_particles, num_lambdas)"
+        assert np.all(ne_fep.cumulative_work[_direction][:,0] == 0.), f"the cumulative works must start at 0"
+        assert len(ne_fep.sMC_observables[_direction]) == num_lambdas, f"there should be an observable per lambda"
+        assert ne_fep.particle_ancestries[_direction].shape == (num_lambdas - 1, num_particles), f"there should be a particle ancestry per resampling attempt"
+
+    #without resampling (and without propagation, so that the works only depend on the starting snapshots), the works match AIS
+    random.seed(2020)
+    ne_fep.AIS(num_particles = num_particles, protocols = protocols, num_integration_steps = 0)
+    AIS_cumulative_works = copy.deepcopy(ne_fep.cumulative_work)
+    random.seed(2020)
+    ne_fep.sMC(num_particles = num_particles, protocols = protocols, num_integration_steps = 0)
+    assert ne_fep.particle_ancestries is None
+    for _direction in ['forward', 'reverse']:
+        assert ne_fep.cumulative_work[_direction].shape == AIS_cumulative_works[_direction].shape
+        assert np.allclose(ne_fep.cumulative_work[_direction], AIS_cumulative_works[_direction], rtol = 1e-6, atol = 1e-4), f"the sMC and AIS works do not match"
+
+    try:
+        os.system(f"rm -r {trajectory_directory}")
+    except Exception as e:
+        print(e)
+
+def test_local_trailblaze_sMC():
+    """
+    test the sMC method with local annealing along a trailblazed protocol, and the multi-candidate binary search
+    """
+    ne_fep = sMC_setup()
+    num_particles = 10
+    ne_fep.sMC(num_particles = num_particles,
+               protocols = None,
+               trailblaze = {'criterion': 'CESS', 'threshold': 0.9, 'num_candidates': 3},
+               num_integration_steps = 1)
+
+    for _direction, (start, end) in zip(['forward', 'reverse'], [(0.0, 1.0), (1.0, 0.0)]):
+        protocol = np.array(ne_fep.protocols[_direction])
+        assert protocol[0] == start and protocol[-1] == end, f"the trailblazed {_direction} protocol must run from {start} to {end}"
+        assert np.all(np.diff(protocol) * (end - start) > 0), f"the trailblazed {_direction} protocol must be monotonic"
+        assert ne_fep.cumulative_work[_direction].shape == (num_particles, len(protocol)), f"the cumulative works should be of shape (num_particles, num_lambdas)"
+        assert len(ne_fep.sMC_observables[_direction]) == len(protocol), f"there should be an observable per lambda"
+
+    #searching with several candidates per round must find the same lambda (within the precision) as a bisection
+    sampler_states = np.array([ne_fep.pull_trajectory_snapshot(0) for _ in range(num_particles)])
+    precision_threshold = 1e-6
+    new_lambdas = [ne_fep.binary_search(sampler_states = sampler_states,
+                                        cumulative_works = np.zeros(num_particles),
+                                        start_val = 0.0,
+                                        end_val = 1.0,
+                                        observable = ne_fep.supported_observables['CESS'],
+                                        observable_threshold = 0.9,
+                                        precision_threshold = precision_threshold,
+                                        num_candidates = num_candidates)[0] for num_candidates in [1, 3]]
+    assert abs(new_lambdas[0] - new_lambdas[1]) <= precision_threshold, f"the binary searches found different lambdas: {new_lambdas}"
+
+    try:
+        os.system(f"rm -r {trajectory_directory}")
+    except Exception as e:
+        print(e)
+
+def test_local_asynchronous_sMC():
+    """
+    test the asynchronous sMC method with local annealing
+    """
+    ne_fep = sMC_setup()
+    ne_fep.asynchronous_sMC(num_particles = 10,
+                            protocols = {'forward': np.linspace(0,1,9), 'reverse': np.linspace(1,0,9)},
+                            resample = {'criterion': 'ESS', 'method': 'multinomial', 'threshold': 0.5},
+                            resample_interval = 2,
+                            segment_length = 1,
+                            num_integration_steps = 1,
+                            return_timer = True,
+                            rethermalize = False)
+
+    for _direction in ['forward', 'reverse']:
+        assert ne_fep.cumulative_work[_direction].shape == (10, 9), f"the cumulative works should be of shape (num_particles, num_lambdas)"
+        assert np.all(ne_fep.cumulative_work[_direction][:,0] == 0.), f"the cumulative works must start at 0"
+        assert len(ne_fep.sMC_observables[_direction]) == 3, f"there should be a resampling attempt at every other lambda increment (except the last)"
+        assert len(ne_fep.particle_ancestries[_direction]) == 4, f"there should be a particle ancestry per resampling attempt"
+        assert all(len(timers) == 8 for timers in ne_fep.sMC_timers[_direction]), f"each particle should be timed at every lambda increment"
+
+    try:
+        os.system(f"rm -r {trajectory_directory}")
+    except Exception as e:
+        print(e)
+
+def _resident_particle_keys():
+    """
+    return the keys of the sampler states that reside on the current annealing worker
+    """
+    return list(getattr(parallel.get_worker().annealing_class, 'particle_states', {}).keys())
+
+@skipIf(istravis, "Skip dask LocalCluster test on travis")
+def test_distributed_asynchronous_sMC():
+    """
+    test the asynchronous sMC method on a 2-worker dask LocalCluster with forced resampling: the works must match the non-resident path,
+    the ancestor generations must be deleted from the workers, and only the planned transfers may ship sampler states to a worker
+    """
+    import random
+    import perses.dispersed.smc as smc
+    ne_fep = sMC_setup()
+    num_particles = 10
+    kwargs = {'num_particles': num_particles,
+              'protocols': {'forward': np.linspace(0,1,9)},
+              'resample': {'criterion': 'ESS', 'method': 'multinomial', 'threshold': 1.0},
+              'resample_interval': 2,
+              'num_integration_steps': 0} #without propagation, the works only depend on the starting snapshots and the resampling
+    num_resamples = 3 #a resampling event at lambda indices 2, 4 and 6
+
+    #reference run with local (non-resident) annealing
+    random.seed(2020)
+    np.random.seed(2020)
+    ne_fep.asynchronous_sMC(**kwargs)
+    local_cumulative_works = copy.deepcopy(ne_fep.cumulative_work['forward'])
+    local_particle_ancestries = copy.deepcopy(ne_fep.particle_ancestries['forward'])
+
+    ne_fep.implement_parallelism(external_parallelism = None, internal_parallelism = {'library': ('dask', 'local'), 'num_processes': 2})
+
+    #record the planned transfers of every resampling event and the sampler states that are actually shipped to a worker
+    planned_transfers, shipped_states, resident_keys = [], [], {}
+    _assign_offspring_workers = smc.assign_offspring_workers
+    def recording_assign_offspring_workers(*args, **kwargs):
+        offspring_workers, transfers = _assign_offspring_workers(*args, **kwargs)
+        planned_transfers.append(np.sum(transfers))
+        return offspring_workers, transfers
+
+    _submit = ne_fep.parallelism.submit
+    def recording_submit(func, *arguments, workers = None):
+        if func is smc.call_anneal_resident_method and arguments[1][1] > 0 and arguments[2] is not None:
+            shipped_states.append(arguments[1])
+        return _submit(func, *arguments, workers = workers)
+
+    _deactivate_annealing_workers = ne_fep._deactivate_annealing_workers
+    def recording_deactivate_annealing_workers():
+        resident_keys.update(ne_fep.parallelism.client.run(_resident_particle_keys))
+        _deactivate_annealing_workers()
+
+    ne_fep.parallelism.submit = recording_submit
+    ne_fep._deactivate_annealing_workers = recording_deactivate_annealing_workers
+    smc.assign_offspring_workers = recording_assign_offspring_workers
+    try:
+        random.seed(2020)
+        np.random.seed(2020)
+        ne_fep.asynchronous_sMC(**kwargs)
+    finally:
+        smc.assign_offspring_workers = _assign_offspring_workers
+        del ne_fep._deactivate_annealing_workers
+
+    assert np.allclose(ne_fep.cumulative_work['forward'], local_cumulative_works, rtol = 1e-6, atol = 1e-4), f"the resident and non-resident works do not match"
+    assert np.all(ne_fep.particle_ancestries['forward'] == local_particle_ancestries), f"the resident and non-resident particle ancestries do not match"
+
+    assert len(resident_keys) == 2, f"there should be 2 workers"
+    all_keys = [key for keys in resident_keys.values() for key in keys]
+    for worker, keys in resident_keys.items():
+        assert all(tuple(key[:2]) == ('forward', num_resamples) for key in keys), f"worker {worker} still holds sampler states of an ancestor generation: {keys}"
+    assert sorted(key[2] for key in all_keys) == list(range(num_particles)), f"every particle of the last generation should reside on exactly one worker"
+
+    assert len(planned_transfers) == num_resamples
+    assert len(shipped_states) == sum(planned_transfers), f"{len(shipped_states)} sampler states were shipped, but {sum(planned_transfers)} transfers were planned"
+
     try:
         os.system(f"rm -r {trajectory_directory}")
     except Exception as e:
@@ -204,6 +400,53 @@ def test_multinomial_resample():
     assert set(resampled_indices).issubset(set(np.arange(10))), f"the resampled indices can only be a subset of the resampled works"
     assert len(resampled_works) == num_resamples, f"there have to be the {num_resamples} resampled works"
 
+def test_low_variance_resamplers():
+    """
+    test the systematic, stratified, and residual resamplers
+    """
+    total_works = np.random.rand(10)
+    num_resamples = 10
+    expected_counts = num_resamples * np.exp(-total_works - logsumexp(-total_works))
+    for resampler in [systematic_resample, stratified_resample, residual_resample]:
+        resampled_works, resampled_indices = resampler(total_works, num_resamples)
+        assert all(_val == np.average(total_works) for _val in resampled_works), f"the returned resampled works are not a uniform average"
+        assert set(resampled_indices).issubset(set(np.arange(10))), f"the resampled indices can only be a subset of the resampled works"
+        assert len(resampled_indices) == num_resamples and len(resampled_works) == num_resamples, f"there have to be the {num_resamples} resampled works"
+        counts = np.bincount(resampled_indices, minlength = 10)
+        if resampler != stratified_resample:
+            #systematic and residual resampling keep at least floor(N * w_i) copies of every particle
+            assert np.all(counts >= np.floor(expected_counts)), f"{resampler.__name__} does not keep floor(N * w_i) copies of every particle"
+        if resampler == systematic_resample:
+            assert np.all(counts <= np.ceil(expected_counts)), f"systematic resampling cannot keep more than ceil(N * w_i) copies of every particle"
+
+    #a degenerate weight is resampled by all particles
+    degenerate_works = np.array([0.] + [1e4] * 9)
+    for resampler in [systematic_resample, stratified_resample, residual_resample]:
+        resampled_works, resampled_indices = resampler(degenerate_works, num_resamples)
+        assert np.all(resampled_indices == 0)
+
+def test_assign_offspring_workers():
+    """
+    test that resampled particles stay on the worker of their ancestor unless load balancing requires a transfer
+    """
+    ancestor_workers = ['a'] * 3 + ['b'] * 3
+    #every ancestor survives once: nothing moves
+    offspring_workers, transfers = assign_offspring_workers(np.arange(6), ancestor_workers)
+    assert offspring_workers == ancestor_workers and not np.any(transfers)
+
+    #all offspring descend from one ancestor on worker 'a': only the surplus is moved to worker 'b'
+    offspring_workers, transfers = assign_offspring_workers(np.zeros(6, dtype = int), ancestor_workers)
+    assert offspring_workers.count('a') == 3 and offspring_workers.count('b') == 3
+    assert np.sum(transfers) == 3
+
+    #offspring of a worker's ancestors stay on that worker as long as it is not over capacity
+    offspring_workers, transfers = assign_offspring_workers(np.array([0, 0, 1, 3, 3, 5]), ancestor_workers)
+    assert offspring_workers == ancestor_workers and not np.any(transfers)
+
+    #workers without ancestors take over the surplus
+    offspring_workers, transfers = assign_offspring_workers(np.zeros(6, dtype = int), ancestor_workers, workers = ['a', 'b', 'c'])
+    assert all(offspring_workers.count(worker) == 2 for worker in ['a', 'b', 'c']) and np.sum(transfers) == 4
+
 def test_ESS():
     """
     test the effective sample size computation
@@ -220,6 +463,98 @@ def test_CESS():
     dummy_prev_works, dummy_works_incremental = np.random.rand(10), np.random.rand(10)
     _CESS = CESS(dummy_prev_works, dummy_works_incremental)
 
+def test_vectorized_observables():
+    """
+    test that the ESS and CESS of several candidate incremental works are computed at once
+    """
+    dummy_prev_works, dummy_works_incremental = np.random.rand(10), np.random.rand(5, 10)
+    for observable in [ESS, CESS]:
+        vectorized = observable(dummy_prev_works, dummy_works_incremental)
+        assert vectorized.shape == (5,), f"one observable per candidate should be returned"
+        assert np.allclose(vectorized, [observable(dummy_prev_works, works) for works in dummy_works_incremental]), f"the vectorized {observable.__name__} does not match the serial {observable.__name__}"
+    assert np.isclose(ESS(dummy_prev_works, np.zeros(10)), np.exp(2 * logsumexp(-dummy_prev_works) - logsumexp(-2 * dummy_prev_works)) / 10)
+    assert np.isclose(CESS(dummy_prev_works, np.zeros(10)), 1.)
+
+def test_online_free_energy_estimator():
+    """
+    test the streaming free energy estimator against pymbar.EXP
+    """
+    incremental_works = np.random.rand(5, 20)
+    for uncertainty_method in OnlineFreeEnergyEstimator.supported_uncertainty_methods:
+        estimator = OnlineFreeEnergyEstimator(num_particles = 20, uncertainty_method = uncertainty_method)
+        for works in incremental_works:
+            estimator.update(works)
+        assert len(estimator.free_energies) == 5 and len(estimator.uncertainties) == 5
+        assert np.isclose(estimator.free_energy, pymbar.EXP(np.sum(incremental_works, axis = 0))[0]), f"the online free energy does not match EXP"
+        assert estimator.uncertainty > 0. and 0. < estimator.effective_sample_size <= 1.
+        assert estimator.converged(np.inf) and not estimator.converged(0.)
+
+    #particles streamed one at a time give the same estimate
+    total_works = np.sum(incremental_works, axis = 0)
+    estimator = OnlineFreeEnergyEstimator()
+    for work in total_works:
+        estimator.add_particles(work)
+    assert np.isclose(estimator.free_energy, pymbar.EXP(total_works)[0])
+
+    #the jackknife uncertainty of the sample mean of exp(-w) agrees with the EXP uncertainty (delta method)
+    assert np.isclose(estimator.uncertainty, pymbar.EXP(total_works)[1], rtol = 0.25)
+
+    #resampling folds the segment into the accumulated free energy
+    estimator = OnlineFreeEnergyEstimator(num_particles = 20)
+    estimator.update(incremental_works[0])
+    estimator.resample()
+    estimator.update(incremental_works[1])
+    expected = -(logsumexp(-incremental_works[0]) + logsumexp(-incremental_works[1]) - 2 * np.log(20))
+    assert np.isclose(estimator.free_energy, expected)
+    assert np.isclose(estimator.effective_sample_size, ESS(np.zeros(20), incremental_works[1]))
+
+    #jackknife replicas are not carried across resampling (particle indices lose their meaning); bootstrap replicas are used thereafter
+    assert estimator._replica_method == 'bootstrap'
+    assert np.isfinite(estimator.uncertainty) and estimator.uncertainty > 0.
+    estimator.resample(num_particles = 10)
+    estimator.update(incremental_works[2][:10])
+    assert np.isfinite(estimator.uncertainty) and estimator.uncertainty > 0.
+
+def test_vectorized_EXP():
+    """
+    test that the vectorized EXP matches pymbar.EXP on every column
+    """
+    cumulative_works = np.cumsum(np.random.rand(10, 6), axis = 1)
+    free_energies = vectorized_EXP(cumulative_works)
+    assert free_energies.shape == (6, 2)
+    assert np.allclose(free_energies, [pymbar.EXP(cumulative_works[:,i]) for i in range(6)])
+
+def test_snapshot_store():
+    """
+    test the ring buffer of equilibrium snapshots, in memory and memory-mapped
+    """
+    positions, box_vectors = np.random.rand(5, 4, 3), np.array([np.eye(3) * 2.] * 5)
+    for filename in [None, os.path.join(trajectory_directory, 'snapshots.npy')]:
+        store = SnapshotStore(capacity = 3, filename = filename)
+        store.extend(range(5), positions, box_vectors)
+        assert len(store) == 3 and set(store.keys()) == {2, 3, 4}, f"the oldest snapshots should be overwritten"
+        sampler_state = store[3]
+        assert np.allclose(sampler_state.positions.value_in_unit(unit.nanometers), positions[3])
+        assert np.allclose(np.array(sampler_state.box_vectors.value_in_unit(unit.nanometers)), box_vectors[3])
+
+        #keys can be (particle, lambda index) tuples, and snapshots without box vectors are supported
+        store.add((0, 1), positions[0])
+        assert (0, 1) in store and 2 not in store
+        assert store[(0, 1)].box_vectors is None
+
+        #retaining a subset of the snapshots (e.g. the decorrelated ones) can grow the buffer so that none of them is evicted
+        store.retain([3, 4, (0, 1), 7], capacity = 4)
+        assert store.capacity == 4 and set(store.keys()) == {3, 4, (0, 1)}
+        assert np.allclose(store[3].positions.value_in_unit(unit.nanometers), positions[3]) and store[(0, 1)].box_vectors is None
+        store.extend(range(5, 7), positions[:2], box_vectors[:2])
+        assert set(store.keys()) == {4, (0, 1), 5, 6}
+    if filename is not None:
+        assert os.path.exists(filename)
+    try:
+        os.system(f"rm -r {trajectory_directory}")
+    except Exception as e:
+        print(e)
+
 def test_compute_timeseries():
     """
     test the compute_timeseries function
@@ -265,5 +600,59 @@ def test_create_endstates():
     one_endstate.set_alchemical_parameters(1.0, lambda_protocol)
     new_endstates = create_endstates(zero_endstate, one_endstate)
 
+def test_compute_reduced_potentials_at_lambdas():
+    """
+    test that the force-group decomposed multi-lambda reduced potentials match per-lambda evaluations
+    """
+    from pkg_resources import resource_filename
+    smiles_filename = resource_filename("perses", os.path.join("data", "test.smi"))
+    fe_setup = RelativeFEPSetup(ligand_input = smiles_filename,
+                                old_ligand_index = 0,
+                                new_ligand_index = 1,
+                                forcefield_files = [],
+                                small_molecule_forcefield = 'gaff-2.11',
+                                phases = ['vacuum'])
+    hybrid_factory = HybridTopologyFactory(topology_proposal = fe_setup._vacuum_topology_proposal,
+                                           current_positions = fe_setup._vacuum_positions_old,
+                                           new_positions = fe_setup._vacuum_positions_new,
+                                           neglected_new_angle_terms = fe_setup._vacuum_forward_neglected_angles,
+                                           neglected_old_angle_terms = fe_setup._vacuum_reverse_neglected_angles,
+                                           softcore_LJ_v2 = True,
+                                           interpolate_old_and_new_14s = False)
+    #put every force in its own group
+    for group, force in enumerate(hybrid_factory.hybrid_system.getForces()):
+        force.setForceGroup(group)
+
+    lambda_protocol = LambdaProtocol(functions = 'quarters')
+    lambda_alchemical_state = RelativeAlchemicalState.from_system(hybrid_factory.hybrid_system)
+    lambda_alchemical_state.set_alchemical_parameters(0.0, lambda_protocol)
+    thermodynamic_state = CompoundThermodynamicState(ThermodynamicState(hybrid_factory.hybrid_system, temperature = temperature),composable_states = [lambda_alchemical_state])
+    sampler_state = SamplerState(hybrid_factory.hybrid_positions)
+
+    global_lambdas = np.linspace(0., 1., 13)
+    reduced_potentials = compute_reduced_potentials_at_lambdas(thermodynamic_state, sampler_state, global_lambdas, lambda_protocol)
+    for global_lambda, reduced_potential in zip(global_lambdas, reduced_potentials):
+        thermodynamic_state.set_alchemical_parameters(global_lambda, lambda_protocol)
+        assert abs(reduced_potential - compute_reduced_potential(thermodynamic_state, sampler_state)) < 1e-6
+
+    #a batch of configurations (as an array) is evaluated with one context
+    positions = hybrid_factory.hybrid_positions.value_in_unit(unit.nanometer)
+    configurations = np.array([positions, positions + 0.01 * np.random.randn(*np.shape(positions))])
+    reduced_potential_matrix = compute_reduced_potential_matrix(thermodynamic_state, configurations, global_lambdas, lambda_protocol)
+    assert reduced_potential_matrix.shape == (2, len(global_lambdas))
+    assert np.allclose(reduced_potential_matrix[0], reduced_potentials, atol = 1e-6)
+    perturbed_sampler_state = SamplerState(configurations[1] * unit.nanometer)
+    assert np.allclose(reduced_potential_matrix[1], compute_reduced_potentials_at_lambdas(thermodynamic_state, perturbed_sampler_state, global_lambdas, lambda_protocol), atol = 1e-6)
+
+def test_multiple_time_step_splitting():
+    """
+    test the multiple time step splitting strings
+    """
+    assert multiple_time_step_splitting(0, 1, inner_steps = 1) == 'V1 V0 R O R V0 V1'
+    assert multiple_time_step_splitting(1, 0, inner_steps = 2, alchemical_update = True) == 'V0 V1 R R V1 O H V1 R R V1 V0'
+    splitting = multiple_time_step_splitting(0, 1, inner_steps = 4).split()
+    assert splitting.count('R') == 8 and splitting.count('V0') == 8 and splitting.count('V1') == 2 and splitting.count('O') == 1
+    assert splitting == splitting[::-1] #symmetric
+
 if __name__ == '__main__':
     test_local_AIS()
@@ -133,6 +133,34 @@ def test_write_object():
         assert ('iteration' in obj)
         assert (obj['iteration'] == iteration)
 
+def test_write_configuration_compressed():
+    """Test that configurations written with zlib compression and quantization are read back to the requested precision.
+    """
+    import mdtraj as md
+    from openmmtools import testsystems
+    testsystem = testsystems.AlanineDipeptideVacuum()
+    topology = md.Topology.from_openmm(testsystem.topology)
+    natoms = topology.n_atoms
+
+    tmpfile = tempfile.NamedTemporaryFile()
+    storage = NetCDFStorage(tmpfile.name, mode='w')
+    view = NetCDFStorageView(storage, 'envname', 'modname')
+
+    nframes = 5
+    frames = [np.random.uniform(-20.0, 20.0, size=(natoms, 3)) for frame in range(nframes)]
+    for frame, positions in enumerate(frames):
+        view.write_configuration('positions', unit.Quantity(positions, unit.angstroms), topology, iteration=0, frame=frame, nframes=nframes,
+                                 zlib=True, least_significant_digit=3)
+    storage.sync()
+
+    variable = storage._ncfile['/envname/modname/positions_0']
+    assert variable.filters()['zlib']
+    assert variable.shape == (nframes, natoms, 3)
+    assert np.allclose(variable[:], np.array(frames), rtol=0.0, atol=1e-3)
+    stored_topology = storage.get_object('envname', 'modname', 'positions_0_topology_0', iteration=0)
+    assert stored_topology.n_atoms == natoms
+    storage.close()
+
 def run_sampler(sampler, niterations):
     sampler.run(niterations)
 